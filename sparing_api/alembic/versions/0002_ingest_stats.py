@@ -0,0 +1,25 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0002_ingest_stats'
+down_revision = '0001_initial'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('ingest_stats',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('bucket', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('source', sa.String(32), nullable=False),
+        sa.Column('status', sa.String(16), nullable=False),
+        sa.Column('site_id', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('count', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('sample_errors', sa.JSON(), nullable=True),
+        sa.UniqueConstraint('bucket', 'source', 'status', 'site_id', name='uq_ingest_stats_key'),
+    )
+    op.create_index('ix_ingest_stats_bucket', 'ingest_stats', ['bucket'])
+
+def downgrade():
+    op.drop_index('ix_ingest_stats_bucket', table_name='ingest_stats')
+    op.drop_table('ingest_stats')
@@ -0,0 +1,27 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0003_sensor_rollups'
+down_revision = '0002_ingest_stats'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('sensor_rollups',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('site_id', sa.Integer(), nullable=False),
+        sa.Column('granularity', sa.String(4), nullable=False),
+        sa.Column('param', sa.String(32), nullable=False),
+        sa.Column('bucket', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('device_id', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('count', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('sum', sa.Double(), nullable=False, server_default=sa.text('0')),
+        sa.Column('min', sa.Double(), nullable=True),
+        sa.Column('max', sa.Double(), nullable=True),
+        sa.Column('sumsq', sa.Double(), nullable=False, server_default=sa.text('0')),
+        sa.UniqueConstraint('site_id', 'granularity', 'param', 'bucket', 'device_id', name='uq_sensor_rollups_key'),
+    )
+
+def downgrade():
+    op.drop_table('sensor_rollups')
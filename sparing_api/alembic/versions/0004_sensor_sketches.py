@@ -0,0 +1,22 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0004_sensor_sketches'
+down_revision = '0003_sensor_rollups'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('sensor_sketches',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('site_id', sa.Integer(), nullable=False),
+        sa.Column('param', sa.String(32), nullable=False),
+        sa.Column('day', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('digest', sa.JSON(), nullable=False),
+        sa.UniqueConstraint('site_id', 'param', 'day', name='uq_sensor_sketches_key'),
+    )
+
+def downgrade():
+    op.drop_table('sensor_sketches')
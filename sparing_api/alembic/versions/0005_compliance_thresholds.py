@@ -0,0 +1,22 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0005_compliance_thresholds'
+down_revision = '0004_sensor_sketches'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('compliance_thresholds',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('site_id', sa.Integer(), sa.ForeignKey('sites.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('param', sa.String(32), nullable=False),
+        sa.Column('min_value', sa.Float(), nullable=True),
+        sa.Column('max_value', sa.Float(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.UniqueConstraint('site_id', 'param', name='uq_compliance_thresholds_key'),
+    )
+
+def downgrade():
+    op.drop_table('compliance_thresholds')
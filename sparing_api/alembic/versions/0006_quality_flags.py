@@ -0,0 +1,25 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0006_quality_flags'
+down_revision = '0005_compliance_thresholds'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('quality_flags',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('site_id', sa.Integer(), nullable=False),
+        sa.Column('device_id', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('param', sa.String(32), nullable=False),
+        sa.Column('kind', sa.String(16), nullable=False),
+        sa.Column('ts', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('value', sa.Float(), nullable=True),
+        sa.Column('detail', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.UniqueConstraint('site_id', 'ts', 'device_id', 'param', 'kind', name='uq_quality_flags_key'),
+    )
+
+def downgrade():
+    op.drop_table('quality_flags')
@@ -1,11 +1,14 @@
 # AFTER
-from fastapi import Depends, HTTPException, status, Security
+from fastapi import Depends, Header, HTTPException, Query, status, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from typing import Optional, List
+from dataclasses import dataclass
 
 from app.core.db import get_db
+from app.core.auth_cache import revoked_tokens, user_cache
+from app.core.api_keys import api_key_cache, INGEST_SCOPE
 from app.core.security import decode_jwt
 from app.models.models import User, ViewerSite, Site, AuthTokenBlacklist
 
@@ -24,21 +27,67 @@ async def get_current_user(
 ) -> User:
     payload = decode_jwt(token)
     jti = payload.get("jti")
-    # blacklist check
-    res = await db.execute(select(AuthTokenBlacklist).where(AuthTokenBlacklist.jti == jti))
-    if res.scalar_one_or_none():
+    # blacklist check (in memory once the revoked set has been loaded)
+    if revoked_tokens.is_revoked(jti):
         raise HTTPException(status_code=401, detail="Token revoked")
+    if not revoked_tokens.loaded:
+        res = await db.execute(select(AuthTokenBlacklist).where(AuthTokenBlacklist.jti == jti))
+        if res.scalar_one_or_none():
+            raise HTTPException(status_code=401, detail="Token revoked")
 
     uid = payload.get("user_id")
-    res = await db.execute(select(User).where(User.id == uid, User.is_active == True))
-    user = res.scalar_one_or_none()
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
+    user = user_cache.get(uid)
+    if user is None:
+        res = await db.execute(select(User).where(User.id == uid, User.is_active == True))
+        found = res.scalar_one_or_none()
+        if not found:
+            raise HTTPException(status_code=401, detail="User not found")
+        user_cache.put(found)
+        user = user_cache.get(uid)
 
     user._site_uids = payload.get("site_uids", [])
     user._role = payload.get("role", "viewer")
     return user
 
+async def get_stream_user(
+    token: str | None = Query(None, description="Access token, for EventSource clients that cannot set headers"),
+    creds: HTTPAuthorizationCredentials = Security(bearer_scheme),
+    db: AsyncSession = Depends(get_db),
+) -> User:
+    """get_current_user that also accepts the token as a query parameter."""
+    if creds:
+        token = creds.credentials
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    return await get_current_user(token, db)
+
+@dataclass
+class IngestPrincipal:
+    """Who is writing readings: a user JWT or a device API key."""
+    actor: str                   # "user:<id>" or "key:<id>"
+    role: str                    # user role, or "device" for API keys
+    site_uid: str | None = None  # API keys bound to a site may only write to it
+
+    def can_write(self, site_uid: str) -> bool:
+        return self.role != "viewer" and (self.site_uid is None or self.site_uid == site_uid)
+
+async def get_ingest_principal(
+    api_key: str | None = Header(default=None, alias="X-API-Key"),
+    creds: HTTPAuthorizationCredentials = Security(bearer_scheme),
+    db: AsyncSession = Depends(get_db),
+) -> IngestPrincipal:
+    if api_key:
+        entry = await api_key_cache.lookup(db, api_key)
+        if entry is None:
+            raise HTTPException(status_code=401, detail="Invalid API key")
+        if not entry.allows(INGEST_SCOPE):
+            raise HTTPException(status_code=403, detail="API key lacks ingest scope")
+        return IngestPrincipal(actor=f"key:{entry.id}", role="device", site_uid=entry.site_uid)
+    if not creds:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    user = await get_current_user(creds.credentials, db)
+    return IngestPrincipal(actor=f"user:{user.id}", role=user._role)
+
 def require_roles(*roles: str):
     async def _dep(user: User = Depends(get_current_user)):
         if user._role not in roles:
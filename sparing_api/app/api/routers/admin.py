@@ -1,9 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.core.db import get_db
+from app.core.registry import site_registry
+from app.core.auth_cache import user_cache
+from app.core.api_keys import api_key_cache, generate_api_key, parse_scopes, INGEST_SCOPE
 from app.api.deps import get_current_user, require_roles
-from app.models.models import User, Site, ViewerSite
+from app.models.models import User, Site, ViewerSite, ApiKey
+from app.services.ingest_stats import site_ingest_summary
+from app.core.cache import cache
 
 router = APIRouter()
 
@@ -77,7 +82,7 @@ async def list_users(db: AsyncSession = Depends(get_db)):
 @router.post("/users", dependencies=[Depends(require_roles("admin"))])
 async def create_user(payload: dict, db: AsyncSession = Depends(get_db)):
     # payload: name, email, password, role
-    from app.core.security import hash_password
+    from app.core.security import hash_password_async
     name = payload.get("name", "")
     email = payload["email"]
     password = payload["password"]
@@ -87,7 +92,7 @@ async def create_user(payload: dict, db: AsyncSession = Depends(get_db)):
     existing_user = (await db.execute(select(User).where(User.email==email))).scalar_one_or_none()
     if existing_user:
         raise HTTPException(400, "Email already exists")
-    hashed_password = hash_password(password)
+    hashed_password = await hash_password_async(password)
     new_user = User(name=name, email=email, password_hash=hashed_password, role=role)
     db.add(new_user)
     await db.commit()
@@ -97,7 +102,7 @@ async def create_user(payload: dict, db: AsyncSession = Depends(get_db)):
 @router.patch("/users/{user_id}", dependencies=[Depends(require_roles("admin"))])
 async def update_user(user_id: int, payload: dict, db: AsyncSession = Depends(get_db)):
     # payload: name (optional), email (optional), password (optional), role (optional)
-    from app.core.security import hash_password
+    from app.core.security import hash_password_async
     u = (await db.execute(select(User).where(User.id==user_id))).scalar_one_or_none()
     if not u:
         raise HTTPException(404, "User not found")
@@ -106,7 +111,7 @@ async def update_user(user_id: int, payload: dict, db: AsyncSession = Depends(ge
     if "email" in payload:
         u.email = payload["email"]
     if "password" in payload:
-        u.password_hash = hash_password(payload["password"])
+        u.password_hash = await hash_password_async(payload["password"])
     if "role" in payload:
         role = payload["role"]
         if role not in ["admin", "operator", "viewer"]:
@@ -115,6 +120,7 @@ async def update_user(user_id: int, payload: dict, db: AsyncSession = Depends(ge
     db.add(u)
     await db.commit()
     await db.refresh(u)
+    user_cache.invalidate(u.id)
     return {"id": u.id, "name": u.name, "email": u.email, "role": u.role}
 
 @router.delete("/users/{user_id}", dependencies=[Depends(require_roles("admin"))])
@@ -124,7 +130,70 @@ async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(404, "User not found")
     await db.delete(u)
     await db.commit()
+    user_cache.invalidate(user_id)
     return {"ok": True}
-    
 
 
+@router.get("/ingest-stats", dependencies=[Depends(require_roles("admin", "operator"))])
+async def ingest_stats(
+    hours: int = Query(24, ge=1, le=24*90),
+    site_uid: str | None = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Ingest rate and error rate per site over the last `hours`, from per-minute aggregates."""
+    site_id = None
+    if site_uid:
+        s = await site_registry.resolve(db, site_uid)
+        if not s:
+            raise HTTPException(404, "Site not found")
+        site_id = s.id
+    return {"hours": hours, "sites": await site_ingest_summary(db, hours, site_id)}
+
+
+@router.get("/cache", dependencies=[Depends(require_roles("admin"))])
+async def cache_stats():
+    """Backend, size and this worker's hit/miss counts of the response cache."""
+    return await cache.stats()
+
+
+@router.post("/api-keys", dependencies=[Depends(require_roles("admin"))])
+async def create_api_key(payload: dict, db: AsyncSession = Depends(get_db)):
+    # payload: name, site_uid (optional, binds the key to one site), scopes (optional, default "ingest")
+    name = payload.get("name") or "device"
+    site_id, site_uid = None, payload.get("site_uid")
+    if site_uid:
+        s = await site_registry.resolve(db, site_uid)
+        if not s:
+            raise HTTPException(400, "Invalid site_uid")
+        site_id = s.id
+    scopes = payload.get("scopes", INGEST_SCOPE)
+    key, token_hash = generate_api_key()
+    k = ApiKey(site_id=site_id, name=name, token_hash=token_hash, scopes=scopes, is_active=True)
+    db.add(k)
+    await db.commit()
+    await db.refresh(k)
+    # The plaintext key is only ever returned here
+    return {"id": k.id, "name": k.name, "site_uid": site_uid, "scopes": k.scopes, "api_key": key}
+
+@router.get("/api-keys", dependencies=[Depends(require_roles("admin"))])
+async def list_api_keys(db: AsyncSession = Depends(get_db)):
+    result = await db.execute(
+        select(ApiKey, Site.uid).outerjoin(Site, Site.id == ApiKey.site_id).order_by(ApiKey.id.desc())
+    )
+    return {"api_keys": [
+        {
+            "id": k.id, "name": k.name, "site_uid": uid,
+            "scopes": None if k.scopes is None else sorted(parse_scopes(k.scopes)), "is_active": k.is_active, "created_at": k.created_at,
+        }
+        for k, uid in result.all()
+    ]}
+
+@router.delete("/api-keys/{key_id}", dependencies=[Depends(require_roles("admin"))])
+async def revoke_api_key(key_id: int, db: AsyncSession = Depends(get_db)):
+    k = (await db.execute(select(ApiKey).where(ApiKey.id==key_id))).scalar_one_or_none()
+    if not k:
+        raise HTTPException(404, "API key not found")
+    k.is_active = False
+    await db.commit()
+    api_key_cache.revoke(key_id)
+    return {"ok": True}
@@ -2,10 +2,11 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, delete
 from app.core.db import get_db
-from app.core.security import hash_password, verify_password, create_jwt, decode_jwt
+from app.core.security import hash_password_async, verify_password_async, create_jwt, decode_jwt
 from app.models.models import User, ViewerSite, Site, AuthTokenBlacklist
 from app.schemas.auth import LoginIn, TokenOut, UserOut
 from app.api.deps import get_current_user, get_current_token, require_roles
+from app.core.auth_cache import revoked_tokens
 from datetime import datetime, timezone
 
 router = APIRouter()
@@ -16,7 +17,7 @@ async def login(data: LoginIn, db: AsyncSession = Depends(get_db)):
     """Authenticate user and return JWT tokens."""
     res = await db.execute(select(User).where(User.email == data.email))
     user = res.scalar_one_or_none()
-    if not user or not verify_password(data.password, user.password_hash):
+    if not user or not await verify_password_async(data.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     site_uids = []
@@ -69,7 +70,7 @@ async def register_user(payload: dict, db: AsyncSession = Depends(get_db)):
         name=payload["name"],
         email=payload["email"],
         role=payload["role"],
-        password_hash=hash_password(payload["password"])
+        password_hash=await hash_password_async(payload["password"])
     )
     db.add(u)
     await db.commit()
@@ -126,6 +127,7 @@ async def logout(
                 reason="logout"
             ))
             await db.commit()
+            revoked_tokens.add(jti, exp)
         
         return {"ok": True}
     except Exception as e:
@@ -0,0 +1,132 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from app.core.db import get_db, SessionLocal
+from app.core.registry import site_registry
+from app.api.deps import get_viewer_site_uids, require_roles
+from app.core.cache import cache, cache_key, site_tag, CACHE_TTL_METRICS, CACHE_STALE_METRICS
+from app.core.latest import latest_readings
+from app.schemas.compliance import ThresholdsIn
+from app.services.compliance import Limit, load_profile, save_profile, site_compliance
+from app.utils.conditional import make_etag, check_conditional
+from app.utils.time import to_utc
+
+router = APIRouter()
+
+# Longest range evaluated in one request
+MAX_RANGE = timedelta(days=366)
+
+
+async def _site(db: AsyncSession, uid: str, viewer_uids: list[str]):
+    site = await site_registry.resolve(db, uid)
+    if not site:
+        raise HTTPException(404, "Site not found")
+    if viewer_uids and uid not in viewer_uids:
+        raise HTTPException(403, "Forbidden")
+    return site
+
+
+def _profile_out(uid: str, limits: dict[str, Limit], is_default: bool) -> dict:
+    return {
+        "site_uid": uid,
+        "default": is_default,
+        "thresholds": {p: limit.to_dict() for p, limit in limits.items()},
+    }
+
+
+@router.get("/sites/{uid}/compliance")
+async def site_compliance_report(
+    request: Request,
+    response: Response,
+    uid: str,
+    date_from: Optional[datetime] = Query(None, description="Start date (default: today)"),
+    date_to: Optional[datetime] = Query(None, description="End date, exclusive (default: now)"),
+    db: AsyncSession = Depends(get_db),
+    viewer_uids: list[str] = Depends(get_viewer_site_uids)
+):
+    """
+    Evaluate a site's readings against its compliance thresholds: per
+    parameter, the exceeding readings and episodes, time in exceedance,
+    percent compliant and the worst excursion.
+    """
+    site = await _site(db, uid, viewer_uids)
+
+    now = datetime.now(timezone.utc)
+    open_ended = date_to is None
+    if date_from is None:
+        date_from = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
+    if date_to is None:
+        date_to = now
+    if to_utc(date_to) <= to_utc(date_from):
+        raise HTTPException(400, "date_to must be after date_from")
+    if to_utc(date_to) - to_utc(date_from) > MAX_RANGE:
+        raise HTTPException(400, f"Range exceeds {MAX_RANGE.days} days")
+
+    # New readings bump the data version and threshold changes the meta version
+    version = await latest_readings.load_version(db, site.id)
+    if version:
+        etag = make_etag(
+            "compliance", site.id, version[0], latest_readings.meta_version(), to_utc(date_from).isoformat(),
+            None if open_ended else to_utc(date_to).isoformat(),
+        )
+        not_modified = check_conditional(request, response, etag)
+        if not_modified:
+            return not_modified
+
+    limits, is_default = await load_profile(db, site.id)
+    profile = sorted((p, limit.min, limit.max) for p, limit in limits.items())
+    # "now" is part of no key: an open-ended report is reused until the data version changes
+    cache_key_str = cache_key(
+        "compliance", uid, version[0] if version else None, date_from.isoformat(),
+        "open" if open_ended else date_to.isoformat(), repr(profile),
+    )
+    return await cache.get_or_compute(
+        cache_key_str, lambda: _report(uid, site.id, date_from, date_to, limits, is_default),
+        CACHE_TTL_METRICS, tags=(site_tag(site.id),), stale_seconds=CACHE_STALE_METRICS,
+    )
+
+
+async def _report(
+    uid: str, site_id: int, date_from: datetime, date_to: datetime, limits: dict[str, Limit], is_default: bool,
+) -> dict:
+    async with SessionLocal() as db:
+        params = await site_compliance(db, site_id, date_from, date_to, limits)
+    return {
+        "site_uid": uid,
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "default_thresholds": is_default,
+        "compliant": all(p["exceedances"] == 0 for p in params.values()),
+        "parameters": params,
+    }
+
+
+@router.get("/sites/{uid}/compliance/thresholds")
+async def get_thresholds(
+    uid: str,
+    db: AsyncSession = Depends(get_db),
+    viewer_uids: list[str] = Depends(get_viewer_site_uids)
+):
+    """Get the thresholds a site is evaluated against."""
+    site = await _site(db, uid, viewer_uids)
+    return _profile_out(uid, *await load_profile(db, site.id))
+
+
+@router.put("/sites/{uid}/compliance/thresholds", dependencies=[Depends(require_roles("admin", "operator"))])
+async def put_thresholds(uid: str, payload: ThresholdsIn, db: AsyncSession = Depends(get_db)):
+    """Replace a site's thresholds. Parameters left out are not evaluated."""
+    site = await _site(db, uid, [])
+    limits = {p: Limit(t.min, t.max) for p, t in sorted(payload.thresholds.items())}
+    await save_profile(db, site.id, limits)
+    latest_readings.bump_meta()
+    return _profile_out(uid, limits, False)
+
+
+@router.delete("/sites/{uid}/compliance/thresholds", dependencies=[Depends(require_roles("admin", "operator"))])
+async def delete_thresholds(uid: str, db: AsyncSession = Depends(get_db)):
+    """Revert a site to the default thresholds."""
+    site = await _site(db, uid, [])
+    await save_profile(db, site.id, None)
+    latest_readings.bump_meta()
+    return _profile_out(uid, *await load_profile(db, site.id))
@@ -1,16 +1,57 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_
+from sqlalchemy import select, func, and_, or_
+import csv
+import io
 from datetime import datetime
+import orjson
 from typing import List
-from app.core.db import get_db
+from app.core.cache import cache, cache_key, site_tag, CACHE_TTL_COUNT, CACHE_TTL_SITE_COUNT
+from app.core.db import get_db, estimate_rows, SessionLocal
+from app.core.registry import site_registry
+from app.core.latest import latest_readings, READING_KEYS
 from app.api.deps import get_current_user, get_viewer_site_uids
-from app.models.models import Site, SensorData, SensorDevice
+from app.models.models import Site, SensorData, SensorDevice, SENSOR_FIELDS
 from app.schemas.common import Page
-from app.schemas.data import DataOut
+from app.utils.pagination import encode_cursor, decode_cursor
+from app.utils.conditional import make_etag, check_conditional
 
 router = APIRouter()
 
+COUNT_MODES = ("exact", "estimate", "none")
+# Always returned by /data, whatever `fields` asks for
+BASE_COLUMNS = ("id", "site_id", "device_id", "ts")
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+EXPORT_CHUNK_ROWS = 2000
+
+
+def _columns(fields: str | None) -> list[str]:
+    """BASE_COLUMNS plus the reading columns named in `fields` (all if omitted)."""
+    if not fields:
+        return [*BASE_COLUMNS, *SENSOR_FIELDS]
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    return [*BASE_COLUMNS, *(f for f in SENSOR_FIELDS if f in requested)]
+
+
+async def _count(db: AsyncSession, filters: list, mode: str, key: str, site_id: int | None) -> int | None:
+    """Total for the filtered range: exact (cached briefly), index estimate, or None."""
+    if mode == "none":
+        return None
+    if mode == "estimate":
+        est = await estimate_rows(db, select(SensorData.id).where(*filters))
+        if est is not None:
+            return est
+
+    async def exact() -> int:
+        async with SessionLocal() as session:
+            return (await session.execute(select(func.count(SensorData.id)).where(*filters))).scalar_one()
+
+    if site_id is None:
+        return await cache.get_or_compute(key, exact, CACHE_TTL_COUNT)
+    return await cache.get_or_compute(key, exact, CACHE_TTL_SITE_COUNT, tags=(site_tag(site_id),))
+
+
 @router.get("", response_model=Page)
 async def list_data(
     db: AsyncSession = Depends(get_db),
@@ -23,71 +64,184 @@ async def list_data(
     page: int = 1,
     per_page: int = 50,
     fields: str | None = None,
+    cursor: str | None = None,
+    count: str = "exact",
 ):
+    """
+    Readings ordered by (ts, id).
+
+    Without `cursor` this pages by `page`/`per_page` as before. Passing the
+    `next_cursor` or `prev_cursor` of a previous response seeks from that
+    row instead, so every page costs the same as the first. `count` selects
+    how `total` is computed: exact (cached per site/range until the site
+    gets new readings, or for a minute across sites),
+    estimate (index statistics) or none.
+
+    Only the columns named in `fields` (plus id, site_id, device_id, ts) are
+    selected, and rows go to the response as plain dicts.
+    """
     if per_page < 1 or per_page > 500:
         raise HTTPException(400, "per_page out of range")
-    stmt = select(SensorData)
-    cnt = select(func.count(SensorData.id))
+    if count not in COUNT_MODES:
+        raise HTTPException(400, "count must be one of: " + ", ".join(COUNT_MODES))
+    empty = {"total": 0, "page": page, "per_page": per_page, "items": []}
+    filters = []
     site_id = None
     if site_uid:
-        res = await db.execute(select(Site).where(Site.uid==site_uid))
-        site = res.scalar_one_or_none()
+        site = await site_registry.resolve(db, site_uid)
         if not site:
-            return {"total": 0, "page": page, "per_page": per_page, "items": []}
+            return empty
         site_id = site.id
         if viewer_uids and site_uid not in viewer_uids:
-            return {"total": 0, "page": page, "per_page": per_page, "items": []}
-        stmt = stmt.where(SensorData.site_id==site.id)
-        cnt = cnt.where(SensorData.site_id==site.id)
+            return empty
+        filters.append(SensorData.site_id==site.id)
+    if device_id:
+        filters.append(SensorData.device_id==device_id)
+    if date_from:
+        filters.append(SensorData.ts >= date_from)
+    if date_to:
+        filters.append(SensorData.ts < date_to)
+
+    desc = order.lower()=="desc"
+    cur = decode_cursor(cursor) if cursor else None
+    if cur is not None and cur.desc != desc:
+        raise HTTPException(400, "Cursor was issued for a different order")
+
+    # Read in list order, or against it when walking back from a prev cursor
+    reverse = cur is not None and not cur.forward
+    read_desc = desc != reverse
+    # Only the requested reading columns; never the payload JSON
+    stmt = select(*(getattr(SensorData, c) for c in _columns(fields))).where(*filters)
+    if cur is not None:
+        # (ts, id) strictly after/before the cursor row; the ts bound alone keeps
+        # the (site_id, ts) index range tight
+        if read_desc:
+            stmt = stmt.where(SensorData.ts <= cur.ts, or_(SensorData.ts < cur.ts, SensorData.id < cur.id))
+        else:
+            stmt = stmt.where(SensorData.ts >= cur.ts, or_(SensorData.ts > cur.ts, SensorData.id > cur.id))
+    if read_desc:
+        stmt = stmt.order_by(SensorData.ts.desc(), SensorData.id.desc())
+    else:
+        stmt = stmt.order_by(SensorData.ts.asc(), SensorData.id.asc())
+    if cur is None:
+        stmt = stmt.offset((page-1)*per_page)
+    rows = (await db.execute(stmt.limit(per_page + 1))).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if reverse:
+        rows.reverse()
+
+    if cur is None:
+        has_prev, has_next = page > 1, more
+    elif cur.forward:
+        has_prev, has_next = True, more
+    else:
+        has_prev, has_next = more, True
+
+    # A site's count is keyed by its data version; counts across sites expire after a minute
+    version = await latest_readings.load_version(db, site_id) if site_id and count == "exact" else None
+    total = await _count(
+        db, filters, count,
+        cache_key("data_count", site_id, version[0] if version else "", device_id or "", date_from or "", date_to or ""),
+        site_id,
+    )
+
+    items = [dict(r._mapping) for r in rows]
+    return ORJSONResponse({
+        "total": total, "page": page, "per_page": per_page, "items": items,
+        "next_cursor": encode_cursor(rows[-1].ts, rows[-1].id, forward=True, desc=desc) if rows and has_next else None,
+        "prev_cursor": encode_cursor(rows[0].ts, rows[0].id, forward=False, desc=desc) if rows and has_prev else None,
+    })
+
+async def _export_chunks(stmt, fmt: str, columns: list[str]):
+    # The request's session is closed before the body is streamed, so the
+    # export reads through its own session and server-side cursor.
+    async with SessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=EXPORT_CHUNK_ROWS))
+        if fmt == "csv":
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(columns)
+            async for part in result.partitions():
+                for r in part:
+                    writer.writerow(
+                        ("" if v is None else v.isoformat() if isinstance(v, datetime) else v)
+                        for v in r
+                    )
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+            if buf.tell():
+                yield buf.getvalue()
+        else:
+            async for part in result.partitions():
+                yield b"".join(orjson.dumps(dict(r._mapping)) + b"\n" for r in part)
+
+
+@router.get("/export")
+async def export_data(
+    db: AsyncSession = Depends(get_db),
+    viewer_uids: List[str] = Depends(get_viewer_site_uids),
+    site_uid: str | None = None,
+    device_id: int | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    format: str = "csv",
+    fields: str | None = None,
+):
+    """
+    Stream every matching reading, oldest first, as CSV or NDJSON.
+
+    Rows are fetched EXPORT_CHUNK_ROWS at a time from a server-side cursor
+    and written out as they arrive, so memory does not grow with the range.
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(400, "format must be one of: " + ", ".join(EXPORT_FORMATS))
+    filters = []
+    if site_uid:
+        site = await site_registry.resolve(db, site_uid)
+        if not site:
+            raise HTTPException(404, "Site not found")
+        if viewer_uids and site_uid not in viewer_uids:
+            raise HTTPException(403, "Forbidden")
+        filters.append(SensorData.site_id==site.id)
+    elif viewer_uids:
+        found = await site_registry.resolve_many(db, viewer_uids)
+        filters.append(SensorData.site_id.in_([e.id for e in found.values()]))
     if device_id:
-        stmt = stmt.where(SensorData.device_id==device_id)
-        cnt = cnt.where(SensorData.device_id==device_id)
+        filters.append(SensorData.device_id==device_id)
     if date_from:
-        stmt = stmt.where(SensorData.ts >= date_from)
-        cnt = cnt.where(SensorData.ts >= date_from)
+        filters.append(SensorData.ts >= date_from)
     if date_to:
-        stmt = stmt.where(SensorData.ts < date_to)
-        cnt = cnt.where(SensorData.ts < date_to)
-
-    total = (await db.execute(cnt)).scalar_one()
-    order_by = SensorData.ts.desc() if order.lower()=="desc" else SensorData.ts.asc()
-    rows = (await db.execute(stmt.order_by(order_by).offset((page-1)*per_page).limit(per_page))).scalars().all()
-
-    selected = None
-    if fields:
-        selected = set([f.strip() for f in fields.split(",") if f.strip()])
-
-    items = []
-    for r in rows:
-        d = DataOut(
-            id=r.id, site_id=r.site_id, device_id=r.device_id, ts=r.ts,
-            ph=r.ph, tss=r.tss, debit=r.debit, nh3n=r.nh3n, cod=r.cod, temp=r.temp, rh=r.rh,
-            wind_speed_kmh=r.wind_speed_kmh, wind_deg=r.wind_deg, noise=r.noise,
-            co=r.co, so2=r.so2, no2=r.no2, o3=r.o3, pm25=r.pm25, pm10=r.pm10, tvoc=r.tvoc,
-            voltage=r.voltage, current=r.current
-        ).model_dump()
-        if selected:
-            d = {k:v for k,v in d.items() if k in selected or k in ("id","ts","site_id","device_id")}
-        items.append(d)
-
-    return {"total": total, "page": page, "per_page": per_page, "items": items}
+        filters.append(SensorData.ts < date_to)
+
+    columns = _columns(fields)
+    stmt = (
+        select(*(getattr(SensorData, c) for c in columns))
+        .where(*filters)
+        .order_by(SensorData.ts.asc(), SensorData.id.asc())
+    )
+    filename = f"sensor_data_{site_uid or 'all'}.{format}"
+    return StreamingResponse(
+        _export_chunks(stmt, format, columns),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 @router.get("/last")
-async def last_record(site_uid: str, db: AsyncSession = Depends(get_db), viewer_uids: List[str] = Depends(get_viewer_site_uids)):
-    res = await db.execute(select(Site).where(Site.uid==site_uid))
-    site = res.scalar_one_or_none()
+async def last_record(request: Request, response: Response, site_uid: str, db: AsyncSession = Depends(get_db), viewer_uids: List[str] = Depends(get_viewer_site_uids)):
+    site = await site_registry.resolve(db, site_uid)
     if not site:
         raise HTTPException(404, "Site not found")
     if viewer_uids and site_uid not in viewer_uids:
         raise HTTPException(403, "Forbidden")
-    row = (await db.execute(select(SensorData).where(SensorData.site_id==site.id).order_by(SensorData.ts.desc()).limit(1))).scalar_one_or_none()
+    version = await latest_readings.load_version(db, site.id)
+    if version:
+        not_modified = check_conditional(request, response, make_etag("last", site.id, version[0]), version[1])
+        if not_modified:
+            return not_modified
+    # Served from the shared latest-reading table; the database is only hit on a miss
+    row = await latest_readings.load(db, site.id)
     if not row:
         return {}
-    return {
-        "id": row.id, "ts": row.ts, "site_id": row.site_id, "device_id": row.device_id,
-        "ph": row.ph, "tss": row.tss, "debit": row.debit, "temp": row.temp, "rh": row.rh,
-        "cod": row.cod, "nh3n": row.nh3n, "voltage": row.voltage, "current": row.current,
-        "wind_speed_kmh": row.wind_speed_kmh, "wind_deg": row.wind_deg, "noise": row.noise,
-        "co": row.co, "so2": row.so2, "no2": row.no2, "o3": row.o3, 
-        "pm25": row.pm25, "pm10": row.pm10, "tvoc": row.tvoc
-    }
+    return {k: row[k] for k in READING_KEYS}
@@ -1,29 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.core.db import get_db
+from app.core.registry import site_registry
+from app.core.latest import latest_readings
 from app.api.deps import require_roles, get_viewer_site_uids
 from app.models.models import Site, SensorDevice
 from app.schemas.device import DeviceCreate, DeviceUpdate, DeviceOut
+from app.utils.conditional import make_etag, check_conditional
 
 router = APIRouter()
 
 @router.post("", dependencies=[Depends(require_roles("admin","operator"))])
 async def create_device(data: DeviceCreate, db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(Site).where(Site.uid==data.site_uid))
-    site = res.scalar_one_or_none()
+    site = await site_registry.resolve(db, data.site_uid)
     if not site:
         raise HTTPException(400, "Invalid site_uid")
     d = SensorDevice(site_id=site.id, name=data.name, modbus_addr=data.modbus_addr, model=data.model, serial_no=data.serial_no, is_active=data.is_active)
     db.add(d); await db.commit(); await db.refresh(d)
+    await site_registry.refresh_site(db, site.id)
     return {"ok": True, "id": d.id}
 
 @router.get("", response_model=list[DeviceOut])
-async def list_devices(site_uid: str | None = None, db: AsyncSession = Depends(get_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
+async def list_devices(request: Request, response: Response, site_uid: str | None = None, db: AsyncSession = Depends(get_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
+    version = latest_readings.meta_version()
+    if version:
+        not_modified = check_conditional(request, response, make_etag("devices", version[0], site_uid, sorted(viewer_uids)), version[1])
+        if not_modified:
+            return not_modified
     stmt = select(SensorDevice)
     if site_uid:
-        res = await db.execute(select(Site).where(Site.uid==site_uid))
-        site = res.scalar_one_or_none()
+        site = await site_registry.resolve(db, site_uid)
         if not site:
             return []
         stmt = stmt.where(SensorDevice.site_id==site.id)
@@ -39,7 +46,7 @@ async def get_device(id: int, db: AsyncSession = Depends(get_db), viewer_uids: l
     if not d:
         raise HTTPException(404, "Not found")
     if viewer_uids:
-        site = (await db.execute(select(Site).where(Site.id==d.site_id))).scalar_one_or_none()
+        site = site_registry.by_id(d.site_id) or (await db.execute(select(Site).where(Site.id==d.site_id))).scalar_one_or_none()
         if site and site.uid not in viewer_uids:
             raise HTTPException(403, "Forbidden")
     return DeviceOut(id=d.id, site_id=d.site_id, name=d.name, modbus_addr=d.modbus_addr, model=d.model, serial_no=d.serial_no, is_active=d.is_active)
@@ -53,6 +60,7 @@ async def update_device(id: int, data: DeviceUpdate, db: AsyncSession = Depends(
     for k,v in data.model_dump(exclude_unset=True).items():
         setattr(d, k, v)
     await db.commit()
+    await site_registry.refresh_site(db, d.site_id)
     return {"ok": True}
 
 @router.delete("/{id}", dependencies=[Depends(require_roles("admin"))])
@@ -65,4 +73,5 @@ async def delete_device(id: int, db: AsyncSession = Depends(get_db)):
     # Soft delete to preserve data integrity
     d.is_active = False
     await db.commit()
+    await site_registry.refresh_site(db, d.site_id)
     return {"ok": True, "message": "Device deactivated"}
@@ -1,13 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, insert
 import jwt
 from datetime import datetime, timezone
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import PlainTextResponse, JSONResponse
 
 from app.core.config import settings
 from app.core.db import get_db
-from app.models.models import Site, SensorData, IngestLog, SensorDevice
+from app.core.registry import site_registry
+from app.models.models import SensorDevice
+from app.services.ingest import blank_row, insert_readings, readings_committed
+from app.services.ingest_queue import ingest_queue
+from app.services.ingest_stats import ingest_stats
+from app.services.rollups import apply_rollups
 
 router = APIRouter()
 
@@ -20,6 +25,13 @@ async def get_key():
 
 @router.post("/api/post-data")
 async def post_data(request: Request, db: AsyncSession = Depends(get_db)):
+    try:
+        return await _store_post_data(request, db)
+    except HTTPException as e:
+        ingest_stats.record("getdata", "error", error=str(e.detail))
+        raise
+
+async def _store_post_data(request: Request, db: AsyncSession):
     body = await request.json()
     token = body.get("token")
     if not token:
@@ -40,24 +52,26 @@ async def post_data(request: Request, db: AsyncSession = Depends(get_db)):
         raise HTTPException(400, "Invalid data format")
     
     # Lookup site by uid
-    site = (await db.execute(select(Site).where(Site.uid == uid))).scalar_one_or_none()
+    site = await site_registry.resolve(db, uid)
     if not site: 
         raise HTTPException(401, "Invalid UID")
     
     # Lookup device by serial_no or name if device_id is provided
     # Auto-provision device if it doesn't exist
     device_db_id = None
+    stale_registry = False
     if device_id_str:
-        device = (await db.execute(
-            select(SensorDevice).where(
-                SensorDevice.site_id == site.id,
-                (SensorDevice.serial_no == device_id_str) | (SensorDevice.name == device_id_str)
-            )
-        )).scalar_one_or_none()
-        
-        if device:
-            device_db_id = device.id
-        else:
+        device_db_id = site.find_device(device_id_str)
+        if device_db_id is None:
+            # This worker's registry may not have seen a device another worker just created
+            device_db_id = (await db.execute(
+                select(SensorDevice.id).where(
+                    SensorDevice.site_id == site.id,
+                    (SensorDevice.serial_no == device_id_str) | (SensorDevice.name == device_id_str)
+                ).order_by(SensorDevice.id).limit(1)
+            )).scalar_one_or_none()
+            stale_registry = True
+        if device_db_id is None:
             # Auto-create device if not exists
             new_device = SensorDevice(
                 site_id=site.id,
@@ -114,11 +128,10 @@ async def post_data(request: Request, db: AsyncSession = Depends(get_db)):
         nh3n_value = d.get("nh3n") or d.get("NH3N") or d.get("nh3N")
         nh3n = float(nh3n_value) if nh3n_value is not None else None
         
-        rows.append({
-            "site_id": site.id,
+        row = blank_row(site.id, ts, "getdata")
+        row.update({
             "device_id": device_db_id,
             "device_uid": device_id_str,  # Store device identifier string directly
-            "ts": ts,
             "ph": ph,
             "cod": cod,
             "tss": tss,
@@ -127,20 +140,30 @@ async def post_data(request: Request, db: AsyncSession = Depends(get_db)):
             "current": current,
             "nh3n": nh3n,
             "created_at": now,
-            "ingest_source": "getdata",
-            "payload": None
         })
+        rows.append(row)
     
-    if rows:
-        await db.execute(insert(SensorData), rows)
+    if settings.ingest_async:
+        # The device may have been auto-provisioned above; make it visible first
         await db.commit()
+        if stale_registry:
+            await site_registry.refresh_site(db, site.id)
+        if not ingest_queue.submit(rows):
+            raise HTTPException(503, "Ingest queue full", headers={"Retry-After": "1"})
+        ingest_stats.record("getdata", "ok", site.id, n=len(rows))
+        return JSONResponse(
+            {"message": "Data Diterima", "rows": len(rows), "uid": uid, "device_id": device_id_str, "queued": True},
+            status_code=202,
+        )
 
-    db.add(IngestLog(
-        source_ip=(request.client.host if request.client else None),
-        api_key_or_user_id="getdata",
-        status="ok",
-    ))
-    await db.commit()
+    if rows:
+        ids = await insert_readings(db, rows)
+        await apply_rollups(db, rows)
+        await db.commit()
+        readings_committed(rows, ids)
+    if stale_registry:
+        await site_registry.refresh_site(db, site.id)
+    ingest_stats.record("getdata", "ok", site.id, n=len(rows))
     
     return {"message": "Data Berhasil Disimpan", "rows": len(rows), "uid": uid, "device_id": device_id_str}
 
@@ -1,46 +1,57 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from app.core.db import get_db
+from app.core.registry import site_registry
 from app.api.deps import get_viewer_site_uids
-from app.models.models import Site, SensorData
-from app.core.cache import cache, cache_key, CACHE_TTL_METRICS, CACHE_TTL_LAST_DATA
+from app.models.models import SENSOR_FIELDS
+from app.core.cache import cache, cache_key, site_tag, CACHE_TTL_METRICS, CACHE_STALE_METRICS
+from app.services.range_metrics import site_range_partial
+from app.services.rollups import ROWS_PARAM
+from app.services.sketches import quantiles
+from app.core.latest import latest_readings
+from app.utils.conditional import make_etag, check_conditional
+from app.utils.time import to_utc
 
 router = APIRouter()
 
+# Decimals per parameter in site_metrics responses (default 2)
+METRIC_DECIMALS = {"tss": 1, "cod": 1, "debit": 1, "temp": 1, "rh": 1, "wind_speed_kmh": 1, "wind_deg": 0, "noise": 1}
+
+
+def round_metric(v: float | None, field: str) -> float | None:
+    return round(v, METRIC_DECIMALS.get(field, 2)) if v is not None else None
+
 
 @router.get("/sites/{uid}/stats/last-seen")
 async def last_seen(
+    request: Request,
+    response: Response,
     uid: str,
     db: AsyncSession = Depends(get_db),
     viewer_uids: list[str] = Depends(get_viewer_site_uids)
 ):
     """Get last data timestamp for a site."""
-    # Check cache first
-    cached = await cache.get(cache_key("last_seen", uid))
-    if cached is not None:
-        return cached
-    
-    res = await db.execute(select(Site).where(Site.uid == uid))
-    site = res.scalar_one_or_none()
+    site = await site_registry.resolve(db, uid)
     if not site:
         raise HTTPException(404, "Site not found")
     if viewer_uids and uid not in viewer_uids:
         raise HTTPException(403, "Forbidden")
     
-    row = (await db.execute(
-        select(func.max(SensorData.ts)).where(SensorData.site_id == site.id)
-    )).scalar_one_or_none()
-    
-    result = {"site_uid": uid, "last_ts": row}
-    await cache.set(cache_key("last_seen", uid), result, CACHE_TTL_LAST_DATA)
-    return result
+    version = await latest_readings.load_version(db, site.id)
+    if version:
+        not_modified = check_conditional(request, response, make_etag("last_seen", site.id, version[0]), version[1])
+        if not_modified:
+            return not_modified
+    row = await latest_readings.load(db, site.id)
+    return {"site_uid": uid, "last_ts": row["ts"] if row else None}
 
 
 @router.get("/sites/{uid}/metrics")
 async def site_metrics(
+    request: Request,
+    response: Response,
     uid: str,
     date_from: Optional[datetime] = Query(None, description="Start date (default: today)"),
     date_to: Optional[datetime] = Query(None, description="End date (default: now)"),
@@ -49,12 +60,11 @@ async def site_metrics(
     viewer_uids: list[str] = Depends(get_viewer_site_uids)
 ):
     """
-    Get aggregated metrics (avg, min, max) for a site.
-    Now includes: pH, TSS, COD, NH3N, Debit, Temperature
+    Get aggregated metrics (avg, min, max, p50, p95, p99) for a site.
+    Covers every numeric SensorData column, or only those named in `fields`.
     """
     # Check permissions
-    res = await db.execute(select(Site).where(Site.uid == uid))
-    site = res.scalar_one_or_none()
+    site = await site_registry.resolve(db, uid)
     if not site:
         raise HTTPException(404, "Site not found")
     if viewer_uids and uid not in viewer_uids:
@@ -62,104 +72,66 @@ async def site_metrics(
     
     # Default date range: today
     now = datetime.now(timezone.utc)
+    open_ended = date_to is None
     if date_from is None:
         date_from = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
     if date_to is None:
         date_to = now
     
-    # Cache key based on parameters
-    cache_key_str = cache_key("metrics", uid, date_from.isoformat(), date_to.isoformat())
-    cached = await cache.get(cache_key_str)
-    if cached is not None:
-        return cached
-    
-    # Build query for all sensor parameters
-    q = await db.execute(
-        select(
-            # pH
-            func.avg(SensorData.ph).label("ph_avg"),
-            func.min(SensorData.ph).label("ph_min"),
-            func.max(SensorData.ph).label("ph_max"),
-            func.count(SensorData.ph).label("ph_count"),
-            # TSS
-            func.avg(SensorData.tss).label("tss_avg"),
-            func.min(SensorData.tss).label("tss_min"),
-            func.max(SensorData.tss).label("tss_max"),
-            # COD
-            func.avg(SensorData.cod).label("cod_avg"),
-            func.min(SensorData.cod).label("cod_min"),
-            func.max(SensorData.cod).label("cod_max"),
-            # NH3N
-            func.avg(SensorData.nh3n).label("nh3n_avg"),
-            func.min(SensorData.nh3n).label("nh3n_min"),
-            func.max(SensorData.nh3n).label("nh3n_max"),
-            # Debit
-            func.avg(SensorData.debit).label("debit_avg"),
-            func.min(SensorData.debit).label("debit_min"),
-            func.max(SensorData.debit).label("debit_max"),
-            # Temperature
-            func.avg(SensorData.temp).label("temp_avg"),
-            func.min(SensorData.temp).label("temp_min"),
-            func.max(SensorData.temp).label("temp_max"),
-            # Data count
-            func.count(SensorData.id).label("total_records"),
-        ).where(
-            SensorData.site_id == site.id,
-            SensorData.ts >= date_from,
-            SensorData.ts <= date_to
+    cols = list(SENSOR_FIELDS)
+    if fields:
+        requested = set(f.strip().lower() for f in fields.split(","))
+        cols = [f for f in SENSOR_FIELDS if f in requested]
+
+    # Any committed reading (late ones included) bumps the site's version. An
+    # open-ended range only grows by new readings, so it is keyed without `now`.
+    version = await latest_readings.load_version(db, site.id)
+    if version:
+        etag = make_etag(
+            "metrics", site.id, version[0], to_utc(date_from).isoformat(),
+            None if open_ended else to_utc(date_to).isoformat(), cols,
         )
+        not_modified = check_conditional(request, response, etag, max(to_utc(version[1]), to_utc(date_from)))
+        if not_modified:
+            return not_modified
+
+    # Keyed by data version too, so a cached body always matches its ETag; like
+    # the ETag, an open-ended range is keyed without `now`. Concurrent misses
+    # share one computation.
+    cache_key_str = cache_key(
+        "metrics", uid, version[0] if version else None, date_from.isoformat(),
+        "open" if open_ended else date_to.isoformat(), ",".join(cols),
     )
-    
-    row = q.one()
-    
+    out = await cache.get_or_compute(
+        cache_key_str, lambda: _site_metrics(uid, site.id, date_from, date_to, cols, now),
+        CACHE_TTL_METRICS, tags=(site_tag(site.id),), stale_seconds=CACHE_STALE_METRICS,
+    )
+    return {**out, "date_to": date_to.isoformat()}
+
+
+async def _site_metrics(
+    uid: str, site_id: int, date_from: datetime, date_to: datetime, cols: list[str], now: datetime,
+) -> dict:
+    # Closed hours come cached (see range_metrics), only the open tail is read fresh
+    partial = await site_range_partial(site_id, date_from, date_to, cols, now)
+    aggs, pcts = partial.aggs, quantiles(partial.digests)
+
     # Build response
-    metrics = {
-        "ph": {
-            "avg": round(row.ph_avg, 2) if row.ph_avg else None,
-            "min": round(row.ph_min, 2) if row.ph_min else None,
-            "max": round(row.ph_max, 2) if row.ph_max else None,
-        },
-        "tss": {
-            "avg": round(row.tss_avg, 1) if row.tss_avg else None,
-            "min": round(row.tss_min, 1) if row.tss_min else None,
-            "max": round(row.tss_max, 1) if row.tss_max else None,
-        },
-        "cod": {
-            "avg": round(row.cod_avg, 1) if row.cod_avg else None,
-            "min": round(row.cod_min, 1) if row.cod_min else None,
-            "max": round(row.cod_max, 1) if row.cod_max else None,
-        },
-        "nh3n": {
-            "avg": round(row.nh3n_avg, 2) if row.nh3n_avg else None,
-            "min": round(row.nh3n_min, 2) if row.nh3n_min else None,
-            "max": round(row.nh3n_max, 2) if row.nh3n_max else None,
-        },
-        "debit": {
-            "avg": round(row.debit_avg, 1) if row.debit_avg else None,
-            "min": round(row.debit_min, 1) if row.debit_min else None,
-            "max": round(row.debit_max, 1) if row.debit_max else None,
-        },
-        "temp": {
-            "avg": round(row.temp_avg, 1) if row.temp_avg else None,
-            "min": round(row.temp_min, 1) if row.temp_min else None,
-            "max": round(row.temp_max, 1) if row.temp_max else None,
-        },
-    }
+    metrics = {}
+    for f in cols:
+        a = aggs[f]
+        metrics[f] = {
+            "avg": round_metric(a.avg, f),
+            "min": round_metric(a.min, f),
+            "max": round_metric(a.max, f),
+            "count": a.count,
+            **{name: round_metric(v, f) for name, v in pcts[f].items()},
+        }
     
-    # Filter by requested fields if specified
-    if fields:
-        requested = set(f.strip().lower() for f in fields.split(","))
-        metrics = {k: v for k, v in metrics.items() if k in requested}
-    
-    result = {
+    return {
         "site_uid": uid,
         "date_from": date_from.isoformat(),
         "date_to": date_to.isoformat(),
-        "total_records": row.total_records,
+        "total_records": aggs[ROWS_PARAM].count,
         "metrics": metrics,
     }
-    
-    # Cache result
-    await cache.set(cache_key_str, result, CACHE_TTL_METRICS)
-    
-    return result
@@ -0,0 +1,95 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from datetime import datetime, timedelta, timezone
+from app.core.config import settings
+from app.core.db import get_db
+from app.core.latest import latest_readings, SITE_LEVEL, READING_KEYS
+from app.api.deps import get_viewer_site_uids
+from app.api.routers.metrics import round_metric
+from app.models.models import Site, SensorDevice, SENSOR_FIELDS
+from app.services.rollups import sites_aggregates, ROWS_PARAM
+from app.utils.time import grid, local_tz
+
+router = APIRouter()
+
+
+def _online(row: dict, since: datetime) -> bool:
+    return bool(row) and row["ts"].replace(tzinfo=timezone.utc) >= since
+
+
+@router.get("/overview")
+async def overview(db: AsyncSession = Depends(get_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
+    """
+    Everything the dashboard shows for all visible sites, in one request:
+    site list, latest reading, devices with online status and today's
+    (local day) avg/min/max per parameter.
+
+    Latest readings come from the shared latest-reading table; sites,
+    devices and today's aggregates are one grouped query each, whatever the
+    number of sites.
+    """
+    stmt = select(Site)
+    if viewer_uids:
+        stmt = stmt.where(Site.uid.in_(viewer_uids))
+    sites = (await db.execute(stmt.order_by(Site.id.desc()))).scalars().all()
+    site_ids = [s.id for s in sites]
+
+    devices: dict[int, list] = {s: [] for s in site_ids}
+    if site_ids:
+        res = await db.execute(
+            select(SensorDevice.id, SensorDevice.site_id, SensorDevice.name, SensorDevice.is_active)
+            .where(SensorDevice.site_id.in_(site_ids))
+            .order_by(SensorDevice.id)
+        )
+        for d in res.all():
+            devices[d.site_id].append(d)
+
+    keys = [(s, SITE_LEVEL) for s in site_ids] + [(d.site_id, d.id) for ds in devices.values() for d in ds]
+    latest = await latest_readings.load_many(db, keys)
+
+    now = datetime.now(timezone.utc)
+    # Local day, unlike the UTC day /sites/{uid}/metrics defaults to; the response names it
+    day_start = grid(now, 86400)
+    today = await sites_aggregates(db, site_ids, day_start, now, list(SENSOR_FIELDS), inclusive_end=True)
+    since = now - timedelta(seconds=settings.device_online_sec)
+
+    out = []
+    for s in sites:
+        last = latest.get((s.id, SITE_LEVEL)) or {}
+        items = []
+        for d in devices[s.id]:
+            dev_last = latest.get((s.id, d.id)) or {}
+            items.append({
+                "id": d.id, "name": d.name, "is_active": d.is_active,
+                "last_ts": dev_last.get("ts"), "online": _online(dev_last, since),
+            })
+        aggs = today[s.id]
+        out.append({
+            "id": s.id, "uid": s.uid, "name": s.name, "company_name": s.company_name,
+            "lat": s.lat, "lon": s.lon, "is_active": s.is_active,
+            "online": _online(last, since),
+            "latest": {k: last[k] for k in READING_KEYS} if last else None,
+            "devices": {
+                "total": len(items),
+                "online": sum(1 for d in items if d["online"]),
+                "items": items,
+            },
+            "today": {
+                "date_from": day_start.astimezone(local_tz).isoformat(),
+                "total_records": aggs[ROWS_PARAM].count,
+                "metrics": {
+                    f: {
+                        "avg": round_metric(a.avg, f), "min": round_metric(a.min, f),
+                        "max": round_metric(a.max, f), "count": a.count,
+                    }
+                    for f in SENSOR_FIELDS if (a := aggs[f]).count
+                },
+            },
+        })
+    return ORJSONResponse({
+        "generated_at": now.astimezone(local_tz).isoformat(),
+        "online_window_sec": settings.device_online_sec,
+        "sites": out,
+    })
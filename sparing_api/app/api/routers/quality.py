@@ -0,0 +1,61 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from app.core.db import get_db
+from app.core.registry import site_registry
+from app.api.deps import get_viewer_site_uids
+from app.models.models import SENSOR_FIELDS
+from app.services.quality import KINDS, site_flags
+
+router = APIRouter()
+
+
+@router.get("/sites/{uid}/quality")
+async def site_quality_flags(
+    uid: str,
+    date_from: Optional[datetime] = Query(None, description="Start date (default: 7 days before date_to)"),
+    date_to: Optional[datetime] = Query(None, description="End date, exclusive (default: now)"),
+    kind: Optional[str] = Query(None, description="spike, flatline or stale"),
+    param: Optional[str] = Query(None, description="Reading column"),
+    limit: int = Query(500, ge=1, le=5000),
+    db: AsyncSession = Depends(get_db),
+    viewer_uids: list[str] = Depends(get_viewer_site_uids)
+):
+    """Data-quality flags raised on a site's readings, newest first."""
+    site = await site_registry.resolve(db, uid)
+    if not site:
+        raise HTTPException(404, "Site not found")
+    if viewer_uids and uid not in viewer_uids:
+        raise HTTPException(403, "Forbidden")
+    if kind is not None and kind not in KINDS:
+        raise HTTPException(400, f"kind must be one of: {', '.join(KINDS)}")
+    if param is not None and param not in SENSOR_FIELDS:
+        raise HTTPException(400, "Unknown parameter")
+
+    if date_to is None:
+        date_to = datetime.now(timezone.utc)
+    if date_from is None:
+        date_from = date_to - timedelta(days=7)
+
+    flags = await site_flags(db, site.id, date_from, date_to, kind, param, limit)
+    counts = {k: 0 for k in KINDS}
+    for f in flags:
+        counts[f.kind] = counts.get(f.kind, 0) + 1
+    return {
+        "site_uid": uid,
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "counts": counts,
+        "flags": [
+            {
+                "ts": f.ts,
+                "device_id": f.device_id or None,
+                "param": f.param,
+                "kind": f.kind,
+                "value": f.value,
+                "detail": f.detail,
+            }
+            for f in flags
+        ],
+    }
@@ -0,0 +1,207 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, and_, or_
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from app.core.config import settings
+from app.core.db import get_db, SessionLocal
+from app.core.registry import site_registry
+from app.core.cache import cache, cache_key, site_tag, CACHE_TTL_METRICS
+from app.core.latest import latest_readings
+from app.api.deps import get_viewer_site_uids
+from app.models.models import SensorData, SENSOR_FIELDS
+from app.utils.time import INTERVALS, to_utc, utc_offset_seconds, bucket_start, time_bucket, local_tz, grid
+from app.utils.lttb import lttb_indices
+from app.services.rollups import GRANULARITIES, ROWS_PARAM, Agg, rollup_buckets
+import numpy as np
+
+router = APIRouter()
+
+# Range used when date_from is omitted
+DEFAULT_SPAN = {"5m": timedelta(days=1), "1h": timedelta(days=7), "1d": timedelta(days=30)}
+MAX_BUCKETS = 10000
+MAX_DOWNSAMPLE = 5000
+# Downsampling reads every raw reading in range into memory, so it is bounded twice
+MAX_DOWNSAMPLE_RANGE = timedelta(days=366)
+MAX_DOWNSAMPLE_ROWS = 500_000
+RAW_CHUNK_ROWS = 10000
+
+
+def parse_fields(fields: str | None) -> list[str]:
+    """Requested numeric columns of SensorData, in table order; all if omitted."""
+    if not fields:
+        return list(SENSOR_FIELDS)
+    requested = {f.strip().lower() for f in fields.split(",") if f.strip()}
+    return [f for f in SENSOR_FIELDS if f in requested]
+
+
+@router.get("/sites/{uid}/series")
+async def site_series(
+    uid: str,
+    interval: str = Query("1h", description="Bucket width: 5m, 1h or 1d"),
+    date_from: Optional[datetime] = Query(None, description="Start (default: one span before date_to)"),
+    date_to: Optional[datetime] = Query(None, description="End, exclusive (default: now, rounded up to the interval)"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields (default: all; required with downsample)"),
+    downsample: Optional[int] = Query(None, description="Return raw readings reduced to N points per field with LTTB"),
+    db: AsyncSession = Depends(get_db),
+    viewer_uids: list[str] = Depends(get_viewer_site_uids),
+):
+    """
+    avg/min/max/count per time bucket for a site, aggregated in SQL.
+    Buckets are aligned to settings.tz, so 1d buckets start at local midnight.
+
+    With `downsample=N` the raw readings in range are reduced to N points per
+    field with LTTB instead (`interval` then only picks the default range).
+    Downsampling needs explicit `fields` and is limited to MAX_DOWNSAMPLE_RANGE
+    and MAX_DOWNSAMPLE_ROWS readings.
+    """
+    if interval not in INTERVALS:
+        raise HTTPException(400, "interval must be one of: " + ", ".join(INTERVALS))
+    site = await site_registry.resolve(db, uid)
+    if not site:
+        raise HTTPException(404, "Site not found")
+    if viewer_uids and uid not in viewer_uids:
+        raise HTTPException(403, "Forbidden")
+
+    step = INTERVALS[interval]
+    # An omitted date_to ends the bucket in progress, so the range (and cache key) holds for a whole bucket
+    date_to = to_utc(date_to) if date_to else grid(datetime.now(timezone.utc), step, up=True)
+    date_from = to_utc(date_from) if date_from else date_to - DEFAULT_SPAN[interval]
+    if date_from >= date_to:
+        raise HTTPException(400, "date_from must be before date_to")
+    cols = parse_fields(fields)
+    # Keyed by data version, so a result computed before a reading committed is never served after it
+    version = await latest_readings.load_version(db, site.id)
+    version = version[0] if version else None
+    if downsample is not None:
+        if downsample < 3 or downsample > MAX_DOWNSAMPLE:
+            raise HTTPException(400, f"downsample must be between 3 and {MAX_DOWNSAMPLE}")
+        if not cols or not fields:
+            raise HTTPException(400, "fields is required with downsample")
+        if date_to - date_from > MAX_DOWNSAMPLE_RANGE:
+            raise HTTPException(400, f"Range exceeds {MAX_DOWNSAMPLE_RANGE.days} days with downsample")
+        key = cache_key("series_lttb", uid, version, downsample, date_from.isoformat(), date_to.isoformat(), ",".join(cols))
+        out = await cache.get_or_compute(
+            key, lambda: _downsampled(uid, site.id, date_from, date_to, cols, downsample), CACHE_TTL_METRICS,
+            tags=(site_tag(site.id),),
+        )
+        return ORJSONResponse(out)
+    if (date_to - date_from).total_seconds() / step > MAX_BUCKETS:
+        raise HTTPException(400, f"Range too large for interval {interval} (max {MAX_BUCKETS} buckets)")
+
+    key = cache_key("series", uid, version, interval, date_from.isoformat(), date_to.isoformat(), ",".join(cols))
+    out = await cache.get_or_compute(
+        key, lambda: _bucketed(uid, site.id, interval, date_from, date_to, cols), CACHE_TTL_METRICS,
+        tags=(site_tag(site.id),),
+    )
+    return ORJSONResponse(out)
+
+
+async def _bucketed(uid: str, site_id: int, interval: str, date_from: datetime, date_to: datetime, cols: list[str]) -> dict:
+    async with SessionLocal() as db:
+        step = INTERVALS[interval]
+        offset = utc_offset_seconds(date_from)
+        by_index: dict[int, dict] = {}
+
+        # Whole hour/day buckets come from sensor_rollups; sensor_data is only
+        # read for the partial buckets at either end (or 5m buckets).
+        raw_ranges = [(date_from, date_to)]
+        if interval in GRANULARITIES and settings.rollup_reads:
+            lo, hi = grid(date_from, step, up=True), grid(date_to, step)
+            if lo < hi:
+                raw_ranges = [(date_from, lo), (hi, date_to)]
+                for start, aggs in (await rollup_buckets(db, site_id, interval, lo, hi, cols)).items():
+                    idx = (int(start.timestamp()) + offset) // step
+                    rows = aggs.get(ROWS_PARAM)
+                    b = {"ts": bucket_start(idx, step, offset).isoformat(), "count": rows.count if rows else 0}
+                    for f in cols:
+                        a = aggs.get(f) or Agg()
+                        b[f] = {"avg": a.avg, "min": a.min, "max": a.max, "count": a.count}
+                    by_index[idx] = b
+
+        bucket = time_bucket(SensorData.ts, step, offset).label("bucket")
+        aggs = [func.count(SensorData.id).label("n")]
+        for f in cols:
+            c = getattr(SensorData, f)
+            aggs += [
+                func.avg(c).label(f"{f}_avg"), func.min(c).label(f"{f}_min"),
+                func.max(c).label(f"{f}_max"), func.count(c).label(f"{f}_count"),
+            ]
+        raw_conds = [and_(SensorData.ts >= lo, SensorData.ts < hi) for lo, hi in raw_ranges if lo < hi]
+        res = []
+        if raw_conds:
+            res = (await db.execute(
+                select(bucket, *aggs)
+                .where(SensorData.site_id == site_id, or_(*raw_conds))
+                .group_by(bucket)
+            )).all()
+        for r in res:
+            m = r._mapping
+            b = {"ts": bucket_start(r.bucket, step, offset).isoformat(), "count": r.n}
+            for f in cols:
+                avg = m[f"{f}_avg"]
+                b[f] = {
+                    "avg": float(avg) if avg is not None else None,
+                    "min": m[f"{f}_min"], "max": m[f"{f}_max"], "count": m[f"{f}_count"],
+                }
+            by_index[r.bucket] = b
+        buckets = [by_index[i] for i in sorted(by_index)]
+
+        return {
+            "site_uid": uid,
+            "interval": interval,
+            "date_from": date_from.isoformat(),
+            "date_to": date_to.isoformat(),
+            "fields": cols,
+            "buckets": buckets,
+        }
+
+
+async def _downsampled(uid: str, site_id: int, date_from: datetime, date_to: datetime, cols: list[str], n: int) -> dict:
+    in_range = (SensorData.site_id == site_id, SensorData.ts >= date_from, SensorData.ts < date_to)
+    async with SessionLocal() as db:
+        rows = (await db.execute(select(func.count(SensorData.id)).where(*in_range))).scalar_one()
+        if rows > MAX_DOWNSAMPLE_ROWS:
+            raise HTTPException(
+                400, f"Range holds {rows} readings, more than {MAX_DOWNSAMPLE_ROWS} for downsample; narrow it",
+            )
+        # Epoch seconds and the requested columns straight into flat double
+        # arrays (NaN for NULL); no per-row objects are kept.
+        epoch = array("d")
+        values = {f: array("d") for f in cols}
+        nan = float("nan")
+        result = await db.stream(
+            select(time_bucket(SensorData.ts, 1, 0), *(getattr(SensorData, f) for f in cols))
+            .where(*in_range)
+            .order_by(SensorData.ts)
+            .execution_options(yield_per=RAW_CHUNK_ROWS)
+        )
+        async for part in result.partitions():
+            for r in part:
+                epoch.append(r[0])
+                for f, v in zip(cols, r[1:]):
+                    values[f].append(nan if v is None else v)
+
+    x_all = np.frombuffer(epoch, dtype=np.float64)
+    series = {}
+    for f in cols:
+        y = np.frombuffer(values[f], dtype=np.float64)
+        keep = ~np.isnan(y)
+        x, y = x_all[keep], y[keep]
+        idx = lttb_indices(x, y, n)
+        series[f] = {
+            "ts": [datetime.fromtimestamp(t, local_tz).isoformat() for t in x[idx]],
+            "values": y[idx].tolist(),
+            "raw_count": int(len(x)),
+        }
+
+    return {
+        "site_uid": uid,
+        "downsample": n,
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "fields": cols,
+        "series": series,
+    }
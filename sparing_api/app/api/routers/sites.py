@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, delete
 from app.core.db import get_db
+from app.core.registry import site_registry
+from app.core.latest import latest_readings
 from app.api.deps import get_current_user, require_roles, get_viewer_site_uids
 from app.models.models import Site
 from app.schemas.site import SiteCreate, SiteUpdate, SiteOut
+from app.utils.conditional import make_etag, check_conditional
 
 router = APIRouter()
 
@@ -17,10 +20,16 @@ async def create_site(data: SiteCreate, db: AsyncSession = Depends(get_db)):
     db.add(s)
     await db.commit()
     await db.refresh(s)
+    await site_registry.refresh_site(db, s.id)
     return {"ok": True, "id": s.id}
 
 @router.get("", response_model=list[SiteOut])
-async def list_sites(db: AsyncSession = Depends(get_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
+async def list_sites(request: Request, response: Response, db: AsyncSession = Depends(get_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
+    version = latest_readings.meta_version()
+    if version:
+        not_modified = check_conditional(request, response, make_etag("sites", version[0], sorted(viewer_uids)), version[1])
+        if not_modified:
+            return not_modified
     stmt = select(Site)
     if viewer_uids:
         stmt = stmt.where(Site.uid.in_(viewer_uids))
@@ -50,6 +59,7 @@ async def update_site(id: int, data: SiteUpdate, db: AsyncSession = Depends(get_
     for k,v in payload.items():
         setattr(s, k, v)
     await db.commit()
+    await site_registry.refresh_site(db, s.id)
     return {"ok": True}
 
 @router.delete("/{id}", dependencies=[Depends(require_roles("admin"))])
@@ -59,4 +69,5 @@ async def delete_site(id: int, db: AsyncSession = Depends(get_db)):
     if not s:
         raise HTTPException(404, "Not found")
     await db.delete(s); await db.commit()
+    await site_registry.drop_site(id)
     return {"ok": True}
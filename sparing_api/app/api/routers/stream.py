@@ -0,0 +1,73 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.broker import broker, Subscription, SlowConsumer
+from app.core.config import settings
+from app.core.db import get_db
+from app.core.latest import latest_readings
+from app.core.registry import site_registry
+from app.api.deps import get_stream_user
+from app.models.models import User
+from app.services.live import site_topic, reading_frame
+
+router = APIRouter()
+
+RETRY_MS = 3000
+
+
+async def _events(request: Request, sub: Subscription, first: bytes | None):
+    try:
+        yield b"retry: %d\n\n" % RETRY_MS
+        if first:
+            yield first
+        while True:
+            try:
+                frame = await sub.get(timeout=settings.stream_keepalive_sec)
+            except SlowConsumer:
+                # The client reconnects (EventSource does so on its own) and starts from the latest reading
+                yield b"event: overflow\ndata: {}\n\n"
+                return
+            if frame is None:
+                if await request.is_disconnected():
+                    return
+                yield b": keepalive\n\n"
+                continue
+            yield frame
+    finally:
+        broker.unsubscribe(sub)
+
+
+@router.get("/sites/{uid}")
+async def stream_site(
+    uid: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_stream_user),
+):
+    """
+    Server-Sent Events: a `reading` event with the site's newest reading on
+    connect and then whenever one is committed, from any worker. Shaped
+    like /data/last plus `site_uid`.
+
+    Clients that fall STREAM_QUEUE_MAX events behind get an `overflow`
+    event and are disconnected. EventSource clients may pass the access
+    token as `?token=`.
+    """
+    site = await site_registry.resolve(db, uid)
+    if not site:
+        raise HTTPException(404, "Site not found")
+    if user._role == "viewer" and uid not in (user._site_uids or []):
+        raise HTTPException(403, "Forbidden")
+
+    # Subscribe before reading the latest row so nothing committed in between is missed
+    sub = broker.subscribe(site_topic(site.id))
+    try:
+        row = await latest_readings.load(db, site.id)
+    except Exception:
+        broker.unsubscribe(sub)
+        raise
+    return StreamingResponse(
+        _events(request, sub, reading_frame(row) if row else None),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,107 @@
+"""
+Device API keys for /ingest/*.
+
+Keys are random 256-bit tokens, so a plain SHA-256 of the key is enough to
+index them (api_keys.token_hash); no slow password hash is needed. Looked-up
+keys are cached per worker for API_KEY_CACHE_TTL_SEC. Revocation through
+/admin/api-keys is published on the broker, so every worker drops its
+entry at once; should the message be lost between workers, the entry still
+expires after API_KEY_CACHE_TTL_SEC.
+"""
+import hashlib
+import secrets
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.broker import broker
+from app.core.config import settings
+from app.models.models import ApiKey, Site
+
+KEY_PREFIX = "spk_"
+INGEST_SCOPE = "ingest"
+MAX_CACHED_MISSES = 10000
+REVOKED_TOPIC = "api_keys:revoked"
+
+
+def hash_api_key(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def generate_api_key() -> tuple[str, str]:
+    """Return (plaintext key, token_hash). The plaintext is shown once only."""
+    key = KEY_PREFIX + secrets.token_urlsafe(32)
+    return key, hash_api_key(key)
+
+
+def parse_scopes(scopes: str | None) -> frozenset[str] | None:
+    """Scopes of a stored key: None (unrestricted) only for NULL; "" grants none."""
+    if scopes is None:
+        return None
+    return frozenset(s.strip() for s in scopes.split(",") if s.strip())
+
+
+@dataclass(frozen=True)
+class ApiKeyEntry:
+    id: int
+    name: str
+    site_id: int | None
+    site_uid: str | None
+    scopes: frozenset[str] | None  # None = unrestricted
+
+    def allows(self, scope: str) -> bool:
+        return self.scopes is None or scope in self.scopes
+
+
+class ApiKeyCache:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: dict[str, tuple[ApiKeyEntry | None, float]] = {}
+        self._listening = False
+
+    def start(self) -> None:
+        if not self._listening:
+            broker.listen(REVOKED_TOPIC, self._on_revoked)
+            self._listening = True
+
+    async def lookup(self, db: AsyncSession, key: str) -> ApiKeyEntry | None:
+        """Active key record for `key`, or None. Misses are cached too."""
+        token_hash = hash_api_key(key)
+        hit = self._entries.get(token_hash)
+        if hit is not None and hit[1] > time.monotonic():
+            return hit[0]
+        row = (await db.execute(
+            select(ApiKey.id, ApiKey.name, ApiKey.site_id, ApiKey.scopes, Site.uid)
+            .outerjoin(Site, Site.id == ApiKey.site_id)
+            .where(ApiKey.token_hash == token_hash, ApiKey.is_active == True)
+        )).one_or_none()
+        entry = None
+        if row is not None:
+            entry = ApiKeyEntry(
+                id=row.id, name=row.name, site_id=row.site_id, site_uid=row.uid,
+                scopes=parse_scopes(row.scopes),
+            )
+        if entry is not None or len(self._entries) < MAX_CACHED_MISSES:
+            self._entries[token_hash] = (entry, time.monotonic() + self.ttl)
+        return entry
+
+    def revoke(self, key_id: int) -> None:
+        """Drop a revoked key in every worker (this one included)."""
+        self._drop(key_id)
+        broker.publish(REVOKED_TOPIC, b"%d" % key_id)
+
+    def _on_revoked(self, payload: bytes) -> None:
+        self._drop(int(payload))
+
+    def _drop(self, key_id: int) -> None:
+        for token_hash, (entry, _) in list(self._entries.items()):
+            if entry is not None and entry.id == key_id:
+                self._entries.pop(token_hash, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+api_key_cache = ApiKeyCache(ttl=settings.api_key_cache_ttl_sec)
@@ -0,0 +1,138 @@
+"""
+In-memory token validation state for get_current_user.
+
+- `revoked_tokens`: blacklisted jti -> token exp. Loaded at startup, updated
+  by /auth/logout in this worker and synced from auth_token_blacklist every
+  TOKEN_SYNC_SEC (logouts handled by other workers). Entries drop out once
+  the token would have expired anyway.
+- `user_cache`: short-TTL snapshot of active users by id.
+
+A background sweeper does the sync and deletes expired blacklist rows.
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.core.logging import logger
+from app.models.models import User, AuthTokenBlacklist
+
+BLACKLIST_PURGE_SECONDS = 3600
+
+
+class RevokedTokens:
+    def __init__(self):
+        self._jtis: dict[str, float] = {}  # jti -> exp (epoch seconds)
+        self.loaded = False
+
+    def add(self, jti: str, exp: float) -> None:
+        if exp > time.time():
+            self._jtis[jti] = exp
+
+    def is_revoked(self, jti: str | None) -> bool:
+        if not jti:
+            return False
+        exp = self._jtis.get(jti)
+        if exp is None:
+            return False
+        if exp <= time.time():
+            self._jtis.pop(jti, None)
+            return False
+        return True
+
+    async def sync(self, db: AsyncSession) -> None:
+        """Merge in every unexpired blacklist row (the table only holds live revocations)."""
+        res = await db.execute(
+            select(AuthTokenBlacklist.jti, AuthTokenBlacklist.expires_at)
+            .where(AuthTokenBlacklist.expires_at > datetime.now(timezone.utc))
+        )
+        for jti, expires_at in res.all():
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            self._jtis[jti] = expires_at.timestamp()
+        self.loaded = True
+
+    def purge(self) -> None:
+        now = time.time()
+        for jti in [j for j, exp in self._jtis.items() if exp <= now]:
+            self._jtis.pop(jti, None)
+
+
+class UserCache:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._users: dict[int, tuple[dict, float]] = {}
+
+    def get(self, user_id: int) -> User | None:
+        """A fresh detached User for `user_id`, or None if not cached."""
+        hit = self._users.get(user_id)
+        if hit is None:
+            return None
+        snapshot, expires = hit
+        if expires <= time.monotonic():
+            self._users.pop(user_id, None)
+            return None
+        return User(**snapshot)
+
+    def put(self, user: User) -> None:
+        snapshot = {
+            "id": user.id, "name": user.name, "email": user.email,
+            "role": user.role, "is_active": user.is_active,
+        }
+        self._users[user.id] = (snapshot, time.monotonic() + self.ttl)
+
+    def invalidate(self, user_id: int) -> None:
+        self._users.pop(user_id, None)
+
+
+revoked_tokens = RevokedTokens()
+user_cache = UserCache(ttl=settings.user_cache_ttl_sec)
+
+
+class TokenSweeper:
+    """Periodically syncs revocations and deletes expired blacklist rows."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+        self._last_purge: float | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> None:
+        async with SessionLocal() as db:
+            await revoked_tokens.sync(db)
+            revoked_tokens.purge()
+            if self._last_purge is None or time.monotonic() - self._last_purge >= BLACKLIST_PURGE_SECONDS:
+                self._last_purge = time.monotonic()
+                await db.execute(
+                    delete(AuthTokenBlacklist)
+                    .where(AuthTokenBlacklist.expires_at < datetime.now(timezone.utc))
+                )
+                await db.commit()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Token sweeper failed")
+
+
+token_sweeper = TokenSweeper(interval=settings.token_sync_sec)
@@ -0,0 +1,240 @@
+"""
+In-process pub/sub with fan-out across the gunicorn workers of a host.
+
+Publishers hand the broker an already-encoded payload for a topic. The
+broker copies it into the bounded buffer of every local subscription to
+that topic and sends it over the bridge, which delivers it to the brokers
+of the other workers. Those deliver it locally only, so a message is never
+relayed twice.
+
+Publishing never blocks. A subscription whose buffer is full is dropped,
+and its reader gets SlowConsumer, so one stalled client cannot hold
+memory or delay anyone else.
+
+Bridges:
+- UnixSocketBridge: one datagram socket per worker in a shared directory.
+  A peer whose socket buffer is full misses that message.
+- MemoryBridge: in-process stand-in. Brokers that share a hub see each
+  other's messages. Used for single-process setups and tests.
+"""
+import asyncio
+import os
+import socket
+import time
+from collections import deque
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.telemetry import STREAM_SUBSCRIPTIONS, STREAM_DROPPED, STREAM_BRIDGE_ERRORS
+
+MAX_DATAGRAM = 65536
+PEER_REFRESH_SEC = 1.0
+
+
+class SlowConsumer(Exception):
+    """The subscription fell more than its buffer size behind and was dropped."""
+
+
+class Subscription:
+    def __init__(self, topic: str, maxsize: int):
+        self.topic = topic
+        self.maxsize = maxsize
+        self.dropped = False
+        self._frames: deque[bytes] = deque()
+        self._ready = asyncio.Event()
+
+    def push(self, payload: bytes) -> bool:
+        """Buffer a payload; False (and the subscription is dropped) if the buffer is full."""
+        if self.dropped:
+            return False
+        if len(self._frames) >= self.maxsize:
+            self.dropped = True
+            self._frames.clear()
+            self._ready.set()
+            return False
+        self._frames.append(payload)
+        self._ready.set()
+        return True
+
+    async def get(self, timeout: float | None = None) -> bytes | None:
+        """Next payload, or None after `timeout` seconds without one. Raises SlowConsumer once dropped."""
+        if not self._frames and not self.dropped:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if self.dropped:
+            raise SlowConsumer(self.topic)
+        return self._frames.popleft()
+
+
+class MemoryBridge:
+    """Bridge between brokers of one process that share `hub`."""
+
+    def __init__(self, hub: list | None = None):
+        self.hub = hub if hub is not None else []
+        self._deliver = None
+
+    def start(self, deliver) -> None:
+        self._deliver = deliver
+        self.hub.append(self)
+
+    def send(self, topic: str, payload: bytes) -> None:
+        for peer in self.hub:
+            if peer is not self:
+                peer._deliver(topic, payload)
+
+    def stop(self) -> None:
+        if self in self.hub:
+            self.hub.remove(self)
+
+
+class UnixSocketBridge:
+    """Bridge between the workers of one host over unix datagram sockets in `directory`."""
+
+    def __init__(self, directory: str, name: str | None = None):
+        self.directory = directory
+        self.name = name or f"{os.getpid()}.sock"
+        self._sock: socket.socket | None = None
+        self._path: str | None = None
+        self._deliver = None
+        self._peers: list[str] = []
+        self._peers_at = 0.0
+
+    def start(self, deliver) -> None:
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        self._path = os.path.join(self.directory, self.name)
+        if os.path.exists(self._path):
+            os.unlink(self._path)  # left behind by an earlier process with our pid
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(self._path)
+        sock.setblocking(False)
+        self._sock, self._deliver = sock, deliver
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._on_readable)
+
+    def stop(self) -> None:
+        if self._sock is None:
+            return
+        asyncio.get_running_loop().remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+    def _on_readable(self) -> None:
+        while True:
+            try:
+                data = self._sock.recv(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            topic, _, payload = data.partition(b"\n")
+            try:
+                self._deliver(topic.decode(), payload)
+            except Exception:
+                logger.exception("Bridge delivery failed")
+
+    def _peer_paths(self) -> list[str]:
+        now = time.monotonic()
+        if now - self._peers_at > PEER_REFRESH_SEC:
+            self._peers = [
+                os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.endswith(".sock") and os.path.join(self.directory, name) != self._path
+            ]
+            self._peers_at = now
+        return self._peers
+
+    def send(self, topic: str, payload: bytes) -> None:
+        if self._sock is None:
+            return
+        msg = topic.encode() + b"\n" + payload
+        if len(msg) > MAX_DATAGRAM:
+            logger.warning(f"Bridge message on {topic} too large ({len(msg)} bytes); not fanned out")
+            STREAM_BRIDGE_ERRORS.inc()
+            return
+        for peer in list(self._peer_paths()):
+            try:
+                self._sock.sendto(msg, peer)
+            except (BlockingIOError, InterruptedError):
+                STREAM_BRIDGE_ERRORS.inc()  # peer is not keeping up; it misses this one
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Worker is gone; forget its socket
+                self._peers.remove(peer)
+                try:
+                    os.unlink(peer)
+                except OSError:
+                    pass
+            except OSError:
+                STREAM_BRIDGE_ERRORS.inc()
+                logger.exception(f"Bridge send to {peer} failed")
+
+
+class Broker:
+    def __init__(self, queue_max: int):
+        self.queue_max = queue_max
+        self._subs: dict[str, set[Subscription]] = {}
+        self._listeners: dict[str, list] = {}
+        self._bridge = None
+
+    def start(self, bridge) -> None:
+        bridge.start(self._deliver)
+        self._bridge = bridge
+
+    def stop(self) -> None:
+        if self._bridge is not None:
+            self._bridge.stop()
+            self._bridge = None
+
+    def subscribe(self, topic: str) -> Subscription:
+        sub = Subscription(topic, self.queue_max)
+        self._subs.setdefault(topic, set()).add(sub)
+        STREAM_SUBSCRIPTIONS.inc()
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        subs = self._subs.get(sub.topic)
+        if subs is None or sub not in subs:
+            return
+        subs.discard(sub)
+        if not subs:
+            del self._subs[sub.topic]
+        STREAM_SUBSCRIPTIONS.dec()
+
+    def listen(self, topic: str, callback) -> None:
+        """Call `callback(payload)` on the event loop for every message on `topic`, from any worker."""
+        self._listeners.setdefault(topic, []).append(callback)
+
+    def subscribers(self, topic: str) -> int:
+        return len(self._subs.get(topic, ()))
+
+    def publish(self, topic: str, payload: bytes) -> None:
+        """Deliver to local subscribers and to the other workers. Never blocks."""
+        self._deliver(topic, payload)
+        if self._bridge is not None:
+            self._bridge.send(topic, payload)
+
+    def _deliver(self, topic: str, payload: bytes) -> None:
+        for sub in list(self._subs.get(topic, ())):
+            if not sub.push(payload):
+                self.unsubscribe(sub)
+                STREAM_DROPPED.inc()
+        for callback in self._listeners.get(topic, ()):
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception(f"Listener on {topic} failed")
+
+
+def default_bridge():
+    """The bridge chosen by STREAM_BRIDGE."""
+    if settings.stream_bridge == "unix":
+        return UnixSocketBridge(settings.stream_socket_dir or settings.shm_path("sparing_stream"))
+    if settings.stream_bridge == "memory":
+        return MemoryBridge()
+    raise ValueError(f"Unknown STREAM_BRIDGE: {settings.stream_bridge}")
+
+
+broker = Broker(queue_max=settings.stream_queue_max)
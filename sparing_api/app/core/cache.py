@@ -1,70 +1,484 @@
 """
-Simple in-memory cache with TTL support.
-For production, consider using Redis instead.
+Response cache with pluggable storage.
+
+`cache` is a Cache in front of the backend chosen by CACHE_BACKEND:
+
+- memory: TTLCache, a size-bounded LRU with per-entry TTL in this worker.
+  Once it holds more than CACHE_MAX_ENTRIES entries or CACHE_MAX_MB of
+  values (sized as their JSON encoding), the least recently used entries
+  are evicted. Expired entries are dropped when read and by a background
+  sweeper, which pops a heap of deadlines and so only visits entries that
+  have expired. Everything runs on the event loop without awaiting in
+  between, so there are no locks.
+- sqlite: one SQLite file shared by the workers of a host (CACHE_PATH).
+- resp: a Redis-protocol server shared across hosts (CACHE_URL).
+
+The shared backends live in app.core.cache_backends and store values as
+orjson, so cached values must be JSON-serializable and come back as JSON
+types.
+
+Every entry belongs to its namespace (the key up to the first ":") and to
+the tags passed to set(); invalidate() drops the entries of a tag in
+O(entries in tag). With the memory backend, invalidations are also
+published on the broker so the other workers of the host drop their
+entries too; shared backends are invalidated once, by the sender.
+
+Entries computed from a site's data carry site_tag(site_id). Site and
+device mutations invalidate it through the site registry, and ingest
+through invalidate_soon() whenever the site gets new readings, so those
+entries stay valid until the data changes rather than for a fixed minute.
+Entries that only cover hours already closed carry history_tag(site_id)
+instead, which ingest invalidates only for readings older than the
+current hour.
+
+get_or_compute() (and the `cached` decorator) coalesces misses: one task
+computes a key while every other caller in the worker awaits it. Callers
+await it through asyncio.shield, so a client going away does not cancel
+the work the others wait for; compute functions therefore open their own
+database session rather than borrowing the request's. A result is not
+stored if one of its tags was invalidated while it was computed. With
+stale_seconds, an expired entry is still served for that long while one
+background task refreshes it.
 """
+import asyncio
+import heapq
+import sys
 import time
-from typing import Any, Optional, Dict
+from collections import OrderedDict
 from functools import wraps
-import asyncio
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+import orjson
+
+from app.core.broker import broker
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.telemetry import CACHE_REQUESTS, CACHE_EVICTIONS, CACHE_ENTRIES, CACHE_BYTES
+
+ENTRY_OVERHEAD = 200  # bytes per entry besides key and value (entry, dict and tag slots)
+INVALIDATION_TOPIC = "cache:invalidate"
+INVALIDATION_BATCH_SEC = 0.2
+
+
+def _sizeof(value: Any) -> int:
+    try:
+        return len(orjson.dumps(value))
+    except TypeError:
+        return sys.getsizeof(value)
+
+
+def entry_tags(key: str, tags: Iterable[str]) -> tuple[str, ...]:
+    """The namespace of `key` followed by its explicit tags."""
+    return (key.partition(":")[0], *tags)
+
+
+class _Entry:
+    __slots__ = ("value", "expires", "keep_until", "size", "tags")
+
+    def __init__(self, value: Any, expires: float, keep_until: float, size: int, tags: tuple[str, ...]):
+        self.value = value
+        self.expires = expires
+        self.keep_until = keep_until  # served stale until then
+        self.size = size
+        self.tags = tags
 
 
 class TTLCache:
-    """Thread-safe in-memory cache with TTL expiration."""
-    
-    def __init__(self):
-        self._cache: Dict[str, tuple] = {}  # key -> (value, expire_time)
-        self._lock = asyncio.Lock()
-    
+    """In-process backend: LRU with TTL expiry, tags and memory accounting."""
+
+    shared = False
+
+    def __init__(self, max_entries: int, max_bytes: int, sweep_interval: float = 5.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()  # least recently used first
+        self._tags: dict[str, set[str]] = {}
+        self._deadlines: list[tuple[float, str]] = []
+        self.bytes = 0
+        self.evictions = self.expirations = 0
+        self._task: asyncio.Task | None = None
+
+    async def lookup(self, key: str) -> tuple[Any, bool] | None:
+        """(value, fresh) while the entry may be served, else None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if entry.keep_until <= now:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry.value, entry.expires > now
+
+    async def set(
+        self, key: str, value: Any, ttl_seconds: int = 60, tags: Iterable[str] = (), stale_seconds: int = 0,
+    ) -> None:
+        size = len(key) + _sizeof(value) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        tags = entry_tags(key, tags)
+        expires = time.monotonic() + ttl_seconds
+        keep_until = expires + stale_seconds
+        self._entries[key] = _Entry(value, expires, keep_until, size, tags)
+        self.bytes += size
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        heapq.heappush(self._deadlines, (keep_until, key))
+        if len(self._deadlines) > 2 * len(self._entries) + 1024:
+            # Overwritten keys leave stale deadlines behind; rebuild from live entries
+            self._deadlines = [(e.keep_until, k) for k, e in self._entries.items()]
+            heapq.heapify(self._deadlines)
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+            CACHE_EVICTIONS.labels("size").inc()
+
+    async def delete(self, key: str) -> None:
+        if key in self._entries:
+            self._remove(key)
+
+    async def clear(self) -> None:
+        self.drop_all()
+
+    async def invalidate(self, *tags: str) -> int:
+        return self.drop(tags)
+
+    async def invalidate_prefix(self, prefix: str) -> int:
+        return self.drop_prefix(prefix)
+
+    def drop_all(self) -> None:
+        self._entries.clear()
+        self._tags.clear()
+        self._deadlines.clear()
+        self.bytes = 0
+
+    def drop(self, tags: Iterable[str]) -> int:
+        """Drop every entry under any of `tags`. Returns the number dropped."""
+        dropped = 0
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                dropped += 1
+        if dropped:
+            CACHE_EVICTIONS.labels("invalidated").inc(dropped)
+        return dropped
+
+    def drop_prefix(self, prefix: str) -> int:
+        """
+        Drop every entry whose key starts with `prefix`. Only the namespaces
+        the prefix can match are visited, never the whole cache.
+        """
+        namespace, sep, _ = prefix.partition(":")
+        if not sep:
+            # Namespaces never contain ":", unlike explicit tags
+            return self.drop([t for t in self._tags if ":" not in t and t.startswith(prefix)])
+        keys = [k for k in self._tags.get(namespace, ()) if k.startswith(prefix)]
+        for key in keys:
+            self._remove(key)
+        if keys:
+            CACHE_EVICTIONS.labels("invalidated").inc(len(keys))
+        return len(keys)
+
+    async def cleanup_expired(self) -> int:
+        """Remove all expired entries. Returns count of removed entries."""
+        now = time.monotonic()
+        removed = 0
+        while self._deadlines and self._deadlines[0][0] <= now:
+            keep_until, key = heapq.heappop(self._deadlines)
+            entry = self._entries.get(key)
+            if entry is not None and entry.keep_until == keep_until:
+                self._remove(key)
+                removed += 1
+        if removed:
+            self.expirations += removed
+            CACHE_EVICTIONS.labels("expired").inc(removed)
+        CACHE_ENTRIES.set(len(self._entries))
+        CACHE_BYTES.set(self.bytes)
+        return removed
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    async def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "tags": len(self._tags),
+        }
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.cleanup_expired()
+            except Exception:
+                logger.exception("Cache sweep failed")
+
+
+class Cache:
+    """Single-flight lookups, hit/miss accounting and cross-worker invalidation over a backend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = self.misses = self.stale_hits = self.coalesced = 0
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._epoch = 0  # bumped by clear(), delete() and prefix invalidation
+        self._generations: dict[str, int] = {}  # tag -> invalidations so far
+        self._dirty: set[str] = set()  # tags for the next invalidate_soon() batch
+        self._dirty_handle: asyncio.TimerHandle | None = None
+        self._background: set[asyncio.Task] = set()
+        self._listening = False
+
     async def get(self, key: str) -> Optional[Any]:
         """Get value from cache if not expired."""
-        async with self._lock:
-            if key in self._cache:
-                value, expire_time = self._cache[key]
-                if time.time() < expire_time:
-                    return value
-                else:
-                    # Expired, remove it
-                    del self._cache[key]
+        hit = await self._lookup(key)
+        if hit is None or not hit[1]:
+            self.misses += 1
+            CACHE_REQUESTS.labels("miss").inc()
+            return None
+        self.hits += 1
+        CACHE_REQUESTS.labels("hit").inc()
+        return hit[0]
+
+    async def _lookup(self, key: str) -> tuple[Any, bool] | None:
+        try:
+            return await self.backend.lookup(key)
+        except Exception:
+            # An unreachable shared cache degrades to computing every request
+            logger.exception(f"Cache lookup of {key} failed")
             return None
-    
-    async def set(self, key: str, value: Any, ttl_seconds: int = 60) -> None:
-        """Set value in cache with TTL."""
-        async with self._lock:
-            expire_time = time.time() + ttl_seconds
-            self._cache[key] = (value, expire_time)
-    
+
+    async def set(
+        self, key: str, value: Any, ttl_seconds: int = 60, tags: Iterable[str] = (), stale_seconds: int = 0,
+    ) -> None:
+        """Set value in cache with TTL, under its namespace and `tags`."""
+        try:
+            await self.backend.set(key, value, ttl_seconds, tags, stale_seconds)
+        except Exception:
+            logger.exception(f"Cache store of {key} failed")
+
+    async def get_or_compute(
+        self, key: str, compute: Callable[[], Awaitable[Any]], ttl_seconds: int = 60,
+        tags: Iterable[str] = (), stale_seconds: int = 0,
+    ) -> Any:
+        """
+        Cached value of `key`, or the result of `compute()`, which is then
+        stored. At most one compute() per key runs at a time; concurrent
+        callers share its result or exception. Within `stale_seconds` after
+        expiry the old value is returned while compute() refreshes it.
+        """
+        hit = await self._lookup(key)
+        if hit is not None:
+            value, fresh = hit
+            if fresh:
+                self.hits += 1
+                CACHE_REQUESTS.labels("hit").inc()
+            else:
+                self.stale_hits += 1
+                CACHE_REQUESTS.labels("stale").inc()
+                if key not in self._inflight:
+                    self._start(key, compute, ttl_seconds, tags, stale_seconds, background=True)
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            CACHE_REQUESTS.labels("miss").inc()
+            task = self._start(key, compute, ttl_seconds, tags, stale_seconds, background=False)
+        else:
+            self.coalesced += 1
+            CACHE_REQUESTS.labels("coalesced").inc()
+        return await asyncio.shield(task)
+
+    def _start(self, key, compute, ttl_seconds, tags, stale_seconds, background: bool) -> asyncio.Task:
+        tags = entry_tags(key, tags)
+        generation = self._generation_of(tags)
+
+        async def run():
+            try:
+                value = await compute()
+                # An invalidation of its tags while computing may concern this value; do not store it
+                if generation == self._generation_of(tags):
+                    await self.set(key, value, ttl_seconds, tags, stale_seconds)
+                return value
+            finally:
+                self._inflight.pop(key, None)
+
+        def done(t: asyncio.Task) -> None:
+            # Retrieve the outcome even if every waiter has gone
+            if not t.cancelled() and t.exception() is not None and background:
+                logger.warning(f"Cache refresh of {key} failed: {t.exception()!r}")
+
+        task = asyncio.create_task(run())
+        task.add_done_callback(done)
+        self._inflight[key] = task
+        return task
+
+    def _generation_of(self, tags: tuple[str, ...]) -> tuple:
+        return self._epoch, *(self._generations.get(t, 0) for t in tags)
+
+    def _bump(self, tags: Iterable[str]) -> None:
+        for t in tags:
+            self._generations[t] = self._generations.get(t, 0) + 1
+
     async def delete(self, key: str) -> None:
         """Delete key from cache."""
-        async with self._lock:
-            self._cache.pop(key, None)
-    
+        self._epoch += 1
+        await self.backend.delete(key)
+
     async def clear(self) -> None:
-        """Clear all cache entries."""
-        async with self._lock:
-            self._cache.clear()
-    
+        """Clear all cache entries, in every worker."""
+        self._epoch += 1
+        await self.backend.clear()
+        self._publish({"clear": True})
+
+    async def invalidate(self, *tags: str) -> int:
+        """Drop every entry under any of `tags`, in every worker. Returns the number dropped here."""
+        self._bump(tags)
+        dropped = await self.backend.invalidate(*tags)
+        self._publish({"tags": tags})
+        return dropped
+
+    async def invalidate_prefix(self, prefix: str) -> int:
+        """Drop every entry whose key starts with `prefix`, in every worker."""
+        self._epoch += 1
+        dropped = await self.backend.invalidate_prefix(prefix)
+        self._publish({"prefix": prefix})
+        return dropped
+
+    def invalidate_soon(self, *tags: str) -> None:
+        """
+        invalidate(*tags) from synchronous code such as the ingest path.
+        Tags arriving within INVALIDATION_BATCH_SEC go out as one
+        invalidation, so a burst of batches costs one round of messages.
+        """
+        self._dirty.update(tags)
+        if self._dirty_handle is None:
+            self._dirty_handle = asyncio.get_running_loop().call_later(INVALIDATION_BATCH_SEC, self._flush_dirty)
+
+    def _flush_dirty(self) -> None:
+        tags, self._dirty, self._dirty_handle = self._dirty, set(), None
+        task = asyncio.create_task(self._invalidate_logged(tags))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _invalidate_logged(self, tags: Iterable[str]) -> None:
+        try:
+            await self.invalidate(*tags)
+        except Exception:
+            logger.exception(f"Cache invalidation of {len(tags)} tags failed")
+
     async def cleanup_expired(self) -> int:
         """Remove all expired entries. Returns count of removed entries."""
-        async with self._lock:
-            now = time.time()
-            expired_keys = [
-                key for key, (_, expire_time) in self._cache.items()
-                if now >= expire_time
-            ]
-            for key in expired_keys:
-                del self._cache[key]
-            return len(expired_keys)
+        return await self.backend.cleanup_expired()
+
+    def _publish(self, message: dict) -> None:
+        if not self.backend.shared:
+            broker.publish(INVALIDATION_TOPIC, orjson.dumps(message))
+
+    def _on_invalidation(self, payload: bytes) -> None:
+        """Apply an invalidation published by any worker (this one included) to the in-process backend."""
+        message = orjson.loads(payload)
+        if message.get("clear"):
+            self._epoch += 1
+            self.backend.drop_all()
+        if message.get("tags"):
+            self._bump(message["tags"])
+            self.backend.drop(message["tags"])
+        if message.get("prefix"):
+            self._epoch += 1
+            self.backend.drop_prefix(message["prefix"])
+
+    async def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.stale_hits + self.coalesced
+        try:
+            backend = await self.backend.stats()
+        except Exception:
+            logger.exception("Cache backend stats failed")
+            backend = {}
+        return {
+            **backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else None,
+            "in_flight": len(self._inflight),
+        }
+
+    def start(self) -> None:
+        if not self.backend.shared and not self._listening:
+            broker.listen(INVALIDATION_TOPIC, self._on_invalidation)
+            self._listening = True
+        self.backend.start()
+
+    async def stop(self) -> None:
+        if self._dirty_handle is not None:
+            self._dirty_handle.cancel()
+            self._flush_dirty()
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        for task in list(self._inflight.values()):
+            task.cancel()
+        await self.backend.stop()
+
+
+def make_backend(name: str):
+    """The backend chosen by CACHE_BACKEND."""
+    max_bytes = settings.cache_max_mb * 1024 * 1024
+    if name == "memory":
+        return TTLCache(settings.cache_max_entries, max_bytes, settings.cache_sweep_sec)
+    from app.core.cache_backends import SqliteBackend, RespBackend
+    if name == "sqlite":
+        path = settings.cache_path or settings.shm_path("sparing_cache.sqlite")
+        return SqliteBackend(path, settings.cache_max_entries, max_bytes, settings.cache_sweep_sec)
+    if name == "resp":
+        return RespBackend(settings.cache_url)
+    raise ValueError(f"Unknown CACHE_BACKEND: {name}")
 
 
 # Global cache instance
-cache = TTLCache()
+cache = Cache(make_backend(settings.cache_backend))
 
 
 # Cache TTL constants (in seconds)
 CACHE_TTL_SITES = 300  # 5 minutes
 CACHE_TTL_LAST_DATA = 30  # 30 seconds
-CACHE_TTL_METRICS = 60  # 1 minute
+CACHE_TTL_METRICS = 3600  # 1 hour; ingest invalidates a site's entries when it gets new readings
 CACHE_TTL_DEVICES = 120  # 2 minutes
+CACHE_TTL_COUNT = 60  # 1 minute, for counts not limited to one site
+CACHE_TTL_SITE_COUNT = 3600  # 1 hour, invalidated like CACHE_TTL_METRICS
+CACHE_STALE_METRICS = 30  # served stale this long past CACHE_TTL_METRICS while refreshing
+CACHE_TTL_CLOSED = 86400  # 1 day, for aggregates of closed hours; late readings invalidate them
 
 
 def cache_key(*args) -> str:
@@ -72,10 +486,21 @@ def cache_key(*args) -> str:
     return ":".join(str(arg) for arg in args)
 
 
-def cached(prefix: str, ttl_seconds: int = 60):
+def site_tag(site_id: int) -> str:
+    """Tag of entries derived from one site's readings or metadata."""
+    return f"site:{site_id}"
+
+
+def history_tag(site_id: int) -> str:
+    """Tag of entries covering only a site's closed hours, which new readings rarely change."""
+    return f"history:{site_id}"
+
+
+def cached(prefix: str, ttl_seconds: int = 60, stale_seconds: int = 0):
     """
-    Decorator for caching async function results.
-    
+    Decorator for caching async function results. Concurrent calls with
+    the same arguments share one execution (see Cache.get_or_compute).
+
     Usage:
         @cached("sites", ttl_seconds=300)
         async def get_sites():
@@ -89,27 +514,12 @@ def cached(prefix: str, ttl_seconds: int = 60):
             key_parts.extend(str(arg) for arg in args)
             key_parts.extend(f"{k}={v}" for k, v in sorted(kwargs.items()))
             key = cache_key(*key_parts)
-            
-            # Try to get from cache
-            cached_value = await cache.get(key)
-            if cached_value is not None:
-                return cached_value
-            
-            # Call function and cache result
-            result = await func(*args, **kwargs)
-            await cache.set(key, result, ttl_seconds)
-            return result
-        
+            return await cache.get_or_compute(key, lambda: func(*args, **kwargs), ttl_seconds, stale_seconds=stale_seconds)
+
         return wrapper
     return decorator
 
 
 async def invalidate_cache(prefix: str) -> None:
     """Invalidate all cache entries with given prefix."""
-    async with cache._lock:
-        keys_to_delete = [
-            key for key in cache._cache.keys()
-            if key.startswith(prefix)
-        ]
-        for key in keys_to_delete:
-            del cache._cache[key]
+    await cache.invalidate_prefix(prefix)
@@ -0,0 +1,462 @@
+"""
+Shared storage for app.core.cache.
+
+Both backends hold orjson-encoded values with wall-clock deadlines, so
+every worker sees the same entries and one invalidation reaches them all.
+
+- SqliteBackend: a SQLite file (WAL) shared by the workers of one host.
+  Calls run on a dedicated thread, so the event loop never waits on the
+  file lock. Tags are rows of cache_tags, and the sweeper deletes expired
+  entries and, past CACHE_MAX_ENTRIES or CACHE_MAX_MB, those closest to
+  expiry.
+- RespBackend: a Redis-protocol server shared across hosts, spoken to
+  through RespClient, a small pipelining RESP2 client. Each tag is a
+  sorted set of keys scored by their deadline, so the sweeper trims
+  expired members in O(log n) and idle tags expire on their own. Tag
+  expiry is extended by a Lua script (TAG_ADD) rather than PEXPIRE NX/GT,
+  which need Redis 7; any server with EVAL (Redis 2.6+) works.
+"""
+import asyncio
+import sqlite3
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Iterable
+from urllib.parse import urlparse
+
+import orjson
+
+from app.core.cache import entry_tags, ENTRY_OVERHEAD
+from app.core.logging import logger
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL NOT NULL,
+    keep_until REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_cache_entries_keep_until ON cache_entries (keep_until);
+CREATE TABLE IF NOT EXISTS cache_tags (
+    tag TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (tag, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_cache_tags_key ON cache_tags (key);
+"""
+SQLITE_CHUNK = 500
+# KEYS[1] tag, ARGV: score, member, keep (ms). Adds the member and makes the
+# tag live at least `keep` more, so it outlives its longest-lived member.
+TAG_ADD = """
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+if redis.call('PTTL', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('PEXPIRE', KEYS[1], ARGV[3])
+end
+return 1
+"""
+
+
+class _Sweeper:
+    """Periodic cleanup_expired() task, as TTLCache runs it."""
+
+    sweep_interval = 5.0
+    _task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.cleanup_expired()
+            except Exception:
+                logger.exception("Cache sweep failed")
+
+
+class SqliteBackend(_Sweeper):
+    shared = True
+
+    def __init__(self, path: str, max_entries: int, max_bytes: int, sweep_interval: float = 5.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-sqlite")
+        self._conn: sqlite3.Connection | None = None
+
+    # ---- executor thread ----
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # a cache: losing the tail on power loss is fine
+            conn.executescript(SQLITE_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def _tx(self):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _delete_keys(self, db: sqlite3.Connection, keys: list[str]) -> int:
+        deleted = 0
+        for i in range(0, len(keys), SQLITE_CHUNK):
+            chunk = [(k,) for k in keys[i:i + SQLITE_CHUNK]]
+            deleted += db.executemany("DELETE FROM cache_entries WHERE key = ?", chunk).rowcount
+            db.executemany("DELETE FROM cache_tags WHERE key = ?", chunk)
+        return deleted
+
+    def _lookup(self, key: str, now: float):
+        return self._db().execute(
+            "SELECT value, expires FROM cache_entries WHERE key = ? AND keep_until > ?", (key, now),
+        ).fetchone()
+
+    def _set(self, key: str, blob: bytes, expires: float, keep_until: float, size: int, tags: tuple) -> None:
+        with self._tx() as db:
+            db.execute("DELETE FROM cache_tags WHERE key = ?", (key,))
+            db.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, expires, keep_until, size) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, expires, keep_until, size),
+            )
+            db.executemany("INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)", [(t, key) for t in tags])
+
+    def _invalidate(self, tags: tuple) -> int:
+        with self._tx() as db:
+            keys = set()
+            for tag in tags:
+                keys.update(k for (k,) in db.execute("SELECT key FROM cache_tags WHERE tag = ?", (tag,)))
+            return self._delete_keys(db, list(keys))
+
+    def _invalidate_prefix(self, prefix: str) -> int:
+        namespace, sep, _ = prefix.partition(":")
+        with self._tx() as db:
+            if sep:
+                rows = db.execute(
+                    "SELECT key FROM cache_tags WHERE tag = ? AND substr(key, 1, ?) = ?",
+                    (namespace, len(prefix), prefix),
+                )
+            else:
+                rows = db.execute(
+                    "SELECT key FROM cache_tags WHERE substr(tag, 1, ?) = ? AND instr(tag, ':') = 0",
+                    (len(prefix), prefix),
+                )
+            return self._delete_keys(db, list({k for (k,) in rows}))
+
+    def _cleanup(self, now: float) -> int:
+        with self._tx() as db:
+            keys = [k for (k,) in db.execute("SELECT key FROM cache_entries WHERE keep_until <= ?", (now,))]
+            removed = self._delete_keys(db, keys)
+            count, total = db.execute("SELECT count(*), coalesce(sum(size), 0) FROM cache_entries").fetchone()
+            if count > self.max_entries or total > self.max_bytes:
+                # Over a bound: drop the entries closest to expiry first
+                over, freed, victims = count - self.max_entries, 0, []
+                for key, size in db.execute("SELECT key, size FROM cache_entries ORDER BY keep_until"):
+                    if len(victims) >= over and total - freed <= self.max_bytes:
+                        break
+                    victims.append(key)
+                    freed += size
+                removed += self._delete_keys(db, victims)
+            return removed
+
+    def _clear(self) -> None:
+        with self._tx() as db:
+            db.execute("DELETE FROM cache_entries")
+            db.execute("DELETE FROM cache_tags")
+
+    def _stats(self) -> dict:
+        count, total = self._db().execute("SELECT count(*), coalesce(sum(size), 0) FROM cache_entries").fetchone()
+        return {
+            "backend": "sqlite", "path": self.path, "entries": count, "bytes": total,
+            "max_entries": self.max_entries, "max_bytes": self.max_bytes,
+        }
+
+    # ---- event loop ----
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def lookup(self, key: str) -> tuple[Any, bool] | None:
+        now = time.time()
+        row = await self._call(self._lookup, key, now)
+        if row is None:
+            return None
+        return orjson.loads(row[0]), row[1] > now
+
+    async def set(
+        self, key: str, value: Any, ttl_seconds: int = 60, tags: Iterable[str] = (), stale_seconds: int = 0,
+    ) -> None:
+        blob = orjson.dumps(value)
+        size = len(key) + len(blob) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        expires = time.time() + ttl_seconds
+        await self._call(self._set, key, blob, expires, expires + stale_seconds, size, entry_tags(key, tags))
+
+    async def delete(self, key: str) -> None:
+        def run():
+            with self._tx() as db:
+                self._delete_keys(db, [key])
+        await self._call(run)
+
+    async def clear(self) -> None:
+        await self._call(self._clear)
+
+    async def invalidate(self, *tags: str) -> int:
+        return await self._call(self._invalidate, tags)
+
+    async def invalidate_prefix(self, prefix: str) -> int:
+        return await self._call(self._invalidate_prefix, prefix)
+
+    async def cleanup_expired(self) -> int:
+        return await self._call(self._cleanup, time.time())
+
+    async def stats(self) -> dict:
+        return await self._call(self._stats)
+
+    async def stop(self) -> None:
+        await super().stop()
+
+        def close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await self._call(close)
+
+
+# ---- Redis protocol ----
+
+class RespError(Exception):
+    """Error reply from the server."""
+
+
+def _encode(args: tuple) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for a in args:
+        if not isinstance(a, bytes):
+            a = str(a).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(a), a))
+    return b"".join(out)
+
+
+class RespClient:
+    """
+    One pipelined RESP2 connection. Commands are written as they come and
+    replies are matched to them in order by a reader task, so concurrent
+    callers never wait on each other's round trips. The connection is
+    re-established on the next command after it drops.
+    """
+
+    def __init__(self, host: str, port: int, db: int = 0, password: str | None = None, timeout: float = 1.0):
+        self.host, self.port, self.db, self.password = host, port, db, password
+        self.timeout = timeout
+        self._writer: asyncio.StreamWriter | None = None
+        self._pending: deque[asyncio.Future] = deque()
+        self._reader_task: asyncio.Task | None = None
+        self._connecting: asyncio.Lock | None = None
+
+    async def _connect(self) -> None:
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:
+            if self._writer is not None:
+                return
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+            self._writer = writer
+            self._reader_task = asyncio.create_task(self._read_loop(reader))
+            setup = [("AUTH", self.password)] if self.password else []
+            if self.db:
+                setup.append(("SELECT", self.db))
+            if setup:
+                await asyncio.wait_for(asyncio.gather(*self._send(*setup)), self.timeout)
+
+    async def _read_reply(self, reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            return RespError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            return None if n < 0 else (await reader.readexactly(n + 2))[:-2]
+        if kind == b"*":
+            n = int(rest)
+            return None if n < 0 else [await self._read_reply(reader) for _ in range(n)]
+        raise ConnectionError(f"Unexpected reply {line[:20]!r}")
+
+    async def _read_loop(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                reply = await self._read_reply(reader)
+                fut = self._pending.popleft()
+                if fut.done():
+                    continue  # the caller timed out; the reply still keeps the order
+                if isinstance(reply, RespError):
+                    fut.set_exception(reply)
+                else:
+                    fut.set_result(reply)
+        except (ConnectionError, asyncio.IncompleteReadError, OSError) as e:
+            self._reset(e)
+        except asyncio.CancelledError:
+            self._reset(ConnectionError("Client closed"))
+            raise
+
+    def _reset(self, exc: Exception) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        while self._pending:
+            fut = self._pending.popleft()
+            if not fut.done():
+                fut.set_exception(ConnectionError(str(exc)))
+
+    def _send(self, *commands: tuple) -> list[asyncio.Future]:
+        loop = asyncio.get_running_loop()
+        futs = [loop.create_future() for _ in commands]
+        self._pending.extend(futs)
+        self._writer.write(b"".join(_encode(c) for c in commands))
+        return futs
+
+    async def execute(self, *args):
+        return (await self.pipeline([args]))[0]
+
+    async def pipeline(self, commands: list[tuple]) -> list:
+        """Send `commands` in one write and return their replies; raises the first error reply."""
+        if not commands:
+            return []
+        if self._writer is None:
+            await self._connect()
+        return await asyncio.wait_for(asyncio.gather(*self._send(*commands)), self.timeout)
+
+    async def close(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+
+
+class RespBackend(_Sweeper):
+    shared = True
+    KEY_PREFIX = "sparing:cache:"
+    TAG_PREFIX = "sparing:tag:"
+    DEADLINE = struct.Struct("<q")  # fresh-until (ms) in front of the value
+
+    def __init__(self, url: str, timeout: float = 1.0, sweep_interval: float = 30.0):
+        u = urlparse(url)
+        self.url = f"{u.hostname}:{u.port or 6379}"
+        self.sweep_interval = sweep_interval
+        db = int(u.path.lstrip("/") or 0)
+        self.client = RespClient(u.hostname or "localhost", u.port or 6379, db, u.password, timeout)
+        self._touched: set[str] = set()  # tags written since the last sweep
+
+    def _k(self, key: str) -> str:
+        return self.KEY_PREFIX + key
+
+    def _t(self, tag: str) -> str:
+        return self.TAG_PREFIX + tag
+
+    async def lookup(self, key: str) -> tuple[Any, bool] | None:
+        raw = await self.client.execute("GET", self._k(key))
+        if raw is None:
+            return None
+        (fresh_until,) = self.DEADLINE.unpack_from(raw)
+        return orjson.loads(raw[self.DEADLINE.size:]), fresh_until > time.time() * 1000
+
+    async def set(
+        self, key: str, value: Any, ttl_seconds: int = 60, tags: Iterable[str] = (), stale_seconds: int = 0,
+    ) -> None:
+        now_ms = int(time.time() * 1000)
+        keep_ms = (ttl_seconds + stale_seconds) * 1000
+        blob = self.DEADLINE.pack(now_ms + ttl_seconds * 1000) + orjson.dumps(value)
+        commands = [("SET", self._k(key), blob, "PX", max(keep_ms, 1))]
+        for tag in entry_tags(key, tags):
+            t = self._t(tag)
+            # Tag sets live as long as their longest-lived member
+            commands.append(("EVAL", TAG_ADD, 1, t, now_ms + keep_ms, key, max(keep_ms, 1)))
+            self._touched.add(tag)
+        await self.client.pipeline(commands)
+
+    async def delete(self, key: str) -> None:
+        await self.client.execute("DEL", self._k(key))
+
+    async def _drop(self, tags: Iterable[str], prefix: str | None = None) -> int:
+        tags = list(tags)
+        if not tags:
+            return 0
+        members = await self.client.pipeline([("ZRANGE", self._t(t), 0, -1) for t in tags])
+        keys = {m.decode() for ms in members for m in ms or ()}
+        if prefix is not None:
+            keys = {k for k in keys if k.startswith(prefix)}
+        else:
+            await self.client.execute("DEL", *(self._t(t) for t in tags))
+        if not keys:
+            return 0
+        return await self.client.execute("DEL", *(self._k(k) for k in keys))
+
+    async def invalidate(self, *tags: str) -> int:
+        return await self._drop(tags)
+
+    async def invalidate_prefix(self, prefix: str) -> int:
+        namespace, sep, _ = prefix.partition(":")
+        if sep:
+            return await self._drop([namespace], prefix)
+        tags = [t[len(self.TAG_PREFIX):] for t in await self._scan(self._t(prefix) + "*")]
+        return await self._drop([t for t in tags if ":" not in t])
+
+    async def _scan(self, pattern: str) -> list[str]:
+        found, cursor = [], b"0"
+        while True:
+            cursor, batch = await self.client.execute("SCAN", cursor, "MATCH", pattern, "COUNT", 1000)
+            found += [b.decode() for b in batch]
+            if cursor in (b"0", 0):
+                return found
+
+    async def clear(self) -> None:
+        keys = await self._scan(self.KEY_PREFIX + "*") + await self._scan(self.TAG_PREFIX + "*")
+        for i in range(0, len(keys), 500):
+            await self.client.execute("DEL", *keys[i:i + 500])
+
+    async def cleanup_expired(self) -> int:
+        """The server expires entries itself; trim expired members from the tags written lately."""
+        touched, self._touched = self._touched, set()
+        if not touched:
+            return 0
+        now_ms = int(time.time() * 1000)
+        await self.client.pipeline([("ZREMRANGEBYSCORE", self._t(t), "-inf", now_ms) for t in touched])
+        return 0
+
+    async def stats(self) -> dict:
+        return {"backend": "resp", "url": self.url}
+
+    async def stop(self) -> None:
+        await super().stop()
+        await self.client.close()
@@ -2,6 +2,8 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, computed_field
 from typing import List
 import json
+import os
+import tempfile
 
 class Settings(BaseSettings):
     app_env: str = "dev"
@@ -21,6 +23,71 @@ class Settings(BaseSettings):
     rate_limit_per_min: int = 120
     log_level: str = "info"
 
+    # Write-behind ingest: queue validated readings and commit them in batches
+    ingest_async: bool = False
+    ingest_queue_max: int = 20000          # readings; beyond this ingest answers 503
+    ingest_flush_rows: int = 500           # flush as soon as this many are queued
+    ingest_flush_interval_ms: int = 250    # ... and at least this often
+
+    # Max seconds before site/device changes made by another worker are seen
+    registry_refresh_sec: int = 30
+
+    # argon2 runs on a thread pool of this size; beyond max_waiting queued calls, 503
+    password_hash_workers: int = 2
+    password_hash_max_waiting: int = 64
+
+    # API key cache lifetime; bounds how long another worker accepts a revoked
+    # key if the revocation message does not reach it over the stream bridge
+    api_key_cache_ttl_sec: int = 60
+
+    # Token validation cache
+    user_cache_ttl_sec: int = 30
+    token_sync_sec: int = 15  # max delay before another worker's logout is enforced here
+
+    # Answer metrics/series from sensor_rollups for whole hours and days.
+    # Off by default: turn on once rebuild_rollups.py has backfilled existing
+    # data, or reads undercount every range that starts before the migration.
+    rollup_reads: bool = False
+    # Max seconds before ingested readings reach the stored percentile sketches
+    sketch_flush_sec: int = 30
+
+    # Shared latest-reading table (mmap); empty path = /dev/shm/sparing_latest
+    latest_path: str = ""
+    latest_slots: int = 8192  # (site, device) pairs, plus one per site
+    # Live stream (SSE): buffered events per client before it is dropped as too slow.
+    # STREAM_BRIDGE=unix fans events out to the other workers over sockets in
+    # STREAM_SOCKET_DIR (default /dev/shm/sparing_stream); "memory" keeps them in-process.
+    stream_queue_max: int = 64
+    stream_keepalive_sec: int = 15
+    stream_bridge: str = "unix"
+    stream_socket_dir: str = ""
+
+    # Response cache: CACHE_BACKEND=memory keeps it per worker, "sqlite" shares a
+    # file between the workers of a host (CACHE_PATH, default /dev/shm/sparing_cache.sqlite)
+    # and "resp" a Redis-protocol server at CACHE_URL. Entries beyond either bound
+    # are evicted; expired entries are swept every CACHE_SWEEP_SEC
+    cache_backend: str = "memory"
+    cache_path: str = ""
+    cache_url: str = "redis://localhost:6379/0"
+    cache_max_entries: int = 20000
+    cache_max_mb: int = 64
+    cache_sweep_sec: int = 5
+
+    # Data-quality flags from ingest: spikes beyond QUALITY_SPIKE_Z standard deviations
+    # of the last QUALITY_WINDOW readings, windows with no variation at all, and
+    # parameters silent for 5 reporting intervals (at least QUALITY_STALE_MIN_SEC)
+    quality_window: int = 30
+    quality_spike_z: float = 6.0
+    quality_stale_min_sec: int = 900
+    quality_flush_sec: int = 10
+
+    # A device (or site) counts as online if it reported within this many seconds
+    device_online_sec: int = 900
+
+    # Ingest accounting: per-minute counters flushed to ingest_stats
+    ingest_stats_flush_sec: int = 10
+    ingest_stats_retention_days: int = 90
+
     # 👇 add these two so pydantic accepts the values from .env
     gunicorn_workers: int = 2
     uvicorn_workers: int = 1
@@ -43,6 +110,11 @@ class Settings(BaseSettings):
         # Fall back to comma-separated values
         return [s.strip() for s in v.split(",") if s.strip()]
 
+    def shm_path(self, name: str) -> str:
+        """Path for files shared by the workers of this host (in /dev/shm when available)."""
+        base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        return os.path.join(base, name)
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_prefix="",
@@ -1,5 +1,9 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ColumnElement
+from sqlalchemy.sql.visitors import InternalTraversal
 from app.core.config import settings
 
 engine = create_async_engine(settings.db_url, pool_pre_ping=True, pool_recycle=1800)
@@ -16,3 +20,76 @@ async def init_models():
     # Alembic handles migrations; this just ensures connection OK
     async with engine.begin() as conn:
         await conn.run_sync(lambda _: None)
+
+async def upsert(db: AsyncSession, model, rows: list[dict], keys: list[str], update) -> None:
+    """
+    Multi-row insert that updates rows colliding on the unique key `keys`.
+
+    `update(current, incoming)` returns the SET mapping; `current` is the
+    table's column collection and `incoming` the would-be-inserted values.
+    Renders ON DUPLICATE KEY UPDATE on MySQL and ON CONFLICT elsewhere.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    if db.get_bind().dialect.name == "mysql":
+        stmt = mysql.insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update(update(table.c, stmt.inserted))
+    else:
+        stmt = sqlite.insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(index_elements=keys, set_=update(table.c, stmt.excluded))
+    await db.execute(stmt)
+
+async def estimate_rows(db: AsyncSession, stmt) -> int | None:
+    """
+    Optimizer row estimate for `stmt` from index statistics (MySQL EXPLAIN).
+
+    Costs one index dive instead of a scan. Returns None on dialects that
+    do not expose an estimate; callers fall back to an exact count.
+    """
+    bind = db.get_bind()
+    if bind.dialect.name != "mysql":
+        return None
+    compiled = stmt.compile(dialect=bind.dialect)
+    params = tuple(compiled.params[k] for k in compiled.positiontup or ())
+    conn = await db.connection()
+    res = await conn.exec_driver_sql("EXPLAIN " + compiled.string, params)
+    rows = res.mappings().all()
+    if not rows:
+        return None
+    return int(rows[0].get("rows") or 0)
+
+
+class greatest(ColumnElement):
+    """GREATEST(a, b); SQLite spells the scalar form MAX(a, b)."""
+    inherit_cache = True
+    _traverse_internals = [("a", InternalTraversal.dp_clauseelement), ("b", InternalTraversal.dp_clauseelement)]
+
+    def __init__(self, a, b):
+        self.a, self.b = a, b
+        self.type = a.type
+
+
+class least(greatest):
+    """LEAST(a, b); SQLite spells the scalar form MIN(a, b)."""
+    inherit_cache = True
+
+
+@compiles(greatest)
+def _greatest(el, compiler, **kw):
+    return f"GREATEST({compiler.process(el.a, **kw)}, {compiler.process(el.b, **kw)})"
+
+
+@compiles(least)
+def _least(el, compiler, **kw):
+    return f"LEAST({compiler.process(el.a, **kw)}, {compiler.process(el.b, **kw)})"
+
+
+@compiles(greatest, "sqlite")
+def _greatest_sqlite(el, compiler, **kw):
+    return f"MAX({compiler.process(el.a, **kw)}, {compiler.process(el.b, **kw)})"
+
+
+@compiles(least, "sqlite")
+def _least_sqlite(el, compiler, **kw):
+    return f"MIN({compiler.process(el.a, **kw)}, {compiler.process(el.b, **kw)})"
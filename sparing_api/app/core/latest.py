@@ -0,0 +1,420 @@
+"""
+Latest reading per (site, device), shared by all workers through mmap.
+
+The table is a file in /dev/shm mapped by every gunicorn worker: a 64-byte
+header followed by fixed-size slots in an open-addressing hash table keyed
+by (site_id, device_id). Device -1 holds the newest reading of the whole
+site. Ingest paths call `record()` after their commit, so every worker
+sees a reading as soon as it is committed.
+
+Writers serialize on flock(). Readers take no lock: each slot starts with
+a sequence number that a writer makes odd before changing the slot and
+even again afterwards (a seqlock), and a reader retries until it sees the
+same even number before and after copying the slot. Keys are never
+removed, so a probe sequence that reaches an empty slot is a definite
+miss.
+
+Every slot also counts the batches committed for its key, and the header
+holds a version counter for site/device metadata; both back the ETags of
+the read endpoints (`data_version()`, `meta_version()`). Site slots also
+count the batches holding readings older than the current hour
+(`history_version()`), which key the cached closed-hour aggregates.
+
+A slot created by ingest only knows readings since the table was created,
+so it is marked complete only once merged with the database's latest row
+(`warm()` at startup, or `record(..., complete=True)` after a fallback
+query). Readers treat incomplete slots as misses. Merging keeps the
+greater (ts, id), so a fallback query racing with ingest cannot go back
+in time. A fallback that finds no rows stores an empty complete slot, so
+sites and devices without readings are not queried again; get() returns
+{} for them.
+"""
+import fcntl
+import mmap
+import os
+import struct
+from datetime import datetime, timezone
+
+from sqlalchemy import select, func, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.models.models import SensorData, SENSOR_FIELDS
+from app.utils.time import grid
+
+SITE_LEVEL = -1
+READING_KEYS = ("id", "ts", "site_id", "device_id", *SENSOR_FIELDS)  # as returned by /data/last
+MAGIC = b"SPLT"
+VERSION = 4
+HEADER = struct.Struct("<4sIIII")  # magic, version, slots, slot size, field count
+META = struct.Struct("<qqq")  # table epoch, metadata version, metadata changed at (us)
+META_OFFSET = 24
+HEADER_SIZE = 64
+# seq, site_id, device_id, null mask, row id, ts (us), changed at (us), change count,
+# late change count, device of the reading (0 = none; the site slot keeps it too), readings
+SLOT = struct.Struct("<IiiIqqqqqi%dd" % len(SENSOR_FIELDS))
+SEQ = struct.Struct("<I")
+MAX_READ_RETRIES = 1000
+COMPLETE = 1 << 31  # mask bit: slot has been merged with the database
+
+
+def _us(ts: datetime) -> int:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() * 1_000_000)
+
+
+def _ts(us: int) -> datetime:
+    # Naive UTC, as sensor_data.ts comes back from MySQL
+    return datetime.fromtimestamp(us / 1_000_000, timezone.utc).replace(tzinfo=None)
+
+
+def latest_rows_stmt(site_ids=None, by_device: bool = False):
+    """Groupwise max: sensor_data rows at MAX(ts) per site (or per site and device)."""
+    keys = [SensorData.site_id, SensorData.device_id] if by_device else [SensorData.site_id]
+    sub = select(*keys, func.max(SensorData.ts).label("max_ts")).group_by(*keys)
+    if site_ids is not None:
+        sub = sub.where(SensorData.site_id.in_(site_ids))
+    if by_device:
+        sub = sub.where(SensorData.device_id.isnot(None))
+    sub = sub.subquery()
+    cond = [SensorData.site_id == sub.c.site_id, SensorData.ts == sub.c.max_ts]
+    if by_device:
+        cond.append(SensorData.device_id == sub.c.device_id)
+    cols = [getattr(SensorData, c) for c in ("id", "site_id", "device_id", "ts", *SENSOR_FIELDS)]
+    return select(*cols).join(sub, and_(*cond))
+
+
+async def _latest_by_key(db: AsyncSession, site_ids, by_device: bool) -> dict[tuple[int, int], dict]:
+    """latest_rows_stmt() rows keyed (site_id, device_id or SITE_LEVEL); ts ties go to the greater id."""
+    out = {}
+    for r in (await db.execute(latest_rows_stmt(site_ids, by_device))).all():
+        row = dict(r._mapping)
+        key = (row["site_id"], row["device_id"] if by_device else SITE_LEVEL)
+        cur = out.get(key)
+        if cur is None or row["id"] > cur["id"]:
+            out[key] = row
+    return out
+
+
+class LatestTable:
+    def __init__(self, path: str, slots: int):
+        self.path = path
+        self.slots = slots
+        self._fd: int | None = None
+        self._mm: mmap.mmap | None = None
+
+    # ---- setup ----
+
+    def open(self) -> None:
+        """Map the table, creating it if needed. The layout is part of the file name."""
+        if self._mm is not None:
+            return
+        size = HEADER_SIZE + self.slots * SLOT.size
+        path = f"{self.path}.v{VERSION}.{self.slots}x{SLOT.size}"
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            expected = HEADER.pack(MAGIC, VERSION, self.slots, SLOT.size, len(SENSOR_FIELDS))
+            current = os.pread(fd, HEADER.size, 0)
+            if current != expected or os.fstat(fd).st_size != size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, expected, 0)
+                epoch = int.from_bytes(os.urandom(8), "little") >> 1
+                os.pwrite(fd, META.pack(epoch, 0, _us(datetime.now(timezone.utc))), META_OFFSET)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._mm = mmap.mmap(fd, size)
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            os.close(self._fd)
+            self._mm, self._fd = None, None
+
+    # ---- reads (lock-free) ----
+
+    def _offset(self, i: int) -> int:
+        return HEADER_SIZE + i * SLOT.size
+
+    def _read(self, off: int) -> tuple:
+        mm = self._mm
+        for _ in range(MAX_READ_RETRIES):
+            (seq,) = SEQ.unpack_from(mm, off)
+            if seq & 1:
+                continue
+            slot = SLOT.unpack_from(mm, off)
+            if slot[0] == seq == SEQ.unpack_from(mm, off)[0]:
+                return slot
+        raise RuntimeError("latest-reading slot is being rewritten")
+
+    def _probe(self, site_id: int, device_id: int):
+        start = (site_id * 1000003 + device_id) % self.slots
+        for n in range(self.slots):
+            yield self._offset((start + n) % self.slots)
+
+    def get(self, site_id: int, device_id: int = SITE_LEVEL) -> dict | None:
+        """
+        Latest reading for (site, device): {} if it is known to have none,
+        None if the slot is missing or incomplete.
+        """
+        if self._mm is None:
+            return None
+        for off in self._probe(site_id, device_id):
+            try:
+                slot = self._read(off)
+            except RuntimeError:
+                return None
+            if slot[1] == 0:
+                return None
+            if slot[1] == site_id and slot[2] == device_id:
+                if not slot[3] & COMPLETE:
+                    return None
+                return self._unpack(slot) if slot[4] or slot[5] else {}
+        return None
+
+    def _unpack(self, slot: tuple) -> dict:
+        _, site_id, _, mask, row_id, ts_us, written_us, _, _, device_id = slot[:10]
+        out = {
+            "id": row_id or None,
+            "ts": _ts(ts_us),
+            "site_id": site_id,
+            "device_id": device_id or None,
+            "written_at": _ts(written_us),
+        }
+        for i, f in enumerate(SENSOR_FIELDS):
+            out[f] = slot[10 + i] if mask & (1 << i) else None
+        return out
+
+    # ---- change tracking (lock-free reads) ----
+
+    def _site_slot(self, site_id: int) -> tuple | None:
+        for off in self._probe(site_id, SITE_LEVEL):
+            try:
+                slot = self._read(off)
+            except RuntimeError:
+                return None
+            if slot[1] == 0:
+                return None
+            if slot[1] == site_id and slot[2] == SITE_LEVEL:
+                return slot
+        return None
+
+    def data_version(self, site_id: int) -> tuple[str, datetime] | None:
+        """
+        (version, last change) of a site's readings, changing with every
+        committed batch; None if the site has no slot yet (load() creates it).
+        """
+        if self._mm is None:
+            return None
+        epoch = META.unpack_from(self._mm, META_OFFSET)[0]
+        slot = self._site_slot(site_id)
+        return (f"{epoch:x}.{slot[7]}", _ts(slot[6])) if slot else None
+
+    def history_version(self, site_id: int) -> str | None:
+        """
+        Version of a site's readings before the current hour, changing with
+        every committed batch that holds one; None if the site has no slot.
+        """
+        if self._mm is None:
+            return None
+        epoch = META.unpack_from(self._mm, META_OFFSET)[0]
+        slot = self._site_slot(site_id)
+        return f"{epoch:x}.{slot[8]}" if slot else None
+
+    async def load_version(self, db: AsyncSession, site_id: int) -> tuple[str, datetime] | None:
+        """data_version(), creating the site's slot from the database first if needed."""
+        version = self.data_version(site_id)
+        if version is None and self._mm is not None:
+            await self.load(db, site_id)
+            version = self.data_version(site_id)
+        return version
+
+    def meta_version(self) -> tuple[str, datetime] | None:
+        """(version, last change) of site and device metadata, as bumped by bump_meta()."""
+        if self._mm is None:
+            return None
+        epoch, version, changed_us = META.unpack_from(self._mm, META_OFFSET)
+        return f"{epoch:x}.{version}", _ts(changed_us)
+
+    def bump_meta(self) -> None:
+        """Record a committed change to sites or devices, for every worker."""
+        if self._mm is None:
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            epoch, version, _ = META.unpack_from(self._mm, META_OFFSET)
+            META.pack_into(self._mm, META_OFFSET, epoch, version + 1, _us(datetime.now(timezone.utc)))
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    # ---- writes (flock) ----
+
+    def record(self, rows: list[dict], ids: list[int], complete: bool = False) -> None:
+        """
+        Publish committed sensor_data rows (with their ids). Keeps, per site
+        and per device, the reading with the greatest (ts, id). Pass
+        complete=True for rows known to be the database's latest.
+        """
+        if self._mm is None or not rows:
+            return
+        hour = _us(grid(datetime.now(timezone.utc), 3600))
+        newest: dict[tuple, tuple] = {}
+        late: set[int] = set()
+        for row, row_id in zip(rows, ids):
+            k = (_us(row["ts"]), row_id or 0)
+            site_id = row["site_id"]
+            if k[0] < hour and not complete:
+                late.add(site_id)
+            keys = [(site_id, SITE_LEVEL)]
+            if row.get("device_id"):
+                keys.append((site_id, row["device_id"]))
+            for key in keys:
+                cur = newest.get(key)
+                if cur is None or k > cur[0]:
+                    newest[key] = (k, row)
+        now = _us(datetime.now(timezone.utc))
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for (site_id, device_id), ((ts_us, row_id), row) in newest.items():
+                self._write(
+                    site_id, device_id, row_id, ts_us, now, row, complete, changed=not complete,
+                    late=device_id == SITE_LEVEL and site_id in late,
+                )
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def bump_site(self, site_id: int) -> None:
+        """
+        Record a change to a site's stored history made outside ingest (a
+        rollup rebuild): bumps its data and history versions, for every worker.
+        """
+        if self._mm is None:
+            return
+        now = _us(datetime.now(timezone.utc))
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for off in self._probe(site_id, SITE_LEVEL):
+                slot = SLOT.unpack_from(self._mm, off)
+                if slot[1] == 0:
+                    return
+                if slot[1] == site_id and slot[2] == SITE_LEVEL:
+                    self._store(off, slot[0], slot[1:6] + (now, slot[7] + 1, slot[8] + 1) + slot[9:])
+                    return
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _write(
+        self, site_id: int, device_id: int, row_id: int, ts_us: int, now: int, row: dict,
+        complete: bool, changed: bool, late: bool = False,
+    ) -> None:
+        """
+        Merge one reading into its slot. `changed` (new data was committed)
+        bumps the change count, `late` (some of it before the current hour)
+        the late change count.
+        """
+        mm = self._mm
+        changes, late_changes, written = int(changed), int(late), now
+        for off in self._probe(site_id, device_id):
+            slot = SLOT.unpack_from(mm, off)
+            if slot[1] == 0:
+                break
+            if slot[1] == site_id and slot[2] == device_id:
+                complete = complete or bool(slot[3] & COMPLETE)
+                changes = slot[7] + int(changed)
+                late_changes = slot[8] + int(late)
+                written = now if changed else slot[6]
+                if (ts_us, row_id) <= (slot[5], slot[4]):
+                    # Late reading: keep the newer one, but count the change and take over the complete flag
+                    if changed or (complete and not slot[3] & COMPLETE):
+                        mask = slot[3] | COMPLETE if complete else slot[3]
+                        self._store(
+                            off, slot[0], slot[1:3] + (mask, slot[4], slot[5], written, changes, late_changes) + slot[9:],
+                        )
+                    return
+                break
+        else:
+            logger.warning("Latest-reading table is full; raise LATEST_SLOTS")
+            return
+        mask = COMPLETE if complete else 0
+        values = []
+        for i, f in enumerate(SENSOR_FIELDS):
+            v = row.get(f)
+            if v is not None:
+                mask |= 1 << i
+            values.append(float(v) if v is not None else 0.0)
+        self._store(
+            off, slot[0],
+            (site_id, device_id, mask, row_id, ts_us, written, changes, late_changes, row.get("device_id") or 0, *values),
+        )
+
+    def _store(self, off: int, seq: int, fields: tuple) -> None:
+        mm = self._mm
+        # An odd seq here means a writer died mid-update; it stays odd until we finish
+        busy = seq if seq & 1 else (seq + 1) & 0xFFFFFFFF
+        SEQ.pack_into(mm, off, busy)
+        SLOT.pack_into(mm, off, busy, *fields)
+        SEQ.pack_into(mm, off, (busy + 1) & 0xFFFFFFFF)
+
+    async def warm(self, db: AsyncSession) -> None:
+        """Merge the database's latest row per site and per device into the table."""
+        for by_device in (False, True):
+            self._complete(await _latest_by_key(db, None, by_device), [])
+
+    async def load(self, db: AsyncSession, site_id: int) -> dict | None:
+        """get() for a site slot, falling back to the database on a miss. None if the site has no data."""
+        return (await self.load_many(db, [(site_id, SITE_LEVEL)]))[(site_id, SITE_LEVEL)] or None
+
+    async def load_many(self, db: AsyncSession, keys: list[tuple[int, int]]) -> dict[tuple[int, int], dict]:
+        """
+        get() for many (site_id, device_id) keys; the misses are loaded with
+        at most two groupwise-max queries. Keys without readings map to {}.
+        """
+        out = {key: self.get(*key) for key in keys}
+        missing = [key for key, hit in out.items() if hit is None]
+        if not missing:
+            return out
+        sites = sorted({s for s, d in missing if d == SITE_LEVEL})
+        device_sites = sorted({s for s, d in missing if d != SITE_LEVEL})
+        found = {}
+        if sites:
+            found.update(await _latest_by_key(db, sites, False))
+        if device_sites:
+            found.update(await _latest_by_key(db, device_sites, True))
+        self._complete(found, missing)
+        for key in missing:
+            out[key] = self.get(*key)
+            if out[key] is None:
+                # Table not mapped (or slot stuck): answer from the query
+                out[key] = found.get(key, {})
+        return out
+
+    def _complete(self, rows: dict[tuple[int, int], dict], empty: list[tuple[int, int]]) -> None:
+        """Merge database rows into their slots as complete; mark other `empty` keys as having none."""
+        if self._mm is None:
+            return
+        now = _us(datetime.now(timezone.utc))
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for (site_id, device_id), row in rows.items():
+                self._write(site_id, device_id, row["id"], _us(row["ts"]), now, row, True, changed=False)
+            for key in empty:
+                if key not in rows:
+                    self._write(*key, 0, 0, now, {}, True, changed=False)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def clear(self) -> None:
+        if self._mm is None:
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            self._mm[HEADER_SIZE:] = bytes(len(self._mm) - HEADER_SIZE)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+latest_readings = LatestTable(settings.latest_path or settings.shm_path("sparing_latest"), settings.latest_slots)
@@ -0,0 +1,178 @@
+"""
+Process-wide registry of sites and their devices.
+
+Maps site uid -> SiteEntry (id, active flag, device identifiers) so hot
+ingest and read paths resolve metadata without a database round trip.
+The registry is warmed at startup, patched by the site/device mutation
+handlers of this worker, and fully reloaded every REGISTRY_REFRESH_SEC so
+changes made through other gunicorn workers show up within that bound.
+Unknown uids fall through to the database and are negatively cached for a
+few seconds.
+
+refresh_site()/drop_site() also bump the shared metadata version, which
+the ETags of /sites and /devices are derived from, and invalidate the
+site's cached responses in every worker.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import cache, site_tag, history_tag
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.core.latest import latest_readings
+from app.core.logging import logger
+from app.models.models import Site, SensorDevice
+
+MISS_TTL_SECONDS = 5
+
+
+@dataclass
+class SiteEntry:
+    id: int
+    uid: str
+    is_active: bool
+    # serial_no and name -> device id, as matched by /api/post-data
+    devices: dict[str, int] = field(default_factory=dict)
+
+    def find_device(self, identifier: str) -> int | None:
+        return self.devices.get(identifier)
+
+
+def _entry(site: Site, devices) -> SiteEntry:
+    e = SiteEntry(id=site.id, uid=site.uid, is_active=bool(site.is_active))
+    for d in devices:
+        # serial_no wins over a device whose name happens to collide
+        if d.name:
+            e.devices.setdefault(d.name, d.id)
+        if d.serial_no:
+            e.devices[d.serial_no] = d.id
+    return e
+
+
+class SiteRegistry:
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._by_uid: dict[str, SiteEntry] = {}
+        self._by_id: dict[int, SiteEntry] = {}
+        self._misses: dict[str, float] = {}
+        self._task: asyncio.Task | None = None
+
+    # ---- lookups ----
+
+    def get(self, uid: str) -> SiteEntry | None:
+        return self._by_uid.get(uid)
+
+    def by_id(self, site_id: int) -> SiteEntry | None:
+        return self._by_id.get(site_id)
+
+    async def resolve(self, db: AsyncSession, uid: str) -> SiteEntry | None:
+        """Site entry for `uid`, querying the database only on a registry miss."""
+        e = self._by_uid.get(uid)
+        if e is not None:
+            return e
+        if self._misses.get(uid, 0) > time.monotonic():
+            return None
+        found = await self.resolve_many(db, [uid])
+        return found.get(uid)
+
+    async def resolve_many(self, db: AsyncSession, uids) -> dict[str, SiteEntry]:
+        """Entries for all known `uids`; misses are loaded with one IN query."""
+        out, missing = {}, []
+        now = time.monotonic()
+        for uid in uids:
+            e = self._by_uid.get(uid)
+            if e is not None:
+                out[uid] = e
+            elif self._misses.get(uid, 0) <= now:
+                missing.append(uid)
+        if missing:
+            sites = (await db.execute(select(Site).where(Site.uid.in_(missing)))).scalars().all()
+            loaded = await self._load(db, sites)
+            for e in loaded:
+                self._put(e)
+                out[e.uid] = e
+            for uid in missing:
+                if uid not in out:
+                    self._misses[uid] = now + MISS_TTL_SECONDS
+        return out
+
+    # ---- maintenance ----
+
+    async def _load(self, db: AsyncSession, sites) -> list[SiteEntry]:
+        if not sites:
+            return []
+        ids = [s.id for s in sites]
+        devs: dict[int, list] = {}
+        res = await db.execute(
+            select(SensorDevice.id, SensorDevice.site_id, SensorDevice.name, SensorDevice.serial_no)
+            .where(SensorDevice.site_id.in_(ids))
+            .order_by(SensorDevice.id)
+        )
+        for d in res.all():
+            devs.setdefault(d.site_id, []).append(d)
+        return [_entry(s, devs.get(s.id, [])) for s in sites]
+
+    def _put(self, e: SiteEntry) -> None:
+        old = self._by_id.get(e.id)
+        if old is not None and old.uid != e.uid:
+            self._by_uid.pop(old.uid, None)
+        self._by_uid[e.uid] = e
+        self._by_id[e.id] = e
+        self._misses.pop(e.uid, None)
+
+    async def warm(self, db: AsyncSession | None = None) -> None:
+        """(Re)load every site and device, swapping the maps in one step."""
+        if db is None:
+            async with SessionLocal() as session:
+                return await self.warm(session)
+        sites = (await db.execute(select(Site))).scalars().all()
+        entries = await self._load(db, sites)
+        self._by_uid = {e.uid: e for e in entries}
+        self._by_id = {e.id: e for e in entries}
+        self._misses = {}
+
+    async def refresh_site(self, db: AsyncSession, site_id: int) -> None:
+        """Reload one site and its devices after a mutation in this worker."""
+        latest_readings.bump_meta()
+        await cache.invalidate(site_tag(site_id))
+        site = (await db.execute(select(Site).where(Site.id == site_id))).scalar_one_or_none()
+        if site is None:
+            await self.drop_site(site_id)
+            return
+        for e in await self._load(db, [site]):
+            self._put(e)
+
+    async def drop_site(self, site_id: int) -> None:
+        latest_readings.bump_meta()
+        await cache.invalidate(site_tag(site_id), history_tag(site_id))
+        e = self._by_id.pop(site_id, None)
+        if e is not None:
+            self._by_uid.pop(e.uid, None)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.warm()
+            except Exception:
+                logger.exception("Site registry refresh failed")
+
+
+site_registry = SiteRegistry(refresh_interval=settings.registry_refresh_sec)
@@ -1,5 +1,8 @@
 from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List
+import asyncio
+import time
 import jwt
 from passlib.hash import argon2
 from fastapi import HTTPException, status, Security
@@ -7,6 +10,7 @@ from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 import uuid
 
 from app.core.config import settings
+from app.core.telemetry import PASSWORD_HASH_WAITING, PASSWORD_HASH_WAIT_SECONDS, PASSWORD_HASH_SECONDS
 
 bearer_scheme = HTTPBearer(auto_error=False)
 
@@ -21,6 +25,39 @@ def hash_password(p: str) -> str:
 def verify_password(p: str, h: str) -> bool:
     return argon2.verify(p, h)
 
+# argon2 is deliberately slow (tens of ms) and releases the GIL, so request
+# handlers run it on a small thread pool instead of blocking the event loop.
+_hash_executor = ThreadPoolExecutor(max_workers=settings.password_hash_workers, thread_name_prefix="argon2")
+_hash_slots = asyncio.Semaphore(settings.password_hash_workers)
+_hash_waiting = 0
+
+async def _offload(fn, *args):
+    global _hash_waiting
+    if _hash_waiting >= settings.password_hash_max_waiting:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server busy, try again", headers={"Retry-After": "1"})
+    queued = time.perf_counter()
+    _hash_waiting += 1
+    PASSWORD_HASH_WAITING.set(_hash_waiting)
+    try:
+        await _hash_slots.acquire()
+    finally:
+        _hash_waiting -= 1
+        PASSWORD_HASH_WAITING.set(_hash_waiting)
+    try:
+        started = time.perf_counter()
+        PASSWORD_HASH_WAIT_SECONDS.observe(started - queued)
+        result = await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+        PASSWORD_HASH_SECONDS.observe(time.perf_counter() - started)
+        return result
+    finally:
+        _hash_slots.release()
+
+async def hash_password_async(p: str) -> str:
+    return await _offload(hash_password, p)
+
+async def verify_password_async(p: str, h: str) -> bool:
+    return await _offload(verify_password, p, h)
+
 def create_jwt(sub: str, role: str, user_id: int, site_uids: Optional[List[str]]=None, expires_minutes: int=60, token_type: str="access"):
     now = datetime.now(timezone.utc)
     exp = now + timedelta(minutes=expires_minutes)
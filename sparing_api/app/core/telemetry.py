@@ -0,0 +1,83 @@
+"""
+Prometheus metrics served at /metrics.
+
+Each gunicorn worker keeps its own registry, so values are per process.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+INGEST_QUEUE_DEPTH = Gauge(
+    "sparing_ingest_queue_depth",
+    "Rows waiting in the write-behind ingest queue",
+)
+INGEST_QUEUE_REJECTED = Counter(
+    "sparing_ingest_queue_rejected_total",
+    "Ingest requests rejected with 503 because the queue was full",
+)
+INGEST_FLUSH_SECONDS = Histogram(
+    "sparing_ingest_flush_seconds",
+    "Time spent writing one batch from the ingest queue",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+PASSWORD_HASH_WAITING = Gauge(
+    "sparing_password_hash_waiting",
+    "argon2 hash/verify calls waiting for a free hashing thread",
+)
+PASSWORD_HASH_WAIT_SECONDS = Histogram(
+    "sparing_password_hash_wait_seconds",
+    "Time argon2 calls spent queued before a hashing thread picked them up",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "sparing_password_hash_seconds",
+    "Time spent inside argon2 hash/verify on the hashing pool",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+INGEST_FLUSHED_ROWS = Counter(
+    "sparing_ingest_flushed_rows_total",
+    "Rows written by the ingest queue writer",
+    ["table"],
+)
+INGEST_DROPPED_ROWS = Counter(
+    "sparing_ingest_dropped_rows_total",
+    "Queued rows the database refused (duplicate or invalid) and the writer dropped",
+    ["table", "reason"],
+)
+STREAM_SUBSCRIPTIONS = Gauge(
+    "sparing_stream_subscriptions",
+    "Open live-stream subscriptions in this worker",
+)
+STREAM_DROPPED = Counter(
+    "sparing_stream_dropped_total",
+    "Live-stream subscriptions dropped because the client fell behind",
+)
+STREAM_BRIDGE_ERRORS = Counter(
+    "sparing_stream_bridge_errors_total",
+    "Messages not fanned out to another worker (peer busy, oversize or send error)",
+)
+QUALITY_FLAGS = Counter(
+    "sparing_quality_flags_total",
+    "Data-quality flags raised by the ingest-path detector",
+    ["kind"],
+)
+QUALITY_FLAGS_DROPPED = Counter(
+    "sparing_quality_flags_dropped_total",
+    "Quality flags discarded because the write buffer was full",
+)
+CACHE_REQUESTS = Counter(
+    "sparing_cache_requests_total",
+    "Response cache lookups",
+    ["result"],
+)
+CACHE_EVICTIONS = Counter(
+    "sparing_cache_evictions_total",
+    "Entries removed from the response cache",
+    ["reason"],
+)
+CACHE_ENTRIES = Gauge(
+    "sparing_cache_entries",
+    "Entries in this worker's response cache",
+)
+CACHE_BYTES = Gauge(
+    "sparing_cache_bytes",
+    "Estimated size of this worker's response cache",
+)
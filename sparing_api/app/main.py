@@ -1,21 +1,79 @@
-from fastapi import FastAPI, Request
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse
 from app.core.config import settings
 from app.core.exceptions import APIError
-from app.api.routers import auth, sites, devices, ingest, data, metrics, admin, getdata
+from app.api.routers import auth, sites, devices, ingest, data, metrics, series, compliance, quality, overview, stream, admin, getdata
 from app.middlewares.request_id import RequestIDMiddleware
 from app.middlewares.rate_limit import RateLimitMiddleware
+from app.middlewares.gzip import GZipMiddleware
 from app.core.db import init_models
 from app.core.logging import logger
+from app.core.registry import site_registry
+from app.core.auth_cache import token_sweeper
+from app.services.ingest_queue import ingest_queue
+from app.services.ingest_stats import ingest_stats
+from app.services.sketches import sketch_buffer
+from app.services.quality import quality_monitor
+from app.core.api_keys import api_key_cache
+from app.core.cache import cache
+from app.core.latest import latest_readings
+from app.core.broker import broker, default_bridge
+from app.core.db import SessionLocal
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background workers; flush them on graceful shutdown."""
+    try:
+        await site_registry.warm()
+    except Exception:
+        logger.exception("Site registry warm-up failed; resolving sites lazily")
+    site_registry.start()
+    try:
+        await token_sweeper.run_once()
+    except Exception:
+        logger.exception("Revoked token load failed; checking blacklist per request")
+    token_sweeper.start()
+    try:
+        latest_readings.open()
+        async with SessionLocal() as db:
+            await latest_readings.warm(db)
+    except Exception:
+        logger.exception("Latest-reading table warm-up failed; loading sites on first read")
+    try:
+        broker.start(default_bridge())
+    except Exception:
+        logger.exception("Stream bridge failed to start; live events stay within this worker")
+    cache.start()
+    api_key_cache.start()
+    ingest_stats.start()
+    sketch_buffer.start()
+    quality_monitor.start()
+    if settings.ingest_async:
+        ingest_queue.start()
+    yield
+    if settings.ingest_async:
+        await ingest_queue.stop()
+    await sketch_buffer.stop()
+    await quality_monitor.stop()
+    await ingest_stats.stop()
+    await site_registry.stop()
+    await token_sweeper.stop()
+    await cache.stop()
+    broker.stop()
+    latest_readings.close()
+
 
 # Create FastAPI app
 app = FastAPI(
     title="SPARING API",
     version="1.0.0",
     description="Environmental Monitoring System API",
-    default_response_class=JSONResponse
+    default_response_class=JSONResponse,
+    lifespan=lifespan,
 )
 
 # ========================================
@@ -50,8 +108,8 @@ async def general_exception_handler(request: Request, exc: Exception):
 # Middleware Stack
 # ========================================
 
-# GZip compression for responses > 500 bytes
-app.add_middleware(GZipMiddleware, minimum_size=500)
+# GZip compression for responses > 500 bytes (not for live streams)
+app.add_middleware(GZipMiddleware, minimum_size=500, exclude_prefixes=("/stream/",))
 
 # Request ID for tracing
 app.add_middleware(RequestIDMiddleware)
@@ -82,6 +140,11 @@ app.include_router(devices.router, prefix="/devices", tags=["Devices"])
 app.include_router(ingest.router, prefix="/ingest", tags=["Ingest"])
 app.include_router(data.router, prefix="/data", tags=["Data"])
 app.include_router(metrics.router, tags=["Metrics"])
+app.include_router(series.router, tags=["Metrics"])
+app.include_router(compliance.router, tags=["Metrics"])
+app.include_router(quality.router, tags=["Metrics"])
+app.include_router(overview.router, tags=["Dashboard"])
+app.include_router(stream.router, prefix="/stream", tags=["Dashboard"])
 app.include_router(admin.router, prefix="/admin", tags=["Admin"])
 app.include_router(getdata.router, tags=["GetData"])
 
@@ -119,6 +182,11 @@ async def readyz():
             status_code=503
         )
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint (per worker process)."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/", tags=["Root"])
 async def root():
     """API root endpoint."""
@@ -0,0 +1,21 @@
+from starlette.middleware.gzip import GZipMiddleware as _GZipMiddleware
+from starlette.types import Receive, Scope, Send
+
+
+class GZipMiddleware(_GZipMiddleware):
+    """
+    GZipMiddleware that leaves the given path prefixes uncompressed.
+
+    Server-Sent Events must skip it: the compressor holds small frames back
+    until it has enough output, so events would reach clients late.
+    """
+
+    def __init__(self, app, minimum_size: int = 500, compresslevel: int = 9, exclude_prefixes: tuple[str, ...] = ()):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+        self.exclude_prefixes = tuple(exclude_prefixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].startswith(self.exclude_prefixes):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
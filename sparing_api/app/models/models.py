@@ -1,4 +1,4 @@
-from sqlalchemy import String, Integer, Boolean, DateTime, ForeignKey, Float, JSON, UniqueConstraint, Index, Text
+from sqlalchemy import String, Integer, Boolean, DateTime, ForeignKey, Float, Double, JSON, UniqueConstraint, Index, Text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime, timezone
 from app.core.db import Base
@@ -100,7 +100,14 @@ class SensorData(Base):
         Index("ix_sensor_data_site_ts_desc", "site_id", "ts"),
     )
 
+# Numeric reading columns of SensorData, in table order.
+SENSOR_FIELDS = (
+    "ph", "tss", "debit", "nh3n", "cod", "temp", "rh", "wind_speed_kmh", "wind_deg", "noise",
+    "co", "so2", "no2", "o3", "pm25", "pm10", "tvoc", "voltage", "current",
+)
+
 class IngestLog(Base):
+    """Legacy per-request ingest audit rows; no longer written (see IngestStat)."""
     __tablename__ = "ingest_logs"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     source_ip: Mapped[str | None] = mapped_column(String(64), nullable=True)
@@ -109,6 +116,101 @@ class IngestLog(Base):
     error_msg: Mapped[str | None] = mapped_column(Text, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, index=True)
 
+class IngestStat(Base):
+    """Per-minute ingest counters; replaces one ingest_logs row per request."""
+    __tablename__ = "ingest_stats"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)  # minute start, UTC
+    source: Mapped[str] = mapped_column(String(32))  # api / bulk / getdata
+    status: Mapped[str] = mapped_column(String(16))  # ok / error
+    site_id: Mapped[int] = mapped_column(Integer, default=0)  # 0 = site could not be resolved
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    sample_errors: Mapped[list | None] = mapped_column(JSON, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("bucket", "source", "status", "site_id", name="uq_ingest_stats_key"),
+    )
+
+class SensorRollup(Base):
+    """
+    Running aggregates of one reading column per site, device and time bucket.
+
+    Maintained in the same transaction as the sensor_data inserts. Bucket
+    starts are UTC instants aligned to settings.tz (1d = local midnight).
+    param "_rows" counts rows regardless of which columns are set. Sums
+    are DOUBLE: MySQL FLOAT is single precision and would drift with count.
+    """
+    __tablename__ = "sensor_rollups"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    site_id: Mapped[int] = mapped_column(Integer)
+    granularity: Mapped[str] = mapped_column(String(4))  # 1h / 1d
+    param: Mapped[str] = mapped_column(String(32))
+    bucket: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    device_id: Mapped[int] = mapped_column(Integer, default=0)  # 0 = no device
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    sum: Mapped[float] = mapped_column(Double, default=0.0)
+    min: Mapped[float | None] = mapped_column(Double, nullable=True)
+    max: Mapped[float | None] = mapped_column(Double, nullable=True)
+    sumsq: Mapped[float] = mapped_column(Double, default=0.0)
+
+    __table_args__ = (
+        # also serves range reads: site, granularity, param, bucket range
+        UniqueConstraint("site_id", "granularity", "param", "bucket", "device_id", name="uq_sensor_rollups_key"),
+    )
+
+class SensorSketch(Base):
+    """t-digest of one reading column per site and local day (see app.services.sketches)."""
+    __tablename__ = "sensor_sketches"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    site_id: Mapped[int] = mapped_column(Integer)
+    param: Mapped[str] = mapped_column(String(32))
+    day: Mapped[datetime] = mapped_column(DateTime(timezone=True))  # local midnight, as UTC
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    digest: Mapped[dict] = mapped_column(JSON)
+
+    __table_args__ = (
+        UniqueConstraint("site_id", "param", "day", name="uq_sensor_sketches_key"),
+    )
+
+class ComplianceThreshold(Base):
+    """
+    Limit for one reading column at one site (baku mutu). A site with no
+    rows uses app.services.compliance.DEFAULT_THRESHOLDS. Limits are inclusive.
+    """
+    __tablename__ = "compliance_thresholds"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    site_id: Mapped[int] = mapped_column(ForeignKey("sites.id", ondelete="CASCADE"))
+    param: Mapped[str] = mapped_column(String(32))
+    min_value: Mapped[float | None] = mapped_column(Float, nullable=True)
+    max_value: Mapped[float | None] = mapped_column(Float, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, onupdate=utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("site_id", "param", name="uq_compliance_thresholds_key"),
+    )
+
+class QualityFlag(Base):
+    """
+    Data-quality event on one reading column (see app.services.quality).
+    kind: spike / flatline / stale; ts is the reading that raised it (for
+    stale, the last one received). device_id 0 = no device.
+    """
+    __tablename__ = "quality_flags"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    site_id: Mapped[int] = mapped_column(Integer)
+    device_id: Mapped[int] = mapped_column(Integer, default=0)
+    param: Mapped[str] = mapped_column(String(32))
+    kind: Mapped[str] = mapped_column(String(16))
+    ts: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    value: Mapped[float | None] = mapped_column(Float, nullable=True)
+    detail: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow)
+
+    __table_args__ = (
+        # also serves range reads per site; workers flagging the same event collapse into one row
+        UniqueConstraint("site_id", "ts", "device_id", "param", "kind", name="uq_quality_flags_key"),
+    )
+
 class ApiKey(Base):
     __tablename__ = "api_keys"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -2,10 +2,12 @@ from pydantic import BaseModel, Field, ConfigDict
 from typing import Any, List, Optional
 
 class Page(BaseModel):
-    total: int
+    total: Optional[int] = None
     page: int = 1
     per_page: int = 50
     items: list[Any]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
 
 class Message(BaseModel):
     ok: bool = True
@@ -0,0 +1,30 @@
+from pydantic import BaseModel, field_validator, model_validator
+
+from app.models.models import SENSOR_FIELDS
+
+
+class ThresholdIn(BaseModel):
+    min: float | None = None
+    max: float | None = None
+
+    @model_validator(mode="after")
+    def check_bounds(self):
+        if self.min is None and self.max is None:
+            raise ValueError("min or max is required")
+        if self.min is not None and self.max is not None and self.min > self.max:
+            raise ValueError("min must not exceed max")
+        return self
+
+
+class ThresholdsIn(BaseModel):
+    thresholds: dict[str, ThresholdIn]
+
+    @field_validator("thresholds")
+    @classmethod
+    def check_params(cls, v: dict[str, ThresholdIn]):
+        unknown = sorted(set(v) - set(SENSOR_FIELDS))
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(unknown)}")
+        if not v:
+            raise ValueError("At least one threshold is required")
+        return v
@@ -0,0 +1,155 @@
+"""
+Compliance (baku mutu) evaluation of sensor readings against per-site limits.
+
+A site's profile is its compliance_thresholds rows, or DEFAULT_THRESHOLDS
+if it has none. `site_compliance` streams the readings of a range in one
+ordered query into flat arrays and evaluates every parameter with numpy,
+so a year of 2-minute data is a single pass with no per-row objects.
+
+Each reading stands for the time until the next reading of the same device,
+capped at MAX_HOLD_SEC, so gaps in the data count as unobserved rather than
+compliant or exceeding.
+"""
+import math
+from array import array
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import SensorData, ComplianceThreshold
+from app.utils.time import to_utc, time_bucket, local_tz
+
+MAX_HOLD_SEC = 600
+RAW_CHUNK_ROWS = 10000
+
+
+@dataclass(frozen=True)
+class Limit:
+    min: float | None = None
+    max: float | None = None
+
+    def to_dict(self) -> dict:
+        return {"min": self.min, "max": self.max}
+
+
+DEFAULT_THRESHOLDS = {
+    "ph": Limit(6.0, 9.0),
+    "tss": Limit(None, 100.0),
+    "cod": Limit(None, 200.0),
+    "nh3n": Limit(None, 10.0),
+}
+
+
+async def load_profile(db: AsyncSession, site_id: int) -> tuple[dict[str, Limit], bool]:
+    """(param -> limit, is_default) for a site."""
+    res = await db.execute(
+        select(ComplianceThreshold.param, ComplianceThreshold.min_value, ComplianceThreshold.max_value)
+        .where(ComplianceThreshold.site_id == site_id)
+    )
+    rows = res.all()
+    if not rows:
+        return dict(DEFAULT_THRESHOLDS), True
+    return {param: Limit(lo, hi) for param, lo, hi in sorted(rows)}, False
+
+
+async def save_profile(db: AsyncSession, site_id: int, limits: dict[str, Limit] | None) -> None:
+    """Replace a site's thresholds; None reverts it to the defaults. Commits."""
+    await db.execute(delete(ComplianceThreshold).where(ComplianceThreshold.site_id == site_id))
+    for param, limit in (limits or {}).items():
+        db.add(ComplianceThreshold(site_id=site_id, param=param, min_value=limit.min, max_value=limit.max))
+    await db.commit()
+
+
+def evaluate(ts: np.ndarray, device: np.ndarray, values: np.ndarray, limit: Limit, end: float) -> dict:
+    """
+    Compliance of one parameter. `ts` are epoch seconds in ascending order,
+    `device` the device id of each reading (0 for none) and `values` the
+    readings, NaN where missing. `end` bounds how long the last reading of
+    each device stands.
+    """
+    keep = ~np.isnan(values)
+    ts, device, values = ts[keep], device[keep], values[keep]
+    n = int(values.size)
+    out = {
+        **limit.to_dict(), "readings": n, "exceedances": 0, "episodes": 0,
+        "exceedance_sec": 0.0, "observed_sec": 0.0,
+        "percent_compliant": None, "percent_time_compliant": None, "worst": None,
+    }
+    if n == 0:
+        return out
+
+    lo = -math.inf if limit.min is None else limit.min
+    hi = math.inf if limit.max is None else limit.max
+    excess = np.maximum(values - hi, lo - values)  # > 0 outside the limits
+    bad = excess > 0
+
+    # Per device, in time order: how long each reading stands, and where exceedance episodes start
+    order = np.lexsort((ts, device))
+    t, dev, bad_sorted = ts[order], device[order], bad[order]
+    first = np.ones(n, dtype=bool)
+    first[1:] = dev[1:] != dev[:-1]
+    last = np.ones(n, dtype=bool)
+    last[:-1] = first[1:]
+    nxt = np.empty(n)
+    nxt[:-1] = t[1:]
+    nxt[last] = end
+    hold = np.clip(nxt - t, 0, MAX_HOLD_SEC)
+    starts = bad_sorted & (first | ~np.roll(bad_sorted, 1))
+
+    k = int(bad.sum())
+    observed = float(hold.sum())
+    exceeding = float(hold[bad_sorted].sum())
+    out.update(
+        exceedances=k,
+        episodes=int(starts.sum()),
+        exceedance_sec=round(exceeding, 1),
+        observed_sec=round(observed, 1),
+        percent_compliant=round((n - k) / n * 100, 2),
+        percent_time_compliant=round((observed - exceeding) / observed * 100, 2) if observed else None,
+    )
+    if k:
+        i = int(np.argmax(excess))
+        v = float(values[i])
+        bound = hi if v > hi else lo
+        out["worst"] = {
+            "ts": datetime.fromtimestamp(float(ts[i]), local_tz).isoformat(),
+            "value": v,
+            "limit": bound,
+            "excess": round(float(excess[i]), 4),
+            "excess_pct": round(float(excess[i]) / abs(bound) * 100, 1) if bound else None,
+        }
+    return out
+
+
+async def site_compliance(
+    db: AsyncSession, site_id: int, date_from: datetime, date_to: datetime, limits: dict[str, Limit],
+) -> dict[str, dict]:
+    """evaluate() for every parameter of `limits` over [date_from, date_to), from one streamed query."""
+    params = list(limits)
+    date_from, date_to = to_utc(date_from), to_utc(date_to)
+    epoch, device = array("d"), array("d")
+    values = {p: array("d") for p in params}
+    nan = float("nan")
+    result = await db.stream(
+        select(
+            time_bucket(SensorData.ts, 1, 0), func.coalesce(SensorData.device_id, 0),
+            *(getattr(SensorData, p) for p in params),
+        )
+        .where(SensorData.site_id == site_id, SensorData.ts >= date_from, SensorData.ts < date_to)
+        .order_by(SensorData.ts)
+        .execution_options(yield_per=RAW_CHUNK_ROWS)
+    )
+    async for part in result.partitions():
+        for r in part:
+            epoch.append(r[0])
+            device.append(r[1])
+            for p, v in zip(params, r[2:]):
+                values[p].append(nan if v is None else v)
+
+    ts = np.frombuffer(epoch, dtype=np.float64)
+    dev = np.frombuffer(device, dtype=np.float64)
+    end = date_to.timestamp()
+    return {p: evaluate(ts, dev, np.frombuffer(values[p], dtype=np.float64), limits[p], end) for p in params}
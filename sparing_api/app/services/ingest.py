@@ -0,0 +1,200 @@
+"""
+Set-based ingest helpers shared by the ingest routers.
+
+All writes to sensor_data go through `insert_readings`, which issues one
+multi-row INSERT per call instead of one ORM flush per reading, followed by
+`apply_rollups` in the same transaction and `readings_committed` once the
+transaction has committed.
+"""
+from fastapi import HTTPException
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timezone
+
+from app.core.cache import cache, site_tag, history_tag
+from app.core.registry import site_registry
+from app.models.models import SensorData, SENSOR_FIELDS
+from app.services.ingest_stats import ingest_stats
+from app.services.rollups import apply_rollups
+from app.services.sketches import sketch_buffer
+from app.core.latest import latest_readings
+from app.services.live import publish_readings
+from app.services.quality import quality_monitor
+from app.schemas.data import IngestStateIn
+from app.utils.time import to_utc, grid
+
+
+def validate_ranges(data: IngestStateIn):
+    if data.ph is not None and not (0 <= data.ph <= 14):
+        raise HTTPException(400, "pH out of range")
+    if data.tss is not None and data.tss < 0:
+        raise HTTPException(400, "tss must be >= 0")
+    if data.debit is not None and data.debit < 0:
+        raise HTTPException(400, "debit must be >= 0")
+    if data.temp is not None and not (-40 <= data.temp <= 80):
+        raise HTTPException(400, "temp out of range")
+    if data.rh is not None and not (0 <= data.rh <= 100):
+        raise HTTPException(400, "rh out of range")
+    if data.wind_speed_kmh is not None and data.wind_speed_kmh < 0:
+        raise HTTPException(400, "wind_speed_kmh must be >= 0")
+    if data.noise is not None and data.noise < 0:
+        raise HTTPException(400, "noise must be >= 0")
+    if data.voltage is not None and not (0 <= data.voltage <= 1000):
+        raise HTTPException(400, "voltage out of range (0-1000V)")
+    if data.current is not None and not (0 <= data.current <= 1000):
+        raise HTTPException(400, "current out of range (0-1000A)")
+
+
+def blank_row(site_id: int, ts: datetime, source: str) -> dict:
+    """
+    A sensor_data insert row with every column present and all readings None.
+
+    Batched inserts need one key set for every row, whichever path built it.
+    """
+    row = {
+        "site_id": site_id,
+        "device_id": None,
+        "device_uid": None,
+        "ts": ts,
+        "payload": None,
+        "created_at": datetime.now(timezone.utc),
+        "ingest_source": source,
+        "ingest_idempotency_key": None,
+    }
+    for f in SENSOR_FIELDS:
+        row[f] = None
+    return row
+
+
+def reading_row(body: IngestStateIn, site_id: int, source: str = "api", idempotency_key: str | None = None) -> dict:
+    """Build a sensor_data insert row from a validated ingest body."""
+    row = blank_row(site_id, to_utc(body.ts), source)
+    row["device_id"] = body.device_id
+    row["payload"] = body.payload
+    row["ingest_idempotency_key"] = idempotency_key
+    for f in SENSOR_FIELDS:
+        row[f] = getattr(body, f)
+    return row
+
+
+async def insert_readings(db: AsyncSession, rows: list[dict]) -> list[int]:
+    """
+    Insert sensor_data rows in one statement and return their ids in input order.
+
+    Every row must carry the same keys. MySQL has no RETURNING, but InnoDB
+    assigns consecutive auto-increment values to a single multi-row INSERT
+    whose row count is known up front, so ids are derived from lastrowid.
+    That relies on the server settings listed under Architecture Notes in
+    the README: innodb_autoinc_lock_mode 1 or 2 and auto_increment_increment
+    = 1 (multi-primary clusters raise it and would break the derived ids).
+    """
+    if not rows:
+        return []
+    dialect = db.get_bind().dialect
+    if dialect.insert_returning:
+        res = await db.execute(
+            insert(SensorData).returning(SensorData.id, sort_by_parameter_order=True),
+            rows,
+        )
+        return list(res.scalars().all())
+    # A plain INSERT ... VALUES is a "simple insert": its ids are allocated as one consecutive block
+    res = await db.execute(insert(SensorData).values(rows))
+    first_id = res.lastrowid
+    return list(range(first_id, first_id + len(rows)))
+
+
+def readings_committed(rows: list[dict], ids: list[int]) -> None:
+    """Fan committed sensor_data rows out to the in-memory read models and drop the sites' cached results."""
+    if not rows:
+        return
+    sketch_buffer.add_rows(rows)
+    latest_readings.record(rows, ids)
+    quality_monitor.observe(rows)
+    publish_readings(rows, ids)
+    tags = {site_tag(r["site_id"]) for r in rows}
+    # Readings of hours already closed also change cached closed-hour aggregates
+    hour = grid(datetime.now(timezone.utc), 3600)
+    tags.update(history_tag(r["site_id"]) for r in rows if to_utc(r["ts"]) < hour)
+    cache.invalidate_soon(*tags)
+
+
+async def bulk_ingest(
+    db: AsyncSession,
+    items: list,
+    *,
+    principal,
+    _retry: bool = True,
+) -> list[dict]:
+    """
+    Ingest a batch of readings in one transaction.
+
+    Sites and idempotency keys are resolved with one IN query each, items are
+    validated in memory and accepted rows are written with a single INSERT.
+    `principal` is the caller's IngestPrincipal. Returns one result per item,
+    in order, shaped like /ingest/state responses: {"ok": True, "id": ...}
+    or {"ok": False, "error": ...}.
+    """
+    entries = await site_registry.resolve_many(db, {it.site_uid for it in items})
+    sites = {uid: e.id for uid, e in entries.items()}
+
+    keys = {it.idempotency_key for it in items if it.idempotency_key}
+    existing = {}
+    if keys:
+        existing = dict((await db.execute(
+            select(SensorData.ingest_idempotency_key, SensorData.id)
+            .where(SensorData.ingest_idempotency_key.in_(keys))
+        )).all())
+
+    results: list[dict | None] = [None] * len(items)
+    rows: list[dict] = []
+    row_slots: list[int] = []          # result index for each row
+    pending: dict[str, int] = {}       # idempotency key -> row index
+    duplicates: list[tuple[int, int]] = []  # (result index, row index)
+
+    for i, item in enumerate(items):
+        site_id = sites.get(item.site_uid)
+        if site_id is None:
+            results[i] = {"ok": False, "error": "Invalid site_uid"}
+            continue
+        if not principal.can_write(item.site_uid):
+            # viewers cannot POST; site-bound API keys only write their own site
+            results[i] = {"ok": False, "error": "Forbidden"}
+            continue
+        try:
+            validate_ranges(item)
+        except HTTPException as e:
+            results[i] = {"ok": False, "error": str(e.detail)}
+            continue
+        key = item.idempotency_key
+        if key:
+            if key in existing:
+                results[i] = {"ok": True, "id": existing[key]}
+                continue
+            if key in pending:
+                duplicates.append((i, pending[key]))
+                continue
+            pending[key] = len(rows)
+        row_slots.append(i)
+        rows.append(reading_row(item, site_id, idempotency_key=key))
+
+    try:
+        ids = await insert_readings(db, rows)
+        await apply_rollups(db, rows)
+        for slot, row_id in zip(row_slots, ids):
+            results[slot] = {"ok": True, "id": row_id}
+        for slot, row_idx in duplicates:
+            results[slot] = {"ok": True, "id": ids[row_idx]}
+
+        await db.commit()
+        readings_committed(rows, ids)
+    except IntegrityError:
+        # An idempotency key was written concurrently; the re-run sees it as existing.
+        await db.rollback()
+        if not _retry:
+            raise
+        return await bulk_ingest(db, items, principal=principal, _retry=False)
+
+    for item, r in zip(items, results):
+        ingest_stats.record("bulk", "ok" if r["ok"] else "error", sites.get(item.site_uid), r.get("error"))
+    return results
@@ -0,0 +1,182 @@
+"""
+Write-behind ingest queue.
+
+With INGEST_ASYNC enabled, ingest endpoints validate a reading, hand the
+insert rows to this queue and answer 202. A background writer drains the
+queue in batches (group commit): a flush starts once INGEST_FLUSH_ROWS rows
+are waiting or INGEST_FLUSH_INTERVAL_MS after the previous flush.
+
+Only connection-level failures put rows back in the queue to be retried.
+Any other database error is taken to be about the rows: the batch is
+written again one row at a time, and the rows the database still refuses
+are logged and dropped.
+"""
+import asyncio
+import time
+from collections import deque
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError
+
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.core.logging import logger
+from app.core.telemetry import (
+    INGEST_QUEUE_DEPTH, INGEST_QUEUE_REJECTED, INGEST_FLUSH_SECONDS, INGEST_FLUSHED_ROWS, INGEST_DROPPED_ROWS,
+)
+from app.models.models import SensorData
+from app.services.rollups import apply_rollups
+from app.services.ingest import insert_readings, readings_committed
+
+
+def _transient(exc: BaseException) -> bool:
+    """Whether `exc` is a lost or unavailable connection (worth retrying) rather than a bad row."""
+    if isinstance(exc, DBAPIError):
+        return exc.connection_invalidated or isinstance(exc, OperationalError)
+    return isinstance(exc, (OSError, asyncio.TimeoutError))
+
+
+class Unwritten(Exception):
+    """A transient failure part way through a batch; `items` were not committed."""
+
+    def __init__(self, items: list[tuple]):
+        super().__init__(f"{len(items)} rows not written")
+        self.items = items
+
+
+class IngestQueue:
+    """Bounded in-process queue of pending inserts with a batching writer."""
+
+    def __init__(self, maxsize: int, flush_rows: int, flush_interval: float):
+        self.maxsize = maxsize
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._items: deque = deque()  # (model, row)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def submit(self, rows: list[dict], model=SensorData) -> bool:
+        """Queue rows for insertion. Returns False (nothing queued) when full."""
+        if len(self._items) + len(rows) > self.maxsize:
+            INGEST_QUEUE_REJECTED.inc()
+            return False
+        self._items.extend((model, r) for r in rows)
+        INGEST_QUEUE_DEPTH.set(len(self._items))
+        if len(self._items) >= self.flush_rows:
+            self._wakeup.set()
+        return True
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the writer and flush whatever is still queued. Never raises, so shutdown continues."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Final ingest queue flush failed")
+        if self._items:
+            logger.error(f"Ingest queue stopped with {len(self._items)} unwritten rows")
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Ingest queue flush failed; retrying")
+                await asyncio.sleep(1)
+
+    async def flush(self) -> None:
+        while self._items:
+            n = min(self.flush_rows, len(self._items))
+            batch = [self._items.popleft() for _ in range(n)]
+            try:
+                await self._write(batch)
+            except Exception as e:
+                # Only connection failures get here. Put back what was not committed, in
+                # order; backpressure takes over if the DB stays down
+                unwritten = e.items if isinstance(e, Unwritten) else batch
+                self._items.extendleft(reversed(unwritten))
+                raise
+            finally:
+                INGEST_QUEUE_DEPTH.set(len(self._items))
+
+    async def _write(self, batch: list[tuple]) -> None:
+        grouped: dict = {}
+        for model, row in batch:
+            grouped.setdefault(model, []).append(row)
+        start = time.perf_counter()
+        async with SessionLocal() as db:
+            try:
+                ids = []
+                for model, rows in grouped.items():
+                    ids += await self._insert(db, model, rows)
+                await db.commit()
+            except Exception as e:
+                if _transient(e):
+                    raise
+                # One bad row (a duplicate idempotency key, a value the column
+                # refuses) poisons the whole batch; retry row by row
+                await db.rollback()
+                await self._write_each(db, batch)
+            else:
+                readings_committed(grouped.get(SensorData, []), ids)
+                for model, rows in grouped.items():
+                    INGEST_FLUSHED_ROWS.labels(model.__tablename__).inc(len(rows))
+        INGEST_FLUSH_SECONDS.observe(time.perf_counter() - start)
+
+    @staticmethod
+    async def _insert(db, model, rows: list[dict]) -> list[int]:
+        """Insert rows; for sensor_data also roll them up and return their ids."""
+        if model is not SensorData:
+            await db.execute(insert(model), rows)
+            return []
+        ids = await insert_readings(db, rows)
+        await apply_rollups(db, rows)
+        return ids
+
+    async def _write_each(self, db, batch: list[tuple]) -> None:
+        """Commit rows one by one, dropping those the database refuses."""
+        for i, (model, row) in enumerate(batch):
+            table = model.__tablename__
+            try:
+                ids = await self._insert(db, model, [row])
+                await db.commit()
+            except Exception as e:
+                try:
+                    await db.rollback()
+                except Exception:
+                    pass
+                if _transient(e):
+                    # Rows before this one are committed; only the rest go back
+                    raise Unwritten(batch[i:]) from e
+                reason = "duplicate" if isinstance(e, IntegrityError) else "invalid"
+                INGEST_DROPPED_ROWS.labels(table, reason).inc()
+                logger.warning(f"Ingest queue dropped {reason} row for {table}: {e!r}"[:500])
+                continue
+            if model is SensorData:
+                readings_committed([row], ids)
+            INGEST_FLUSHED_ROWS.labels(table).inc()
+
+
+ingest_queue = IngestQueue(
+    maxsize=settings.ingest_queue_max,
+    flush_rows=settings.ingest_flush_rows,
+    flush_interval=settings.ingest_flush_interval_ms / 1000,
+)
@@ -0,0 +1,166 @@
+"""
+Buffered ingest accounting.
+
+Ingest handlers call `ingest_stats.record(...)`, which only bumps an
+in-memory counter. A background task periodically upserts the counters into
+ingest_stats as per-minute aggregates keyed by (minute, source, status,
+site), keeping a few sample error messages per key.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, delete, func
+
+from app.core.config import settings
+from app.core.db import SessionLocal, upsert
+from app.core.logging import logger
+from app.models.models import IngestStat, Site
+
+MAX_SAMPLE_ERRORS = 3
+
+
+def _minute(now: datetime) -> datetime:
+    return now.replace(second=0, microsecond=0)
+
+
+class IngestAccounting:
+    def __init__(self, flush_interval: float, retention_days: int):
+        self.flush_interval = flush_interval
+        self.retention = timedelta(days=retention_days)
+        self._counts: dict[tuple, int] = {}
+        self._samples: dict[tuple, list[str]] = {}
+        self._task: asyncio.Task | None = None
+        self._last_purge: datetime | None = None
+
+    def record(self, source: str, status: str, site_id: int | None = None, error: str | None = None, n: int = 1) -> None:
+        """Count `n` ingest events. Never touches the database."""
+        if n <= 0:
+            return
+        key = (_minute(datetime.now(timezone.utc)), source, status, site_id or 0)
+        self._counts[key] = self._counts.get(key, 0) + n
+        if error:
+            samples = self._samples.setdefault(key, [])
+            if len(samples) < MAX_SAMPLE_ERRORS and error not in samples:
+                samples.append(error[:255])
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                await self._purge_old()
+            except Exception:
+                logger.exception("Ingest accounting flush failed")
+
+    async def flush(self) -> None:
+        if not self._counts:
+            return
+        counts, samples = self._counts, self._samples
+        self._counts, self._samples = {}, {}
+        rows = [
+            {
+                "bucket": bucket, "source": source, "status": status, "site_id": site_id,
+                "count": n, "sample_errors": samples.get((bucket, source, status, site_id)),
+            }
+            for (bucket, source, status, site_id), n in counts.items()
+        ]
+        try:
+            async with SessionLocal() as db:
+                await upsert(
+                    db, IngestStat, rows, ["bucket", "source", "status", "site_id"],
+                    lambda cur, new: {
+                        "count": cur.count + new.count,
+                        "sample_errors": func.coalesce(cur.sample_errors, new.sample_errors),
+                    },
+                )
+                await db.commit()
+        except Exception:
+            # Keep the counts for the next attempt
+            for key, n in counts.items():
+                self._counts[key] = self._counts.get(key, 0) + n
+            for key, msgs in samples.items():
+                self._samples.setdefault(key, msgs)
+            raise
+
+    async def _purge_old(self) -> None:
+        now = datetime.now(timezone.utc)
+        if self._last_purge and now - self._last_purge < timedelta(hours=1):
+            return
+        self._last_purge = now
+        async with SessionLocal() as db:
+            await db.execute(delete(IngestStat).where(IngestStat.bucket < now - self.retention))
+            await db.commit()
+
+
+ingest_stats = IngestAccounting(
+    flush_interval=settings.ingest_stats_flush_sec,
+    retention_days=settings.ingest_stats_retention_days,
+)
+
+
+async def site_ingest_summary(db, hours: int, site_id: int | None = None) -> list[dict]:
+    """Ingest rate and error rate per site over the last `hours`, from ingest_stats."""
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    stmt = (
+        select(IngestStat.site_id, IngestStat.source, IngestStat.status, func.sum(IngestStat.count))
+        .where(IngestStat.bucket >= since)
+        .group_by(IngestStat.site_id, IngestStat.source, IngestStat.status)
+    )
+    if site_id is not None:
+        stmt = stmt.where(IngestStat.site_id == site_id)
+    res = await db.execute(stmt)
+
+    per_site: dict[int, dict] = {}
+    for sid, source, status, n in res.all():
+        s = per_site.setdefault(sid, {"total": 0, "ok": 0, "error": 0, "sources": {}})
+        n = int(n or 0)
+        s["total"] += n
+        s[status] = s.get(status, 0) + n
+        s["sources"][source] = s["sources"].get(source, 0) + n
+
+    # Most recent sampled error messages per site
+    samples: dict[int, list[str]] = {}
+    stmt = (
+        select(IngestStat.site_id, IngestStat.sample_errors)
+        .where(IngestStat.bucket >= since, IngestStat.status == "error", IngestStat.sample_errors.isnot(None))
+        .order_by(IngestStat.bucket.desc())
+        .limit(200)
+    )
+    if site_id is not None:
+        stmt = stmt.where(IngestStat.site_id == site_id)
+    for sid, msgs in (await db.execute(stmt)).all():
+        bucket = samples.setdefault(sid, [])
+        for m in msgs or []:
+            if len(bucket) < 5 and m not in bucket:
+                bucket.append(m)
+
+    uids = dict((await db.execute(select(Site.id, Site.uid).where(Site.id.in_(list(per_site))))).all()) if per_site else {}
+    minutes = hours * 60
+    out = []
+    for sid, s in sorted(per_site.items(), key=lambda kv: -kv[1]["total"]):
+        out.append({
+            "site_id": sid or None,
+            "site_uid": uids.get(sid),
+            "total": s["total"],
+            "ok": s["ok"],
+            "error": s["error"],
+            "rate_per_min": round(s["total"] / minutes, 3),
+            "error_rate": round(s["error"] / s["total"], 4) if s["total"] else 0.0,
+            "sources": s["sources"],
+            "recent_errors": samples.get(sid, []),
+        })
+    return out
@@ -0,0 +1,44 @@
+"""
+Live reading events for /stream/sites/{uid}.
+
+`publish_readings` is called by `readings_committed` after every ingest
+commit. It publishes one Server-Sent Events frame per site in the batch,
+holding the newest reading, on the topic of that site, unless the site
+already has a newer one (a backfill or late batch); clients would
+otherwise show an old reading as the current one. The frame is
+encoded once here, so neither the broker nor the stream handlers
+re-serialize per client.
+"""
+import orjson
+
+from app.core.broker import broker
+from app.core.latest import READING_KEYS, latest_readings
+from app.core.registry import site_registry
+from app.utils.time import to_utc
+
+def site_topic(site_id: int) -> str:
+    return f"site:{site_id}"
+
+
+def reading_frame(row: dict) -> bytes:
+    """SSE `reading` event for a sensor_data row (id, ts, site and readings)."""
+    data = {k: row.get(k) for k in READING_KEYS}
+    data["ts"] = to_utc(row["ts"]).replace(tzinfo=None)  # naive UTC, as /data/last
+    entry = site_registry.by_id(row["site_id"])
+    data["site_uid"] = entry.uid if entry else None
+    return b"id: %d\nevent: reading\ndata: %s\n\n" % (row["id"] or 0, orjson.dumps(data))
+
+
+def publish_readings(rows: list[dict], ids: list[int]) -> None:
+    """Publish the newest of the committed rows of each site, if it is the site's latest reading."""
+    newest: dict[int, dict] = {}
+    for row, row_id in zip(rows, ids):
+        cur = newest.get(row["site_id"])
+        if cur is None or (row["ts"], row_id) > (cur["ts"], cur["id"]):
+            newest[row["site_id"]] = {**row, "id": row_id}
+    for site_id, row in newest.items():
+        # readings_committed() has already merged the batch into the latest-reading table
+        last = latest_readings.get(site_id)
+        if last and (to_utc(last["ts"]), last["id"] or 0) > (to_utc(row["ts"]), row["id"] or 0):
+            continue
+        broker.publish(site_topic(site_id), reading_frame(row))
@@ -0,0 +1,266 @@
+"""
+Streaming data-quality checks on ingested readings.
+
+`readings_committed` hands every committed batch to `quality_monitor`,
+which keeps O(1) state per (site, device, parameter) stream in flat arrays
+indexed by stream number. Streams are allocated in blocks of
+len(SENSOR_FIELDS) per (site, device), so a reading costs one dict lookup
+and a few float updates per parameter, and history is never queried:
+
+- spike: a value more than QUALITY_SPIKE_Z standard deviations from the
+  mean of the stream's last QUALITY_WINDOW values. The window is a ring
+  buffer with a running mean and sum of squares (Welford, with removal of
+  the value leaving it, recomputed exactly each time the ring wraps).
+- flatline: a full window without any variation, flagged once until the
+  value changes.
+- stale: no value for 5 EWMA reporting intervals, and at least
+  QUALITY_STALE_MIN_SEC. The background task checks all streams in one
+  vectorized pass and flags each once until it reports again.
+
+Readings older than a stream's newest one are left out. Flags are buffered
+and upserted into quality_flags every QUALITY_FLUSH_SEC. Each worker keeps
+state over the readings it ingests itself; before flagging a stream stale
+it checks the shared latest-reading table for values ingested elsewhere,
+and workers raising the same flag write the same row.
+"""
+import asyncio
+import math
+import time
+from array import array
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.db import SessionLocal, upsert
+from app.core.latest import latest_readings, SITE_LEVEL
+from app.core.logging import logger
+from app.core.telemetry import QUALITY_FLAGS, QUALITY_FLAGS_DROPPED
+from app.models.models import QualityFlag, SENSOR_FIELDS
+from app.utils.time import to_utc
+
+KINDS = ("spike", "flatline", "stale")
+MIN_SPIKE_WINDOW = 10      # values in the window before spikes are judged
+SPIKE_REL_FLOOR = 0.01     # std is taken as at least 1% of the mean ...
+SPIKE_ABS_FLOOR = 1e-6     # ... and at least this
+FLAT_REL_TOL = 1e-9
+STALE_INTERVALS = 5
+INTERVAL_ALPHA = 0.1       # EWMA weight of the newest reporting interval
+MAX_PENDING = 10000        # buffered flags; beyond this new ones are dropped
+
+FLAT, STALE = 1, 2         # state bits
+PARAMS = len(SENSOR_FIELDS)
+
+
+def _epoch(ts: datetime) -> float:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+class QualityMonitor:
+    def __init__(self, window: int, spike_z: float, stale_min_sec: float, flush_interval: float):
+        self.window = window
+        self.spike_z = spike_z
+        self.stale_min_sec = stale_min_sec
+        self.flush_interval = flush_interval
+        self._blocks: dict[tuple[int, int], int] = {}  # (site_id, device_id) -> first stream
+        self._keys: list[tuple[int, int]] = []          # block -> (site_id, device_id)
+        self._count = array("i")     # values in the window
+        self._pos = array("i")       # next ring position
+        self._mean = array("d")
+        self._m2 = array("d")
+        self._interval = array("d")  # EWMA seconds between values
+        self._last = array("d")      # epoch of the newest value, 0 = none yet
+        self._state = array("B")
+        self._ring = array("d")      # stream i owns [i * window, (i + 1) * window)
+        self._pending: list[dict] = []
+        self._task: asyncio.Task | None = None
+
+    # ---- ingest path ----
+
+    def observe(self, rows: list[dict]) -> None:
+        """Fold committed sensor_data insert rows in. Never touches the database."""
+        for r in rows:
+            key = (r["site_id"], r.get("device_id") or 0)
+            base = self._blocks.get(key)
+            if base is None:
+                base = self._add_block(key)
+            t = _epoch(r["ts"])
+            for j, f in enumerate(SENSOR_FIELDS):
+                v = r.get(f)
+                if v is not None:
+                    self._update(base + j, float(v), t, r)
+
+    def _add_block(self, key: tuple[int, int]) -> int:
+        base = len(self._mean)
+        self._blocks[key] = base
+        self._keys.append(key)
+        for arr in (self._count, self._pos, self._state):
+            arr.extend([0] * PARAMS)
+        for arr in (self._mean, self._m2, self._interval, self._last):
+            arr.extend([0.0] * PARAMS)
+        self._ring.extend([0.0] * (PARAMS * self.window))
+        return base
+
+    def _update(self, i: int, v: float, t: float, row: dict) -> None:
+        last = self._last[i]
+        if t < last:
+            return
+        if last:
+            dt = t - last
+            iv = self._interval[i]
+            self._interval[i] = dt if not iv else iv + INTERVAL_ALPHA * (dt - iv)
+        self._last[i] = t
+        state = self._state[i] & ~STALE
+
+        w = self.window
+        n, mean, m2 = self._count[i], self._mean[i], self._m2[i]
+        if n >= MIN_SPIKE_WINDOW:
+            std = math.sqrt(m2 / (n - 1))
+            scale = max(std, SPIKE_REL_FLOOR * abs(mean), SPIKE_ABS_FLOOR)
+            dev = abs(v - mean)
+            if dev > self.spike_z * scale:
+                self._flag(i, "spike", row["ts"], v, {"mean": round(mean, 6), "std": round(std, 6), "z": round(dev / scale, 1)})
+
+        pos = self._pos[i]
+        off = i * w + pos
+        if n == w:
+            old = self._ring[off]
+            n -= 1
+            d = old - mean
+            mean -= d / n
+            m2 -= d * (old - mean)
+        self._ring[off] = v
+        n += 1
+        d = v - mean
+        mean += d / n
+        m2 += d * (v - mean)
+        pos = (pos + 1) % w
+        if pos == 0:
+            # Drop accumulated rounding error once per lap
+            vals = self._ring[i * w:(i + 1) * w]
+            mean = math.fsum(vals) / w
+            m2 = math.fsum((x - mean) ** 2 for x in vals)
+        m2 = max(m2, 0.0)
+        self._count[i], self._pos[i], self._mean[i], self._m2[i] = n, pos, mean, m2
+
+        tol = FLAT_REL_TOL * max(1.0, abs(mean))
+        if n == w and m2 <= n * tol * tol:
+            if not state & FLAT:
+                self._flag(i, "flatline", row["ts"], v, {"readings": w})
+            state |= FLAT
+        else:
+            state &= ~FLAT
+        self._state[i] = state
+
+    def _flag(self, i: int, kind: str, ts: datetime, value: float | None, detail: dict) -> None:
+        QUALITY_FLAGS.labels(kind).inc()
+        if len(self._pending) >= MAX_PENDING:
+            QUALITY_FLAGS_DROPPED.inc()
+            return
+        site_id, device_id = self._keys[i // PARAMS]
+        self._pending.append({
+            "site_id": site_id, "device_id": device_id, "param": SENSOR_FIELDS[i % PARAMS],
+            "kind": kind, "ts": to_utc(ts), "value": value, "detail": detail,
+            "created_at": datetime.now(timezone.utc),
+        })
+
+    # ---- stale check ----
+
+    def check_stale(self, now: float | None = None) -> int:
+        """Flag streams that stopped reporting; returns how many were flagged."""
+        if not self._keys:
+            return 0
+        now = time.time() if now is None else now
+        last = np.frombuffer(self._last, dtype=np.float64)
+        interval = np.frombuffer(self._interval, dtype=np.float64)
+        state = np.frombuffer(self._state, dtype=np.uint8)
+        threshold = np.maximum(STALE_INTERVALS * interval, self.stale_min_sec)
+        due = np.flatnonzero((last > 0) & (state & STALE == 0) & (now - last > threshold)).tolist()
+        del last, interval, state  # release the buffers so the arrays can grow again
+
+        flagged = 0
+        for i in due:
+            site_id, device_id = self._keys[i // PARAMS]
+            param = SENSOR_FIELDS[i % PARAMS]
+            # Another worker may have ingested newer values of this stream
+            row = latest_readings.get(site_id, device_id or SITE_LEVEL)
+            if row and row.get(param) is not None:
+                self._last[i] = max(self._last[i], _epoch(row["ts"]))
+                if now - self._last[i] <= max(STALE_INTERVALS * self._interval[i], self.stale_min_sec):
+                    continue
+            self._state[i] |= STALE
+            last_ts = datetime.fromtimestamp(self._last[i], timezone.utc)
+            self._flag(i, "stale", last_ts, None, {"silent_sec": round(now - self._last[i]), "interval_sec": round(self._interval[i], 1)})
+            flagged += 1
+        return flagged
+
+    # ---- background flush ----
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.check_stale()
+                await self.flush()
+            except Exception:
+                logger.exception("Quality flag flush failed")
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            async with SessionLocal() as db:
+                await upsert(
+                    db, QualityFlag, pending, ["site_id", "ts", "device_id", "param", "kind"],
+                    lambda cur, new: {"value": new.value},
+                )
+                await db.commit()
+        except Exception:
+            # Keep the flags for the next attempt
+            self._pending[:0] = pending[:MAX_PENDING - len(self._pending)]
+            raise
+
+
+quality_monitor = QualityMonitor(
+    window=settings.quality_window,
+    spike_z=settings.quality_spike_z,
+    stale_min_sec=settings.quality_stale_min_sec,
+    flush_interval=settings.quality_flush_sec,
+)
+
+
+async def site_flags(
+    db: AsyncSession, site_id: int, date_from: datetime, date_to: datetime,
+    kind: str | None = None, param: str | None = None, limit: int = 500,
+) -> list[QualityFlag]:
+    """A site's flags in [date_from, date_to), newest first."""
+    stmt = (
+        select(QualityFlag)
+        .where(QualityFlag.site_id == site_id, QualityFlag.ts >= to_utc(date_from), QualityFlag.ts < to_utc(date_to))
+        .order_by(QualityFlag.ts.desc(), QualityFlag.id.desc())
+        .limit(limit)
+    )
+    if kind:
+        stmt = stmt.where(QualityFlag.kind == kind)
+    if param:
+        stmt = stmt.where(QualityFlag.param == param)
+    return list((await db.execute(stmt)).scalars().all())
@@ -0,0 +1,111 @@
+"""
+Site metrics over a range, assembled from cached partial aggregates.
+
+A range [date_from, date_to] is split at the end of its last closed local
+hour, min(date_to, now) rounded down to the hour:
+
+- the closed head [date_from, split) is a Partial (rollup aggregates and a
+  t-digest per parameter) cached for CACHE_TTL_CLOSED under the site's
+  history tag. On a miss, the head ending one hour earlier is looked up
+  and extended by that hour, so a range that moves forward with the clock
+  (the default "today") costs one hour of rollups and raw rows per hour
+  instead of a scan from date_from.
+- the open tail [split, date_to] is computed on every call; it holds at
+  most an hour of readings.
+
+Heads are keyed by the site's history version, which ingest bumps in the
+shared latest-reading table for readings older than the current hour, so
+every worker stops using a head as soon as such a reading commits. Ingest
+and the sketch flush (for sketches of past days) also invalidate the
+history tag.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import cache, cache_key, history_tag, CACHE_TTL_CLOSED
+from app.core.db import SessionLocal
+from app.core.latest import latest_readings
+from app.services.rollups import Agg, range_aggregates
+from app.services.sketches import TDigest, range_digests
+from app.utils.time import to_utc, grid
+
+HOUR = 3600
+
+
+@dataclass
+class Partial:
+    aggs: dict[str, Agg]           # per field, plus ROWS_PARAM
+    digests: dict[str, TDigest]    # per field
+
+    def merge(self, other: "Partial") -> None:
+        for f, a in other.aggs.items():
+            self.aggs.setdefault(f, Agg()).merge(a)
+        for f, d in other.digests.items():
+            self.digests.setdefault(f, TDigest()).merge(d)
+
+    def to_dict(self) -> dict:
+        return {
+            "aggs": {f: [a.count, a.sum, a.min, a.max, a.sumsq] for f, a in self.aggs.items()},
+            "digests": {f: d.to_dict() for f, d in self.digests.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Partial":
+        return cls(
+            {f: Agg(*v) for f, v in d["aggs"].items()},
+            {f: TDigest.from_dict(v) for f, v in d["digests"].items()},
+        )
+
+
+async def range_partial(
+    db: AsyncSession, site_id: int, date_from: datetime, date_to: datetime,
+    fields: list[str], inclusive_end: bool = False,
+) -> Partial:
+    """Partial of a range, from rollups and sketches for whole hours/days and raw rows for the rest."""
+    return Partial(
+        await range_aggregates(db, site_id, date_from, date_to, fields, inclusive_end),
+        await range_digests(db, site_id, date_from, date_to, fields, inclusive_end),
+    )
+
+
+def closed_until(date_to: datetime, now: datetime) -> datetime:
+    """End of the last local hour before `date_to` that has closed by `now`."""
+    return grid(min(to_utc(date_to), to_utc(now)), HOUR)
+
+
+async def closed_partial(site_id: int, date_from: datetime, split: datetime, fields: list[str]) -> Partial:
+    """Partial of [date_from, split) for a split on the hour grid, cached."""
+    date_from = to_utc(date_from)
+    history = latest_readings.history_version(site_id)
+
+    def key(end: datetime) -> str:
+        return cache_key("metrics_closed", site_id, history, date_from.isoformat(), end.isoformat(), ",".join(fields))
+
+    async def compute() -> dict:
+        prev_to = split - timedelta(seconds=HOUR)
+        prev = await cache.get(key(prev_to)) if prev_to > date_from else None
+        async with SessionLocal() as db:
+            if prev is None:
+                return (await range_partial(db, site_id, date_from, split, fields)).to_dict()
+            partial = Partial.from_dict(prev)
+            partial.merge(await range_partial(db, site_id, prev_to, split, fields))
+        return partial.to_dict()
+
+    value = await cache.get_or_compute(key(split), compute, CACHE_TTL_CLOSED, tags=(history_tag(site_id),))
+    return Partial.from_dict(value)
+
+
+async def site_range_partial(
+    site_id: int, date_from: datetime, date_to: datetime, fields: list[str], now: datetime | None = None,
+) -> Partial:
+    """Partial of [date_from, date_to], end inclusive: the cached closed head merged with the open tail."""
+    split = closed_until(date_to, now or datetime.now(timezone.utc))
+    if split <= to_utc(date_from):
+        async with SessionLocal() as db:
+            return await range_partial(db, site_id, date_from, date_to, fields, inclusive_end=True)
+    partial = await closed_partial(site_id, date_from, split, fields)
+    async with SessionLocal() as db:
+        partial.merge(await range_partial(db, site_id, split, date_to, fields, inclusive_end=True))
+    return partial
@@ -0,0 +1,299 @@
+"""
+Hourly and daily rollups of sensor_data.
+
+Every ingest path calls `apply_rollups(db, rows)` with the rows it inserts,
+inside the same transaction. The rows are folded in memory into one delta
+per (site, granularity, parameter, bucket, device) and upserted into
+sensor_rollups, so late or out-of-order readings simply land in their own
+bucket. Readers split a range into whole days, whole hours and raw edges
+(`range_aggregates`), so a one-year query reads ~365 rollup rows per
+parameter plus at most two partial hours of raw data.
+
+There are no minute rollups: at the usual 2-minute logging interval they
+would hold more rows than sensor_data itself.
+
+`rebuild()` recomputes rollups and percentile sketches from sensor_data
+(backfill after deploying, or repair); see rebuild_rollups.py.
+"""
+import math
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, delete, func, and_, or_, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import cache, site_tag, history_tag
+from app.core.config import settings
+from app.core.db import SessionLocal, upsert, greatest, least
+from app.core.latest import latest_readings
+from app.core.logging import logger
+from app.models.models import Site, SensorData, SensorRollup, SENSOR_FIELDS
+from app.services.sketches import rebuild_sketches
+from app.utils.time import to_utc, utc_offset_seconds, time_bucket, grid
+
+GRANULARITIES = {"1h": 3600, "1d": 86400}
+ROWS_PARAM = "_rows"
+REBUILD_CHUNK = timedelta(days=7)
+INSERT_CHUNK = 1000
+
+
+@dataclass
+class Agg:
+    count: int = 0
+    sum: float = 0.0
+    min: float | None = None
+    max: float | None = None
+    sumsq: float = 0.0
+
+    def add(self, v: float) -> None:
+        self.count += 1
+        self.sum += v
+        self.sumsq += v * v
+        self.min = v if self.min is None or v < self.min else self.min
+        self.max = v if self.max is None or v > self.max else self.max
+
+    def merge(self, o: "Agg") -> None:
+        if not o.count:
+            return
+        self.count += o.count
+        self.sum += o.sum
+        self.sumsq += o.sumsq
+        self.min = o.min if self.min is None or (o.min is not None and o.min < self.min) else self.min
+        self.max = o.max if self.max is None or (o.max is not None and o.max > self.max) else self.max
+
+    @property
+    def avg(self) -> float | None:
+        return self.sum / self.count if self.count else None
+
+    @property
+    def std(self) -> float | None:
+        if not self.count:
+            return None
+        mean = self.sum / self.count
+        return math.sqrt(max(self.sumsq / self.count - mean * mean, 0.0))
+
+
+# ---- write path ----
+
+def rollup_deltas(rows: list[dict]) -> list[dict]:
+    """Fold sensor_data insert rows into sensor_rollups upsert rows, in key order."""
+    acc: dict[tuple, Agg] = {}
+    for r in rows:
+        ts = to_utc(r["ts"])
+        device_id = r.get("device_id") or 0
+        for gran, step in GRANULARITIES.items():
+            bucket = grid(ts, step)
+            base = (r["site_id"], gran)
+            acc.setdefault((*base, ROWS_PARAM, bucket, device_id), Agg()).count += 1
+            for f in SENSOR_FIELDS:
+                v = r.get(f)
+                if v is not None:
+                    acc.setdefault((*base, f, bucket, device_id), Agg()).add(float(v))
+    # A stable key order keeps concurrent upserts from deadlocking on MySQL
+    return [
+        {
+            "site_id": k[0], "granularity": k[1], "param": k[2], "bucket": k[3], "device_id": k[4],
+            "count": a.count, "sum": a.sum, "min": a.min, "max": a.max, "sumsq": a.sumsq,
+        }
+        for k, a in sorted(acc.items(), key=lambda kv: (kv[0][0], kv[0][1], kv[0][2], kv[0][3], kv[0][4]))
+    ]
+
+
+async def apply_rollups(db: AsyncSession, rows: list[dict]) -> None:
+    """Add inserted sensor_data rows to the rollups. Call before the commit."""
+    deltas = rollup_deltas(rows)
+    for i in range(0, len(deltas), INSERT_CHUNK):
+        await upsert(
+            db, SensorRollup, deltas[i:i + INSERT_CHUNK],
+            ["site_id", "granularity", "param", "bucket", "device_id"],
+            lambda cur, new: {
+                "count": cur.count + new.count,
+                "sum": cur.sum + new.sum,
+                "min": least(cur.min, new.min),
+                "max": greatest(cur.max, new.max),
+                "sumsq": cur.sumsq + new.sumsq,
+            },
+        )
+
+
+# ---- read path ----
+
+def _raw_aggs(fields: list[str]) -> list:
+    cols = [func.count(SensorData.id)]
+    for f in fields:
+        c = getattr(SensorData, f)
+        cols += [func.count(c), func.sum(c), func.min(c), func.max(c), func.sum(c * c)]
+    return cols
+
+
+def _unpack(values, fields: list[str]) -> dict[str, Agg]:
+    out = {ROWS_PARAM: Agg(count=int(values[0] or 0))}
+    for i, f in enumerate(fields):
+        n, s, mn, mx, sq = values[1 + 5 * i: 6 + 5 * i]
+        out[f] = Agg(int(n or 0), float(s or 0), mn, mx, float(sq or 0))
+    return out
+
+
+def split_range(date_from: datetime, date_to: datetime):
+    """
+    Split [date_from, date_to) into raw edges, whole local hours and whole
+    local days: (raw, hours, days), each a list of (lo, hi) pairs.
+    """
+    h0, h1 = grid(date_from, 3600, up=True), grid(date_to, 3600)
+    if not settings.rollup_reads or h0 >= h1:
+        return [(date_from, date_to)], [], []
+    raw = [(date_from, h0), (h1, date_to)]
+    d0, d1 = grid(h0, 86400, up=True), grid(h1, 86400)
+    if d0 < d1:
+        return raw, [(h0, d0), (d1, h1)], [(d0, d1)]
+    return raw, [(h0, h1)], []
+
+
+async def range_aggregates(
+    db: AsyncSession, site_id: int, date_from: datetime, date_to: datetime,
+    fields: list[str], inclusive_end: bool = False,
+) -> dict[str, Agg]:
+    """
+    Aggregates of `fields` (plus ROWS_PARAM) for a site over a time range,
+    read from rollups for whole hours/days and from sensor_data for the rest.
+    """
+    return (await sites_aggregates(db, [site_id], date_from, date_to, fields, inclusive_end))[site_id]
+
+
+async def sites_aggregates(
+    db: AsyncSession, site_ids: list[int], date_from: datetime, date_to: datetime,
+    fields: list[str], inclusive_end: bool = False,
+) -> dict[int, dict[str, Agg]]:
+    """range_aggregates() for several sites at once: one raw and one rollup query, grouped by site."""
+    date_from, date_to = to_utc(date_from), to_utc(date_to)
+    raw, hours, days = split_range(date_from, date_to)
+    out = {s: {f: Agg() for f in (ROWS_PARAM, *fields)} for s in site_ids}
+    if not site_ids:
+        return out
+
+    conds = []
+    for lo, hi in raw:
+        end = SensorData.ts <= hi if inclusive_end and hi == date_to else SensorData.ts < hi
+        conds.append(and_(SensorData.ts >= lo, end))
+    res = await db.execute(
+        select(SensorData.site_id, *_raw_aggs(fields))
+        .where(SensorData.site_id.in_(site_ids), or_(*conds))
+        .group_by(SensorData.site_id)
+    )
+    for site_id, *values in res.all():
+        for f, a in _unpack(values, fields).items():
+            out[site_id][f].merge(a)
+
+    spans = [(g, lo, hi) for g, ranges in (("1h", hours), ("1d", days)) for lo, hi in ranges if lo < hi]
+    if spans:
+        res = await db.execute(
+            select(
+                SensorRollup.site_id, SensorRollup.param,
+                func.sum(SensorRollup.count), func.sum(SensorRollup.sum),
+                func.min(SensorRollup.min), func.max(SensorRollup.max), func.sum(SensorRollup.sumsq),
+            )
+            .where(
+                SensorRollup.site_id.in_(site_ids),
+                SensorRollup.param.in_([ROWS_PARAM, *fields]),
+                or_(*(
+                    and_(SensorRollup.granularity == g, SensorRollup.bucket >= lo, SensorRollup.bucket < hi)
+                    for g, lo, hi in spans
+                )),
+            )
+            .group_by(SensorRollup.site_id, SensorRollup.param)
+        )
+        for site_id, param, n, s, mn, mx, sq in res.all():
+            out[site_id][param].merge(Agg(int(n or 0), float(s or 0), mn, mx, float(sq or 0)))
+    return out
+
+
+async def rollup_buckets(
+    db: AsyncSession, site_id: int, granularity: str, lo: datetime, hi: datetime, fields: list[str],
+) -> dict[datetime, dict[str, Agg]]:
+    """Per-bucket aggregates summed over devices, for whole buckets in [lo, hi)."""
+    res = await db.execute(
+        select(
+            SensorRollup.bucket, SensorRollup.param, func.sum(SensorRollup.count), func.sum(SensorRollup.sum),
+            func.min(SensorRollup.min), func.max(SensorRollup.max), func.sum(SensorRollup.sumsq),
+        )
+        .where(
+            SensorRollup.site_id == site_id,
+            SensorRollup.granularity == granularity,
+            SensorRollup.param.in_([ROWS_PARAM, *fields]),
+            SensorRollup.bucket >= lo, SensorRollup.bucket < hi,
+        )
+        .group_by(SensorRollup.bucket, SensorRollup.param)
+    )
+    out: dict[datetime, dict[str, Agg]] = {}
+    for bucket, param, n, s, mn, mx, sq in res.all():
+        out.setdefault(to_utc(bucket), {})[param] = Agg(int(n or 0), float(s or 0), mn, mx, float(sq or 0))
+    return out
+
+
+# ---- backfill ----
+
+async def _rebuild_chunk(db: AsyncSession, site_id: int, lo: datetime, hi: datetime) -> int:
+    await db.execute(
+        delete(SensorRollup)
+        .where(SensorRollup.site_id == site_id, SensorRollup.bucket >= lo, SensorRollup.bucket < hi)
+    )
+    rows = []
+    for gran, step in GRANULARITIES.items():
+        offset = utc_offset_seconds(lo)
+        bucket = time_bucket(SensorData.ts, step, offset).label("bucket")
+        device = func.coalesce(SensorData.device_id, 0).label("device")
+        res = await db.execute(
+            select(bucket, device, *_raw_aggs(list(SENSOR_FIELDS)))
+            .where(SensorData.site_id == site_id, SensorData.ts >= lo, SensorData.ts < hi)
+            .group_by(bucket, device)
+        )
+        for r in res.all():
+            start = datetime.fromtimestamp(r[0] * step - offset, timezone.utc)
+            for param, a in _unpack(r[2:], list(SENSOR_FIELDS)).items():
+                if a.count:
+                    rows.append({
+                        "site_id": site_id, "granularity": gran, "param": param, "bucket": start,
+                        "device_id": r[1], "count": a.count, "sum": a.sum,
+                        "min": a.min, "max": a.max, "sumsq": a.sumsq,
+                    })
+    for i in range(0, len(rows), INSERT_CHUNK):
+        await db.execute(insert(SensorRollup), rows[i:i + INSERT_CHUNK])
+    await db.commit()
+    return len(rows)
+
+
+async def rebuild(site_uid: str | None = None, date_from: datetime | None = None, date_to: datetime | None = None) -> int:
+    """
+    Recompute rollups and sketches from sensor_data, REBUILD_CHUNK at a time per site.
+
+    The range is widened to whole local days. Readings ingested into the
+    range while it is being rebuilt may be counted twice, so backfill
+    closed ranges or run it before enabling ingest.
+    """
+    written = 0
+    async with SessionLocal() as db:
+        stmt = select(Site.id, Site.uid)
+        if site_uid:
+            stmt = stmt.where(Site.uid == site_uid)
+        sites = (await db.execute(stmt)).all()
+        for site_id, uid in sites:
+            lo, hi = date_from, date_to
+            if lo is None or hi is None:
+                first, last = (await db.execute(
+                    select(func.min(SensorData.ts), func.max(SensorData.ts)).where(SensorData.site_id == site_id)
+                )).one()
+                if first is None:
+                    continue
+                lo = lo or first
+                hi = hi or last + timedelta(seconds=1)
+            lo, hi = grid(lo, 86400), grid(hi, 86400, up=True)
+            while lo < hi:
+                end = min(lo + REBUILD_CHUNK, hi)
+                written += await _rebuild_chunk(db, site_id, lo, end)
+                written += await rebuild_sketches(db, site_id, lo, end)
+                lo = end
+            # New versions retire ETags and version-keyed entries the tags cannot reach
+            latest_readings.bump_site(site_id)
+            await cache.invalidate(site_tag(site_id), history_tag(site_id))
+            logger.info(f"Rebuilt rollups for site {uid}")
+    return written
@@ -0,0 +1,330 @@
+"""
+Mergeable percentile sketches (t-digest) per site, local day and parameter.
+
+Ingest paths hand committed rows to `sketch_buffer`, which folds them into
+in-memory digests. A background task merges those into sensor_sketches
+every SKETCH_FLUSH_SEC (read, merge, write under a row lock), so a
+reading is reflected in stored sketches within that bound, and the sites'
+cached results are invalidated then; unflushed digests are lost if a
+worker dies, and rebuild_rollups.py recomputes them.
+
+`range_quantiles` answers p50/p95/p99 over a range by merging the stored
+sketches of the whole days in it with digests built from the raw readings
+of the partial days at either end.
+"""
+import asyncio
+import math
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import select, delete, and_, or_, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import cache, site_tag, history_tag
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.core.logging import logger
+from app.models.models import SensorData, SensorSketch, SENSOR_FIELDS
+from app.utils.time import to_utc, grid
+
+DAY = 86400
+COMPRESSION = 200  # ~100 centroids; p99 within ~0.3% on skewed data
+QUANTILES = {"p50": 0.50, "p95": 0.95, "p99": 0.99}
+
+
+class TDigest:
+    """
+    Merging t-digest (Dunning & Ertl) with the arcsine scale function.
+
+    Values are buffered and compressed in batches; centroids are kept as
+    parallel mean/weight arrays. Two digests merge by compressing the union
+    of their centroids, so the result does not depend on merge order beyond
+    the usual t-digest error bounds.
+    """
+
+    def __init__(self, compression: float = COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = math.inf
+        self.max = -math.inf
+        self._buf: list[float] = []
+
+    @property
+    def count(self) -> float:
+        self._flush()
+        return float(self.weights.sum())
+
+    def add(self, v: float) -> None:
+        self._buf.append(v)
+        if len(self._buf) >= 10 * self.compression:
+            self._flush()
+
+    def add_many(self, values) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        if values.size:
+            self._compress(values, np.ones(values.size))
+
+    def merge(self, other: "TDigest") -> None:
+        other._flush()
+        if other.weights.size:
+            self._compress(other.means, other.weights)
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+
+    def _flush(self) -> None:
+        if self._buf:
+            buf, self._buf = np.array(self._buf), []
+            self._compress(buf, np.ones(buf.size))
+
+    def _k(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _k_inv(self, k):
+        return (math.sin(min(k * 2 * math.pi / self.compression, math.pi / 2)) + 1) / 2
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray) -> None:
+        self.min = min(self.min, float(means.min()))
+        self.max = max(self.max, float(means.max()))
+        m = np.concatenate([self.means, means])
+        w = np.concatenate([self.weights, weights])
+        order = np.argsort(m, kind="mergesort")
+        m, w = m[order], w[order]
+        total = w.sum()
+
+        out_m, out_w = [], []
+        cur_m, cur_w = m[0], w[0]
+        q0 = 0.0
+        q_limit = self._k_inv(self._k(q0) + 1)
+        for mi, wi in zip(m[1:], w[1:]):
+            if q0 + (cur_w + wi) / total <= q_limit:
+                cur_m += (mi - cur_m) * wi / (cur_w + wi)
+                cur_w += wi
+            else:
+                out_m.append(cur_m)
+                out_w.append(cur_w)
+                q0 += cur_w / total
+                q_limit = self._k_inv(self._k(q0) + 1)
+                cur_m, cur_w = mi, wi
+        out_m.append(cur_m)
+        out_w.append(cur_w)
+        self.means, self.weights = np.array(out_m), np.array(out_w)
+
+    def quantile(self, q: float) -> float | None:
+        self._flush()
+        n = self.weights.size
+        if n == 0:
+            return None
+        if n == 1:
+            return float(self.means[0])
+        total = self.weights.sum()
+        target = q * total
+        centers = np.cumsum(self.weights) - self.weights / 2
+        if target <= centers[0]:
+            # Between the minimum and the first centroid
+            frac = target / centers[0] if centers[0] else 0.0
+            return float(self.min + (self.means[0] - self.min) * frac)
+        if target >= centers[-1]:
+            tail = total - centers[-1]
+            frac = (target - centers[-1]) / tail if tail else 0.0
+            return float(self.means[-1] + (self.max - self.means[-1]) * frac)
+        return float(np.interp(target, centers, self.means))
+
+    def to_dict(self) -> dict:
+        self._flush()
+        return {
+            "c": [[round(float(m), 6), float(w)] for m, w in zip(self.means, self.weights)],
+            "min": self.min, "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict, compression: float = COMPRESSION) -> "TDigest":
+        t = cls(compression)
+        if d and d.get("c"):
+            c = np.array(d["c"], dtype=np.float64)
+            t.means, t.weights = c[:, 0], c[:, 1]
+            t.min, t.max = d["min"], d["max"]
+        return t
+
+
+class SketchBuffer:
+    """In-memory digests of committed readings, merged into sensor_sketches periodically."""
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._digests: dict[tuple, TDigest] = {}  # (site_id, day, param) -> digest
+        self._task: asyncio.Task | None = None
+
+    def add_rows(self, rows: list[dict]) -> None:
+        """Fold committed sensor_data insert rows in. Never touches the database."""
+        for r in rows:
+            day = grid(r["ts"], DAY)
+            for f in SENSOR_FIELDS:
+                v = r.get(f)
+                if v is not None:
+                    key = (r["site_id"], day, f)
+                    d = self._digests.get(key)
+                    if d is None:
+                        d = self._digests[key] = TDigest()
+                    d.add(float(v))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Sketch flush failed")
+
+    async def flush(self) -> None:
+        if not self._digests:
+            return
+        pending, self._digests = self._digests, {}
+        try:
+            async with SessionLocal() as db:
+                try:
+                    await merge_sketches(db, pending)
+                except IntegrityError:
+                    # Another worker inserted one of the rows first; now it merges
+                    await db.rollback()
+                    await merge_sketches(db, pending)
+            # Results over whole days read these sketches; closed-hour ones only those of past days
+            now = datetime.now(timezone.utc)
+            tags = {site_tag(site_id) for site_id, _, _ in pending}
+            tags.update(history_tag(site_id) for site_id, day, _ in pending if day + timedelta(days=1) <= now)
+            cache.invalidate_soon(*tags)
+        except Exception:
+            # Keep the digests for the next attempt
+            for key, d in pending.items():
+                cur = self._digests.get(key)
+                if cur is None:
+                    self._digests[key] = d
+                else:
+                    cur.merge(d)
+            raise
+
+
+async def merge_sketches(db: AsyncSession, digests: dict[tuple, TDigest]) -> None:
+    """Merge (site_id, day, param) -> digest into sensor_sketches and commit."""
+    keys = list(digests)
+    existing = {}
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        res = await db.execute(
+            select(SensorSketch)
+            .where(tuple_(SensorSketch.site_id, SensorSketch.day, SensorSketch.param).in_(chunk))
+            .with_for_update()
+        )
+        for s in res.scalars().all():
+            existing[(s.site_id, to_utc(s.day), s.param)] = s
+    for key, d in digests.items():
+        row = existing.get(key)
+        if row is None:
+            db.add(SensorSketch(site_id=key[0], day=key[1], param=key[2], count=int(d.count), digest=d.to_dict()))
+            continue
+        merged = TDigest.from_dict(row.digest)
+        merged.merge(d)
+        row.count = int(merged.count)
+        row.digest = merged.to_dict()
+    await db.commit()
+
+
+sketch_buffer = SketchBuffer(flush_interval=settings.sketch_flush_sec)
+
+
+def quantiles(digests: dict[str, TDigest]) -> dict[str, dict[str, float | None]]:
+    """p50/p95/p99 of each digest."""
+    return {f: {name: d.quantile(q) for name, q in QUANTILES.items()} for f, d in digests.items()}
+
+
+async def range_quantiles(
+    db: AsyncSession, site_id: int, date_from: datetime, date_to: datetime,
+    fields: list[str], inclusive_end: bool = False,
+) -> dict[str, dict[str, float | None]]:
+    """p50/p95/p99 per field over a range: stored sketches for whole local days, raw rows for the rest."""
+    return quantiles(await range_digests(db, site_id, date_from, date_to, fields, inclusive_end))
+
+
+async def range_digests(
+    db: AsyncSession, site_id: int, date_from: datetime, date_to: datetime,
+    fields: list[str], inclusive_end: bool = False,
+) -> dict[str, TDigest]:
+    """One digest per field over a range, for range_quantiles() or to merge with others."""
+    if not fields:
+        return {}
+    date_from, date_to = to_utc(date_from), to_utc(date_to)
+    digests = {f: TDigest() for f in fields}
+
+    d0, d1 = grid(date_from, DAY, up=True), grid(date_to, DAY)
+    raw = [(date_from, date_to)]
+    if settings.rollup_reads and d0 < d1:
+        raw = [(date_from, d0), (d1, date_to)]
+        res = await db.execute(
+            select(SensorSketch.param, SensorSketch.digest)
+            .where(
+                SensorSketch.site_id == site_id, SensorSketch.param.in_(fields),
+                SensorSketch.day >= d0, SensorSketch.day < d1,
+            )
+        )
+        for param, digest in res.all():
+            digests[param].merge(TDigest.from_dict(digest))
+
+    conds = []
+    for lo, hi in raw:
+        end = SensorData.ts <= hi if inclusive_end and hi == date_to else SensorData.ts < hi
+        conds.append(and_(SensorData.ts >= lo, end))
+    result = await db.stream(
+        select(*(getattr(SensorData, f) for f in fields))
+        .where(SensorData.site_id == site_id, or_(*conds))
+        .execution_options(yield_per=5000)
+    )
+    async for part in result.partitions():
+        cols = np.array([tuple(r) for r in part], dtype=np.float64).reshape(len(part), len(fields))  # NULL -> nan
+        for i, f in enumerate(fields):
+            col = cols[:, i]
+            digests[f].add_many(col[~np.isnan(col)])
+    return digests
+
+
+async def rebuild_sketches(db: AsyncSession, site_id: int, lo: datetime, hi: datetime) -> int:
+    """Recompute the sketches of whole local days in [lo, hi) from sensor_data."""
+    await db.execute(
+        delete(SensorSketch)
+        .where(SensorSketch.site_id == site_id, SensorSketch.day >= lo, SensorSketch.day < hi)
+    )
+    written = 0
+    day = lo
+    while day < hi:
+        nxt = grid(day + timedelta(hours=36), DAY)
+        rows = (await db.execute(
+            select(*(getattr(SensorData, f) for f in SENSOR_FIELDS))
+            .where(SensorData.site_id == site_id, SensorData.ts >= day, SensorData.ts < nxt)
+        )).all()
+        if rows:
+            cols = np.array([tuple(r) for r in rows], dtype=np.float64).reshape(len(rows), len(SENSOR_FIELDS))
+            for i, f in enumerate(SENSOR_FIELDS):
+                col = cols[:, i]
+                col = col[~np.isnan(col)]
+                if col.size:
+                    d = TDigest()
+                    d.add_many(col)
+                    db.add(SensorSketch(site_id=site_id, day=day, param=f, count=int(col.size), digest=d.to_dict()))
+                    written += 1
+        day = nxt
+    await db.commit()
+    return written
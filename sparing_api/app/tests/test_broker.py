@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from app.core.broker import Broker, MemoryBridge, UnixSocketBridge, SlowConsumer
+
+
+def test_fan_out_between_brokers():
+    async def run():
+        hub = []
+        a, b = Broker(queue_max=8), Broker(queue_max=8)
+        a.start(MemoryBridge(hub))
+        b.start(MemoryBridge(hub))
+        sa, sb = a.subscribe("site:1"), b.subscribe("site:1")
+        other = b.subscribe("site:2")
+        a.publish("site:1", b"x")
+        assert await sa.get(0.1) == b"x"
+        assert await sb.get(0.1) == b"x"
+        assert await other.get(0.01) is None
+
+    asyncio.run(run())
+
+
+def test_slow_consumer_is_dropped():
+    async def run():
+        broker = Broker(queue_max=3)
+        slow, fast = broker.subscribe("t"), broker.subscribe("t")
+        for i in range(3):
+            broker.publish("t", b"%d" % i)
+            assert await fast.get(0.1) == b"%d" % i
+        broker.publish("t", b"3")
+        with pytest.raises(SlowConsumer):
+            await slow.get(0.1)
+        assert broker.subscribers("t") == 1
+        assert await fast.get(0.1) == b"3"
+
+    asyncio.run(run())
+
+
+def test_unix_socket_bridge(tmp_path):
+    async def run():
+        a, b = Broker(queue_max=8), Broker(queue_max=8)
+        a.start(UnixSocketBridge(str(tmp_path), "a.sock"))
+        b.start(UnixSocketBridge(str(tmp_path), "b.sock"))
+        sub = b.subscribe("site:1")
+        a.publish("site:1", b"reading")
+        assert await sub.get(1) == b"reading"
+        a.stop()
+        b.stop()
+        assert not list(tmp_path.iterdir())
+
+    asyncio.run(run())
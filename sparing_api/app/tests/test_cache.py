@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+from app.core.cache import Cache, TTLCache
+
+
+def _cache(max_entries: int = 100, max_bytes: int = 100_000) -> Cache:
+    return Cache(TTLCache(max_entries=max_entries, max_bytes=max_bytes))
+
+
+def test_lru_eviction_by_count_and_bytes():
+    async def run():
+        c = _cache(max_entries=3, max_bytes=10_000)
+        for k in "abc":
+            await c.set(f"ns:{k}", k)
+        assert await c.get("ns:a") == "a"        # a is now most recently used
+        await c.set("ns:d", "d")
+        assert await c.get("ns:b") is None
+        assert [await c.get(f"ns:{k}") for k in "acd"] == ["a", "c", "d"]
+        assert (await c.stats())["evictions"] == 1
+
+        small = _cache(max_bytes=1000)
+        await small.set("big:1", "x" * 300)
+        await small.set("big:2", "x" * 300)
+        await small.set("big:3", "x" * 300)
+        assert small.backend.bytes <= 1000 and await small.get("big:1") is None
+        await small.set("big:huge", "x" * 5000)   # larger than the whole cache: not stored
+        assert await small.get("big:huge") is None
+
+    asyncio.run(run())
+
+
+def test_expiry_sweep_and_stats():
+    async def run():
+        c = _cache()
+        await c.set("m:1", 1, ttl_seconds=0)
+        await c.set("m:2", 2, ttl_seconds=60)
+        await c.set("m:1", 1, ttl_seconds=0)     # rewrite leaves a stale deadline
+        time.sleep(0.001)
+        assert await c.cleanup_expired() == 1
+        assert await c.get("m:2") == 2
+        assert await c.get("m:1") is None
+        s = await c.stats()
+        assert (s["entries"], s["hits"], s["misses"], s["expirations"]) == (1, 1, 1, 1)
+
+    asyncio.run(run())
+
+
+def test_tag_and_prefix_invalidation():
+    async def run():
+        c = _cache()
+        await c.set("metrics:S1:a", 1, tags=("site:1",))
+        await c.set("metrics:S2:a", 2, tags=("site:2",))
+        await c.set("series:S1:a", 3, tags=("site:1",))
+        await c.set("series_lttb:S1:a", 4)
+        assert await c.invalidate("site:1") == 2
+        assert await c.get("metrics:S2:a") == 2
+        assert await c.invalidate_prefix("metrics:S2") == 1
+        assert await c.invalidate_prefix("series") == 1   # every namespace starting with it
+        s = await c.stats()
+        assert s["entries"] == 0 and s["bytes"] == 0 and s["tags"] == 0
+
+    asyncio.run(run())
+
+
+def test_concurrent_misses_share_one_computation():
+    async def run():
+        c = _cache()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"n": len(calls)}
+
+        waiters = [asyncio.create_task(c.get_or_compute("m:1", compute, 60)) for _ in range(10)]
+        await asyncio.sleep(0.01)
+        waiters[0].cancel()  # a client going away does not cancel the shared work
+        results = await asyncio.gather(*waiters[1:])
+        assert calls == [1] and all(r == {"n": 1} for r in results)
+        assert await c.get_or_compute("m:1", compute, 60) == {"n": 1}
+        s = await c.stats()
+        assert s["coalesced"] == 9 and s["misses"] == 1
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("db down")
+
+        outcomes = await asyncio.gather(*(c.get_or_compute("m:2", fail, 60) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(o, RuntimeError) for o in outcomes)
+        assert await c.get("m:2") is None
+
+    asyncio.run(run())
+
+
+def test_stale_while_revalidate_and_invalidation_during_compute():
+    async def run():
+        c = _cache()
+        version = [1]
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            return version[0]
+
+        await c.set("m:1", 0, ttl_seconds=0, stale_seconds=60)
+        assert await c.get_or_compute("m:1", compute, 60, stale_seconds=60) == 0   # stale, refresh started
+        assert await c.get_or_compute("m:1", compute, 60, stale_seconds=60) == 0   # still one refresh
+        await asyncio.sleep(0.03)
+        assert await c.get_or_compute("m:1", compute, 60) == 1
+        assert (await c.stats())["stale_hits"] == 2
+
+        version[0] = 2
+        task = asyncio.create_task(c.get_or_compute("m:2", compute, 60))
+        await asyncio.sleep(0)
+        await c.invalidate("m")  # data changed while computing: the result is not stored
+        assert await task == 2
+        assert await c.get("m:2") is None
+
+    asyncio.run(run())
+
+
+def test_invalidate_soon_batches_and_spares_other_tags():
+    async def run():
+        c = _cache()
+        await c.set("metrics:S1:a", 1, tags=("site:1",))
+        await c.set("metrics:S2:a", 2, tags=("site:2",))
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            return 3
+
+        task = asyncio.create_task(c.get_or_compute("series:S2:a", compute, 60, tags=("site:2",)))
+        await asyncio.sleep(0)
+        for _ in range(5):
+            c.invalidate_soon("site:1")   # a burst of ingest batches for site 1
+        assert await c.get("metrics:S1:a") == 1
+        assert await task == 3
+        await asyncio.sleep(0.3)
+        assert await c.get("metrics:S1:a") is None
+        assert await c.get("metrics:S2:a") == 2
+        assert await c.get("series:S2:a") == 3   # computed while another site was invalidated: kept
+
+    asyncio.run(run())
@@ -0,0 +1,182 @@
+import asyncio
+import fnmatch
+import time
+
+from app.core.cache import Cache
+from app.core.cache_backends import SqliteBackend, RespBackend, RespClient, RespError, _encode
+
+
+class StandInServer:
+    """Just enough of a Redis-protocol server for RespBackend, in-process."""
+
+    def __init__(self):
+        self.data: dict[bytes, object] = {}     # key -> bytes or {member: score}
+        self.expires: dict[bytes, float] = {}   # key -> epoch ms
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._client, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    def _alive(self, key: bytes) -> bool:
+        if key in self.expires and self.expires[key] <= time.time() * 1000:
+            self.data.pop(key, None)
+            self.expires.pop(key)
+        return key in self.data
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:])):
+                    n = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(n + 2))[:-2])
+                writer.write(self._reply(self._run(args[0].upper().decode(), args[1:])))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def _reply(self, v) -> bytes:
+        if isinstance(v, RespError):
+            return b"-%s\r\n" % str(v).encode()
+        if v is None:
+            return b"$-1\r\n"
+        if isinstance(v, int):
+            return b":%d\r\n" % v
+        if isinstance(v, str):
+            return b"+%s\r\n" % v.encode()
+        if isinstance(v, list):
+            return b"*%d\r\n" % len(v) + b"".join(self._reply(x) for x in v)
+        return b"$%d\r\n%s\r\n" % (len(v), v)
+
+    def _run(self, cmd: str, a: list[bytes]):
+        now = time.time() * 1000
+        if cmd == "GET":
+            return self.data[a[0]] if self._alive(a[0]) else None
+        if cmd == "SET":
+            self.data[a[0]] = a[1]
+            self.expires[a[0]] = now + int(a[3])
+            return "OK"
+        if cmd == "DEL":
+            return sum(self._alive(k) and self.data.pop(k, None) is not None for k in a)
+        if cmd == "ZADD":
+            self._alive(a[0])
+            self.data.setdefault(a[0], {})[a[2]] = float(a[1])
+            return 1
+        if cmd == "ZRANGE":
+            return sorted(self.data[a[0]], key=self.data[a[0]].get) if self._alive(a[0]) else []
+        if cmd == "ZREMRANGEBYSCORE":
+            if not self._alive(a[0]):
+                return 0
+            zset = self.data[a[0]]
+            gone = [m for m, score in zset.items() if score <= float(a[2])]
+            for m in gone:
+                del zset[m]
+            return len(gone)
+        if cmd == "EVAL":
+            # Only TAG_ADD is ever sent: ZADD, then extend the expiry if shorter
+            tag, score, member, keep = a[2], float(a[3]), a[4], int(a[5])
+            self._alive(tag)
+            self.data.setdefault(tag, {})[member] = score
+            if self.expires.get(tag, 0) < now + keep:
+                self.expires[tag] = now + keep
+            return 1
+        if cmd == "SCAN":
+            pattern = a[a.index(b"MATCH") + 1].decode()
+            return [b"0", [k for k in list(self.data) if self._alive(k) and fnmatch.fnmatchcase(k.decode(), pattern)]]
+        return RespError(f"ERR unknown command '{cmd}'")
+
+
+async def _exercise(backend) -> None:
+    c = Cache(backend)
+    await c.set("metrics:S1:a", {"x": [1, 2.5, None]}, tags=("site:1",))
+    await c.set("metrics:S2:a", 2, tags=("site:2",))
+    await c.set("series:S1:a", 3, tags=("site:1",))
+    await c.set("series_lttb:S1:a", 4)
+    assert await c.get("metrics:S1:a") == {"x": [1, 2.5, None]}
+    assert await c.invalidate("site:1") == 2
+    assert await c.get("metrics:S1:a") is None and await c.get("metrics:S2:a") == 2
+    assert await c.invalidate_prefix("metrics:S2") == 1
+    assert await c.invalidate_prefix("series") == 1        # every namespace starting with it
+    assert await c.get("series_lttb:S1:a") is None
+
+    async def compute():
+        return 5
+
+    await c.set("m:1", 1, ttl_seconds=0, stale_seconds=60)
+    assert await backend.lookup("m:1") == (1, False)      # expired, still servable stale
+    assert await c.get_or_compute("m:1", compute, 60, stale_seconds=60) == 1
+    await asyncio.sleep(0.05)
+    assert await c.get("m:1") == 5
+    await c.clear()
+    assert await c.get("m:1") is None
+    await backend.stop()
+
+
+def test_sqlite_backend(tmp_path):
+    asyncio.run(_exercise(SqliteBackend(str(tmp_path / "cache.sqlite"), max_entries=100, max_bytes=100_000)))
+
+
+def test_sqlite_backend_is_shared_and_bounded(tmp_path):
+    async def run():
+        path = str(tmp_path / "cache.sqlite")
+        a = SqliteBackend(path, max_entries=3, max_bytes=100_000)
+        b = SqliteBackend(path, max_entries=3, max_bytes=100_000)
+        for i in range(5):
+            await a.set(f"m:{i}", i, ttl_seconds=60 + i)
+        assert await b.lookup("m:4") == (4, True)         # written by one worker, read by another
+        await b.set("m:old", 0, ttl_seconds=0)
+        time.sleep(0.001)
+        assert await b.cleanup_expired() == 3              # the expired one, then the two closest to expiry
+        assert (await a.stats())["entries"] == 3 and await a.lookup("m:1") is None
+        await a.stop()
+        await b.stop()
+
+    asyncio.run(run())
+
+
+def test_resp_backend():
+    async def run():
+        server = StandInServer()
+        port = await server.start()
+        await _exercise(RespBackend(f"redis://127.0.0.1:{port}/0"))
+
+        backend = RespBackend(f"redis://127.0.0.1:{port}/0")
+        await backend.set("m:2", 2, ttl_seconds=0, tags=("site:1",))
+        await backend.set("m:3", 3, ttl_seconds=60, tags=("site:1",))
+        await asyncio.sleep(0.01)
+        await backend.cleanup_expired()                    # expired members leave the tag
+        assert server.data[b"sparing:tag:site:1"] == {b"m:3": server.data[b"sparing:tag:site:1"][b"m:3"]}
+        await backend.stop()
+        await server.stop()
+
+    asyncio.run(run())
+
+
+def test_resp_client_pipelines_and_reconnects():
+    async def run():
+        server = StandInServer()
+        port = await server.start()
+        client = RespClient("127.0.0.1", port, timeout=1.0)
+        replies = await asyncio.gather(*(client.execute("SET", f"k{i}", i, "PX", 60000) for i in range(20)))
+        assert replies == ["OK"] * 20
+        assert await client.pipeline([("GET", "k3"), ("GET", "missing"), ("DEL", "k3", "k4")]) == [b"3", None, 2]
+        try:
+            await client.execute("NOPE")
+            assert False
+        except RespError as e:
+            assert "unknown command" in str(e)
+        client._writer.close()            # connection drops: the next command reconnects
+        await asyncio.sleep(0.01)
+        assert await client.execute("GET", "k5") == b"5"
+        await client.close()
+        await server.stop()
+
+    asyncio.run(run())
+    assert _encode(("SET", "k", 1)) == b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1\r\n1\r\n"
@@ -0,0 +1,38 @@
+import numpy as np
+
+from app.services.compliance import Limit, evaluate, MAX_HOLD_SEC
+
+
+def _arrays(*readings):
+    ts, dev, vals = zip(*readings)
+    return np.array(ts, float), np.array(dev, float), np.array(vals, float)
+
+
+def test_counts_durations_and_worst():
+    # Device 1 every 60s, device 2 once; cod limit 100
+    ts, dev, vals = _arrays(
+        (0, 1, 90), (60, 1, 120), (120, 1, 130), (180, 1, 80), (240, 1, 150),
+        (30, 2, 99), (3000, 1, float("nan")),
+    )
+    r = evaluate(ts, dev, vals, Limit(None, 100.0), end=300)
+    assert r["readings"] == 6
+    assert r["exceedances"] == 3
+    assert r["episodes"] == 2
+    assert r["exceedance_sec"] == 60 + 60 + 60
+    assert r["observed_sec"] == 4 * 60 + 60 + 270
+    assert r["percent_compliant"] == 50.0
+    assert r["worst"]["value"] == 150 and r["worst"]["excess"] == 50 and r["worst"]["limit"] == 100
+
+
+def test_gaps_are_capped_and_min_limits():
+    ts, dev, vals = _arrays((0, 0, 5.5), (10000, 0, 7.0))
+    r = evaluate(ts, dev, vals, Limit(6.0, 9.0), end=10060)
+    assert r["observed_sec"] == MAX_HOLD_SEC + 60
+    assert r["exceedance_sec"] == MAX_HOLD_SEC
+    assert r["worst"]["limit"] == 6.0 and r["worst"]["excess"] == 0.5
+
+
+def test_no_readings():
+    empty = np.array([], float)
+    r = evaluate(empty, empty, empty, Limit(None, 10.0), end=0)
+    assert r["readings"] == 0 and r["percent_compliant"] is None and r["worst"] is None
@@ -0,0 +1,11 @@
+from datetime import datetime, timezone
+
+from app.utils.conditional import _not_modified_since
+
+
+def test_if_modified_since_zones():
+    modified = datetime(1994, 11, 6, 8, 49, 37, 500000, tzinfo=timezone.utc)
+    assert _not_modified_since("Sun, 06 Nov 1994 08:49:37 GMT", modified)
+    assert _not_modified_since("Sun, 06 Nov 1994 08:49:37 -0000", modified)
+    assert not _not_modified_since("Sun, 06 Nov 1994 08:49:36 -0000", modified)
+    assert not _not_modified_since("yesterday", modified)
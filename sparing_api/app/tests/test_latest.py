@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta, timezone
+
+from app.core.latest import LatestTable
+
+
+def _table(tmp_path, slots=64):
+    t = LatestTable(str(tmp_path / "latest"), slots)
+    t.open()
+    return t
+
+
+def _row(site_id, ts, device_id=None, **values):
+    return {"site_id": site_id, "device_id": device_id, "ts": ts, **values}
+
+
+def test_incomplete_slots_are_misses(tmp_path):
+    t = _table(tmp_path)
+    t.record([_row(1, datetime(2024, 1, 1), ph=7.0)], [10])
+    assert t.get(1) is None
+    t.record([_row(1, datetime(2023, 1, 1), ph=6.0)], [5], complete=True)
+    # The older database row completes the slot but does not replace the newer reading
+    hit = t.get(1)
+    assert hit["id"] == 10 and hit["ph"] == 7.0 and hit["tss"] is None
+
+
+def test_keeps_newest_per_site_and_device(tmp_path):
+    t = _table(tmp_path)
+    rows = [
+        _row(1, datetime(2024, 1, 2), device_id=3, cod=2.0),
+        _row(1, datetime(2024, 1, 3), device_id=4, cod=3.0),
+        _row(1, datetime(2024, 1, 1), device_id=3, cod=1.0),
+    ]
+    t.record(rows, [1, 2, 3], complete=True)
+    assert t.get(1)["cod"] == 3.0
+    assert t.get(1, 3)["ts"] == datetime(2024, 1, 2)
+    assert t.get(1, 4)["device_id"] == 4
+    assert t.get(2) is None
+
+
+def test_shared_between_mappings(tmp_path):
+    a, b = _table(tmp_path), _table(tmp_path)
+    a.record([_row(7, datetime(2024, 5, 1), ph=8.5)], [1], complete=True)
+    assert b.get(7)["ph"] == 8.5
+    # Colliding keys probe past each other
+    for site in range(8, 8 + 40):
+        b.record([_row(site, datetime(2024, 5, 1), ph=float(site))], [site], complete=True)
+    assert all(a.get(site)["ph"] == site for site in range(8, 8 + 40))
+
+
+def test_site_slot_keeps_the_reading_device(tmp_path):
+    t = _table(tmp_path)
+    t.record([_row(1, datetime(2024, 1, 1), device_id=5, ph=7.0)], [1], complete=True)
+    assert t.get(1)["device_id"] == 5 and t.get(1, 5)["device_id"] == 5
+    # A newer reading without a device replaces it; a late one from another device does not
+    t.record([_row(1, datetime(2024, 1, 2), ph=7.1), _row(1, datetime(2023, 1, 1), device_id=6, ph=6.0)], [2, 3])
+    assert t.get(1)["device_id"] is None and t.get(1)["id"] == 2
+
+
+def test_history_version_counts_batches_before_the_current_hour(tmp_path):
+    t = _table(tmp_path)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    t.record([_row(1, now, ph=7.0)], [1])
+    before = t.history_version(1)
+    t.record([_row(1, now, ph=7.1)], [2])
+    assert t.history_version(1) == before
+    t.record([_row(1, now - timedelta(hours=2), device_id=3, ph=6.0)], [3])
+    assert t.history_version(1) != before
+    assert t.history_version(2) is None
+
+
+def test_bump_site_changes_both_versions(tmp_path):
+    t = _table(tmp_path)
+    t.record([_row(1, datetime(2024, 1, 1), ph=7.0)], [1], complete=True)
+    data, history = t.data_version(1)[0], t.history_version(1)
+    t.bump_site(1)
+    t.bump_site(2)                      # no slot: nothing to retire
+    assert t.data_version(1)[0] != data and t.history_version(1) != history
+    assert t.get(1)["ph"] == 7.0 and t.data_version(2) is None
@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from app.core.latest import LatestTable
+from app.services import live
+
+
+def test_late_batch_is_not_pushed(tmp_path, monkeypatch):
+    table = LatestTable(str(tmp_path / "latest"), 64)
+    table.open()
+    sent = []
+    monkeypatch.setattr(live, "latest_readings", table)
+    monkeypatch.setattr(live.broker, "publish", lambda topic, frame: sent.append((topic, frame)))
+
+    def commit(rows, ids):
+        table.record(rows, ids)  # as readings_committed() does before publishing
+        live.publish_readings(rows, ids)
+
+    table.record([{"site_id": 1, "ts": datetime(2023, 6, 1)}], [1], complete=True)  # warm()
+    commit([{"site_id": 1, "ts": datetime(2024, 1, 2), "ph": 7.0}], [10])
+    commit([{"site_id": 1, "ts": datetime(2024, 1, 1), "ph": 6.0}, {"site_id": 1, "ts": datetime(2023, 1, 1)}], [11, 12])
+    commit([{"site_id": 1, "ts": datetime(2024, 1, 3), "ph": 7.2}], [13])
+    assert [frame.split(b"\n")[0] for _, frame in sent] == [b"id: 10", b"id: 13"]
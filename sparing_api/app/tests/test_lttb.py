@@ -0,0 +1,28 @@
+import numpy as np
+from app.utils.lttb import lttb, lttb_indices
+
+
+def test_short_series_returned_unchanged():
+    x = np.arange(10.0)
+    assert list(lttb_indices(x, x, 20)) == list(range(10))
+    assert list(lttb_indices(x, x, 2)) == list(range(10))
+
+
+def test_output_size_and_endpoints():
+    x = np.arange(100_000.0)
+    y = np.sin(x / 500)
+    idx = lttb_indices(x, y, 500)
+    assert len(idx) == 500
+    assert idx[0] == 0 and idx[-1] == len(x) - 1
+    assert np.all(np.diff(idx) > 0)
+
+
+def test_spikes_survive():
+    rng = np.random.default_rng(1)
+    x = np.arange(50_000.0)
+    y = 7 + rng.normal(0, 0.05, len(x))
+    y[12_345] = 12.0  # pH spike
+    y[40_000] = 2.0   # dip
+    xs, ys = lttb(x, y, 200)
+    assert 12.0 in ys and 2.0 in ys
+    assert 12_345 in xs and 40_000 in xs
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta, timezone
+
+from app.services.quality import QualityMonitor
+
+T0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _monitor(window=10):
+    return QualityMonitor(window=window, spike_z=6.0, stale_min_sec=900, flush_interval=60)
+
+
+def _rows(values, step=120, device_id=None, start=0):
+    return [
+        {"site_id": 1, "device_id": device_id, "ts": T0 + timedelta(seconds=(start + i) * step), "ph": v}
+        for i, v in enumerate(values)
+    ]
+
+
+def _kinds(m):
+    return [(f["kind"], f["param"], f["value"]) for f in m._pending]
+
+
+def test_spike_and_flatline():
+    m = _monitor()
+    m.observe(_rows([7.0, 7.1, 6.9, 7.05, 6.95, 7.0, 7.1, 6.9, 7.0, 7.05, 12.0, 7.0]))
+    assert _kinds(m) == [("spike", "ph", 12.0)]
+    m._pending.clear()
+    m.observe(_rows([7.3] * 25, start=12))
+    # Flagged once when the window fills with one value, not again while it stays
+    assert _kinds(m) == [("flatline", "ph", 7.3)]
+
+
+def test_window_stats_match_exact():
+    m = _monitor(window=8)
+    vals = [float(x * x % 17) for x in range(37)]
+    m.observe(_rows(vals))
+    w = vals[-8:]
+    mean = sum(w) / 8
+    assert abs(m._mean[0] - mean) < 1e-9
+    assert abs(m._m2[0] - sum((x - mean) ** 2 for x in w)) < 1e-6
+
+
+def test_stale_flagged_once_until_it_reports():
+    m = _monitor()
+    m.observe(_rows([7.0] * 3 + [7.1]))
+    last = (T0 + timedelta(seconds=3 * 120)).timestamp()
+    assert m.check_stale(last + 600) == 0     # 5 intervals = 600s, but at least 900s
+    assert m.check_stale(last + 901) == 1
+    assert m.check_stale(last + 5000) == 0
+    assert _kinds(m)[-1] == ("stale", "ph", None)
+    m.observe(_rows([7.0], start=50))
+    assert m.check_stale(last + 5000) == 0
+
+
+def test_late_readings_and_devices_are_separate():
+    m = _monitor()
+    m.observe(_rows([7.0, 7.1] * 6, device_id=1))
+    m.observe(_rows([20.0], device_id=1, start=2))   # older than the newest: ignored
+    m.observe(_rows([20.0], device_id=2, start=20))  # new stream, no history yet
+    assert m._pending == []
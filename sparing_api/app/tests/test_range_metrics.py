@@ -0,0 +1,43 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import orjson
+
+from app.services.range_metrics import Partial, closed_until
+from app.services.rollups import Agg, ROWS_PARAM
+from app.services.sketches import TDigest, quantiles
+
+
+def _partial(values) -> Partial:
+    agg, d = Agg(), TDigest()
+    for v in values:
+        agg.add(float(v))
+    d.add_many(values)
+    return Partial({"cod": agg, ROWS_PARAM: Agg(count=len(values))}, {"cod": d})
+
+
+def test_hourly_partials_merge_like_the_whole_range():
+    rng = np.random.default_rng(11)
+    hours = [rng.lognormal(3, 0.5, 30) for _ in range(24)]
+    merged = Partial({}, {})
+    for h in hours:
+        # Each closed hour goes through the cache as JSON before it is extended
+        merged = Partial.from_dict(orjson.loads(orjson.dumps(merged.to_dict())))
+        merged.merge(_partial(h))
+    whole = _partial(np.concatenate(hours))
+
+    a, b = merged.aggs["cod"], whole.aggs["cod"]
+    assert (a.count, a.min, a.max) == (b.count, b.min, b.max)
+    assert abs(a.avg - b.avg) < 1e-9 and merged.aggs[ROWS_PARAM].count == 720
+    values = np.concatenate(hours)
+    for name, q in (("p50", 0.5), ("p95", 0.95)):
+        exact = np.quantile(values, q)
+        assert abs(quantiles(merged.digests)["cod"][name] - exact) / exact < 0.02
+
+
+def test_closed_until_stops_at_the_last_closed_hour():
+    utc = timezone.utc
+    now = datetime(2024, 1, 2, 10, 25, tzinfo=utc)
+    assert closed_until(datetime(2024, 1, 2, 10, 25, tzinfo=utc), now) == datetime(2024, 1, 2, 10, tzinfo=utc)
+    assert closed_until(datetime(2024, 1, 3, tzinfo=utc), now) == datetime(2024, 1, 2, 10, tzinfo=utc)
+    assert closed_until(datetime(2024, 1, 1, 18, 40, tzinfo=utc), now) == datetime(2024, 1, 1, 18, tzinfo=utc)
@@ -0,0 +1,38 @@
+import numpy as np
+from app.services.sketches import TDigest
+
+
+def _digest(values):
+    d = TDigest()
+    for v in values:
+        d.add(float(v))
+    return d
+
+
+def test_quantiles_close_to_exact():
+    rng = np.random.default_rng(7)
+    values = rng.lognormal(3, 0.6, 50_000)  # skewed, like COD/TSS
+    d = TDigest()
+    d.add_many(values)
+    for q in (0.5, 0.95, 0.99):
+        exact = np.quantile(values, q)
+        assert abs(d.quantile(q) - exact) / exact < 0.01
+    assert d.count == len(values)
+    assert d.quantile(0) == values.min() and d.quantile(1) == values.max()
+
+
+def test_merge_matches_single_digest():
+    rng = np.random.default_rng(3)
+    days = [rng.normal(7 + i * 0.1, 0.3, 720) for i in range(30)]
+    merged = TDigest()
+    for day in days:
+        merged.merge(TDigest.from_dict(_digest(day).to_dict()))
+    values = np.concatenate(days)
+    for q in (0.5, 0.95, 0.99):
+        assert abs(merged.quantile(q) - np.quantile(values, q)) < 0.02
+    assert len(merged.means) < 300
+
+
+def test_empty_and_single():
+    assert TDigest().quantile(0.5) is None
+    assert _digest([4.2]).quantile(0.99) == 4.2
@@ -0,0 +1,65 @@
+"""
+Conditional GET helpers.
+
+Handlers derive a weak ETag from cheap version counters (see
+app.core.latest) plus everything else the body depends on, and answer
+304 before running their queries when the client already has it.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, Response
+
+
+def make_etag(*parts) -> str:
+    """Weak ETag over `parts` (versions, query parameters, viewer scope)."""
+    return 'W/"%s"' % hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def _http_date(dt: datetime) -> str:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return format_datetime(dt.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: W/ prefixes are ignored
+    want = etag.removeprefix("W/")
+    return any(t.strip().removeprefix("W/") == want for t in if_none_match.split(","))
+
+
+def _not_modified_since(if_modified_since: str, last_modified: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        # "-0000" parses to a naive datetime; it still means UTC
+        since = since.replace(tzinfo=timezone.utc)
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return last_modified.replace(microsecond=0) <= since
+
+
+def check_conditional(
+    request: Request, response: Response, etag: str, last_modified: datetime | None = None,
+) -> Response | None:
+    """
+    Set ETag/Last-Modified on `response` and return a 304 response if the
+    request's If-None-Match (or, without it, If-Modified-Since) matches.
+    """
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if last_modified is not None:
+        headers["Last-Modified"] = _http_date(last_modified)
+    response.headers.update(headers)
+
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        fresh = _matches(inm, etag)
+    else:
+        ims = request.headers.get("if-modified-since")
+        fresh = bool(ims and last_modified and _not_modified_since(ims, last_modified))
+    return Response(status_code=304, headers=headers) if fresh else None
@@ -0,0 +1,41 @@
+"""
+Opaque keyset cursors for time-ordered listings.
+
+A cursor names the (ts, id) of a boundary row plus the direction to read
+from it ("n" = continue in list order, "p" = go back towards the start) and
+the list order it was issued for. It is base64url JSON so clients treat it
+as a token.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import NamedTuple
+
+from fastapi import HTTPException
+
+
+class Cursor(NamedTuple):
+    ts: datetime
+    id: int
+    forward: bool
+    desc: bool
+
+
+def encode_cursor(ts: datetime, row_id: int, *, forward: bool, desc: bool) -> str:
+    raw = json.dumps(
+        {"t": ts.isoformat(), "i": row_id, "d": "n" if forward else "p", "o": "d" if desc else "a"},
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Cursor:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        d = json.loads(raw)
+        return Cursor(
+            ts=datetime.fromisoformat(d["t"]), id=int(d["i"]),
+            forward=d["d"] == "n", desc=d["o"] == "d",
+        )
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(400, "Invalid cursor")
@@ -1,7 +1,80 @@
+import math
 from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ColumnElement
+from sqlalchemy.sql.visitors import InternalTraversal
+from sqlalchemy.types import Integer
+
+from app.core.config import settings
+
+# Chart/series bucket widths, in seconds
+INTERVALS = {"5m": 300, "1h": 3600, "1d": 86400}
+
+local_tz = ZoneInfo(settings.tz)
+
+
 def to_utc(dt: datetime | None):
     if dt is None:
         return datetime.now(timezone.utc)
     if dt.tzinfo is None:
         return dt.replace(tzinfo=timezone.utc)
     return dt.astimezone(timezone.utc)
+
+
+def utc_offset_seconds(at: datetime) -> int:
+    """Offset of settings.tz from UTC at `at` (fixed for Asia/Jakarta)."""
+    return int(local_tz.utcoffset(to_utc(at).replace(tzinfo=None)).total_seconds())
+
+
+def grid(dt: datetime, step: int, up: bool = False) -> datetime:
+    """`dt` rounded down (or up) to a `step`-second boundary in settings.tz."""
+    dt = to_utc(dt)
+    offset = utc_offset_seconds(dt)
+    local = dt.timestamp() + offset
+    idx = math.ceil(local / step) if up else math.floor(local / step)
+    return datetime.fromtimestamp(idx * step - offset, timezone.utc)
+
+
+def bucket_start(index: int, step: int, offset: int) -> datetime:
+    """Local-time start of bucket `index` as returned by time_bucket()."""
+    return datetime.fromtimestamp(index * step - offset, timezone.utc).astimezone(local_tz)
+
+
+class time_bucket(ColumnElement):
+    """
+    Integer index of the `step`-second bucket holding `ts`, with bucket
+    edges aligned to local midnight via `offset` seconds east of UTC.
+    Stored timestamps are naive UTC; the epoch is taken per dialect.
+    """
+    type = Integer()
+    inherit_cache = True
+    _traverse_internals = [
+        ("ts", InternalTraversal.dp_clauseelement),
+        ("step", InternalTraversal.dp_plain_obj),
+        ("offset", InternalTraversal.dp_plain_obj),
+    ]
+
+    def __init__(self, ts, step: int, offset: int):
+        self.ts = ts
+        self.step = int(step)
+        self.offset = int(offset)
+
+
+@compiles(time_bucket, "mysql")
+def _bucket_mysql(el, compiler, **kw):
+    ts = compiler.process(el.ts, **kw)
+    return f"((TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', {ts}) + {el.offset}) DIV {el.step})"
+
+
+@compiles(time_bucket, "sqlite")
+def _bucket_sqlite(el, compiler, **kw):
+    ts = compiler.process(el.ts, **kw)
+    return f"((CAST(strftime('%s', {ts}) AS INTEGER) + {el.offset}) / {el.step})"
+
+
+@compiles(time_bucket)
+def _bucket_default(el, compiler, **kw):
+    ts = compiler.process(el.ts, **kw)
+    return f"FLOOR((EXTRACT(EPOCH FROM {ts}) + {el.offset}) / {el.step})"
@@ -0,0 +1,64 @@
+"""
+Event-loop latency during a login storm.
+
+Fires CONCURRENCY password verifications at once, the way a burst of
+/auth/login requests would, while a ticker task measures how late the event
+loop wakes it up (what every concurrent ingest request would feel). Runs the
+storm twice: argon2 called inline, as the handlers used to, and through the
+hashing pool (`verify_password_async`).
+
+Usage (from sparing_api/):
+    python -m benchmarks.login_storm [concurrency]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from app.core.security import hash_password, verify_password, verify_password_async
+
+TICK = 0.005
+
+
+async def _ticker(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - t - TICK)
+
+
+async def _inline(pw, h):
+    # What the handlers did before: argon2 straight on the event loop
+    return verify_password(pw, h)
+
+
+async def _storm(verify, n: int, h: str) -> tuple[list, float]:
+    lags: list[float] = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(lags, stop))
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    await asyncio.gather(*(verify("Admin#123", h) for _ in range(n)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    return lags, elapsed
+
+
+def _report(name: str, lags: list, elapsed: float) -> None:
+    ms = sorted(x * 1000 for x in lags)
+    p99 = ms[min(len(ms) - 1, int(len(ms) * 0.99))]
+    print(
+        f"{name:<10} storm={elapsed * 1000:7.1f}ms  loop lag p50={statistics.median(ms):6.2f}ms "
+        f"p99={p99:7.2f}ms  max={ms[-1]:7.2f}ms  ticks={len(ms)}"
+    )
+
+
+async def main(n: int):
+    h = hash_password("Admin#123")
+    _report("inline", *await _storm(_inline, n, h))
+    _report("offloaded", *await _storm(verify_password_async, n, h))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 32))
@@ -5,6 +5,7 @@ import random
 from app.core.db import SessionLocal, engine
 from app.models.models import User, Site, ViewerSite, SensorDevice, SensorData
 from app.core.security import hash_password
+from app.services.rollups import rebuild
 
 async def main():
     async with SessionLocal() as db:
@@ -43,6 +44,8 @@ async def main():
                     db.add(sd)
         await db.commit()
 
+    await rebuild()
+
     # penting: tutup pool/engine sebelum loop ditutup
     await engine.dispose()
     print("Seed done")